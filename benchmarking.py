@@ -0,0 +1,1575 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Замеры производительности отдельных частей системы.
+В качестве нагрузки используются вопросы из тестов по кубам и Минфину.
+
+Пример запуска:
+python3 benchmarking.py solr-payload
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import listdir, path
+from socketserver import ThreadingMixIn
+from statistics import median
+from urllib.parse import parse_qs
+import argparse
+import copy
+import datetime
+import itertools
+import json
+import logging
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from config import QUERY_DB_PATH, SETTINGS, TEST_PATH_CUBE, TEST_PATH_MINFIN
+from config import TECH_CUBE_DOCS_FILE, TECH_MINFIN_DOCS_FILE
+import logs_helper  # pylint: disable=unused-import
+
+
+def read_test_cases(test_path: str):
+    """Пары (запрос, результат) из тестовых файлов вида Запрос:Результат"""
+
+    cases = []
+    for file_name in sorted(listdir(test_path)):
+        with open(path.join(test_path, file_name), encoding='utf-8-sig') as file_in:
+            for line in file_in:
+                line = ' '.join(line.split())
+                if not line or line.startswith('*'):
+                    continue
+                parts = line.split(':')
+                cases.append((':'.join(parts[:-1]), parts[-1]))
+    return cases
+
+
+def read_test_questions(test_path: str):
+    """Вопросы из тестовых файлов вида Запрос:Результат"""
+
+    return [question for question, _ in read_test_cases(test_path)]
+
+
+def percentile(values: list, per: float):
+    """Перцентиль по уже отсортированной выборке"""
+
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * per / 100.))]
+
+
+def timed_map(func, cases):
+    """Результаты func для всех cases и суммарное время в секундах"""
+
+    start = time.monotonic()
+    results = [func(case) for case in cases]
+    return results, time.monotonic() - start
+
+
+def count_mismatches(cases, expected: list, actual: list, label=str):
+    """
+    Сравнение результатов прежней и новой реализации на одних и тех же
+    входах. Каждое расхождение выводится с подписью label(case).
+    Возвращает количество расхождений
+    """
+
+    mismatches = 0
+    for case, case_expected, case_actual in zip(cases, expected, actual):
+        if case_expected != case_actual:
+            mismatches += 1
+            print('Расхождение: {}'.format(label(case)))
+    return mismatches
+
+
+def print_report(title: str, report: dict):
+    """Вывод результатов замера"""
+
+    print('{}: {}'.format(title, json.dumps(report, indent=4, ensure_ascii=False)))
+
+
+def bench_solr_payload(args):
+    """
+    Размер ответа Solr и время декодирования JSON:
+    один запрос fl=*,score на solr_documents_to_return строк против
+    запросов по типам документов с их полями и бюджетами строк
+    """
+
+    from core.solr import Solr
+    from data_retrieving import DataRetrieving
+
+    solr = Solr.inst()
+    core = SETTINGS.SOLR_MAIN_CORE
+
+    for test_set, test_path in (('cube', TEST_PATH_CUBE), ('minfin', TEST_PATH_MINFIN)):
+        questions = read_test_questions(test_path)[:args.limit or None]
+
+        modes = {'before': [], 'after': []}
+        for question in questions:
+            norm_question = DataRetrieving._preprocess_user_request(
+                question, 'benchmark')
+
+            _, stats = solr.select(core, Solr.search_params(norm_question))
+            modes['before'].append(stats)
+
+            _, stats = solr._select_by_doc_type(core, norm_question)
+            modes['after'].append(stats)
+
+        report = {}
+        for mode, all_stats in modes.items():
+            sizes = sorted(stats['bytes'] for stats in all_stats)
+            decodes = sorted(stats['decode_seconds'] for stats in all_stats)
+            report[mode] = {
+                'requests': len(all_stats),
+                'bytes_total': sum(sizes),
+                'bytes_median': median(sizes) if sizes else 0,
+                'decode_seconds_total': sum(decodes),
+                'decode_seconds_p50': percentile(decodes, 50),
+                'decode_seconds_p99': percentile(decodes, 99),
+            }
+
+        print_report('Solr payload, {}'.format(test_set), report)
+
+
+def bench_tech_join(args):
+    """
+    Время присоединения технической информации к найденным документам
+    на один запрос: линейный поиск по списку против индекса по inner_id
+    """
+
+    import core.support_library as csl
+
+    # столько документов в худшем случае возвращает Solr на запрос
+    hits_per_query = 200
+    queries = args.limit or 100
+
+    tech_files = (
+        ('cube', TECH_CUBE_DOCS_FILE),
+        ('minfin', path.join(SETTINGS.PATH_TO_MINFIN_ATTACHMENTS, TECH_MINFIN_DOCS_FILE)),
+    )
+
+    for doc_type, tech_file in tech_files:
+        with open(tech_file, 'r', encoding='utf-8') as file:
+            data = json.loads(file.read())
+
+        start = time.monotonic()
+        index = csl._index_tech_data(data)
+        build_seconds = time.monotonic() - start
+
+        inner_ids = [doc['inner_id'] for doc in data]
+        hits = [
+            [{'inner_id': random.choice(inner_ids)} for _ in range(hits_per_query)]
+            for _ in range(queries)
+        ]
+
+        start = time.monotonic()
+        for query_hits in hits:
+            for found_doc in query_hits:
+                needed_doc = [
+                    doc for doc in data
+                    if doc['inner_id'] == found_doc['inner_id']
+                ]
+                for key, value in needed_doc[0].items():
+                    found_doc[key] = value
+        linear_seconds = time.monotonic() - start
+
+        start = time.monotonic()
+        for query_hits in hits:
+            for found_doc in query_hits:
+                found_doc.update(index[found_doc['inner_id']])
+        index_seconds = time.monotonic() - start
+
+        print_report('Tech join, {}'.format(doc_type), {
+            'tech_docs': len(data),
+            'hits_per_query': hits_per_query,
+            'index_build_seconds': build_seconds,
+            'linear_seconds_per_query': linear_seconds / queries,
+            'index_seconds_per_query': index_seconds / queries,
+        })
+
+
+def prepare_cube_data(limit: int):
+    """
+    Данные для дерева решений по вопросам тестов по кубам,
+    подготовленные так же, как в CubeProcessor.get_data
+    """
+
+    from core.solr import Solr
+    from core.support_library import group_documents
+    import core.support_library as csl
+    from data_retrieving import DataRetrieving
+
+    prepared = []
+    for question in read_test_questions(TEST_PATH_CUBE)[:limit or None]:
+        norm_question = DataRetrieving._preprocess_user_request(
+            question, 'benchmark')
+        docs = Solr.inst().get_data(
+            norm_question, 'benchmark', SETTINGS.SOLR_MAIN_CORE)['response']['docs']
+        _, cube_data = group_documents(docs, question, norm_question, 'benchmark')
+
+        csl.check_real_bglevel_existence(cube_data)
+        csl.preprocess_bglevels_member(cube_data)
+        csl.check_real_territory_existence(cube_data)
+        prepared.append(cube_data)
+
+    return prepared
+
+
+def bench_tree_paths(args):
+    """
+    Память и время прогона путей дерева решений по вопросам
+    тестов по кубам: глубокая копия CubeData на путь против
+    копирования при записи
+    """
+
+    from core.cube_docs_processing import CubeProcessor
+    from core.support_library import CubeData
+
+    def deepcopy_cube_data(cube_data):
+        return copy.deepcopy(cube_data)
+
+    prepared = prepare_cube_data(args.limit)
+
+    modes = (('before', deepcopy_cube_data), ('after', CubeData.copy))
+    report = {}
+    cube_data_copy = CubeData.copy
+
+    try:
+        for mode, copy_method in modes:
+            CubeData.copy = copy_method
+
+            seconds, retained, peaks = [], [], []
+            for cube_data in prepared:
+                tracemalloc.start()
+                start = time.monotonic()
+                cube_data_list = CubeProcessor._get_several_cube_answers(cube_data)
+                seconds.append(time.monotonic() - start)
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                retained.append(current)
+                peaks.append(peak)
+                del cube_data_list
+
+            seconds.sort()
+            report[mode] = {
+                'requests': len(prepared),
+                'seconds_total': sum(seconds),
+                'seconds_p50': percentile(seconds, 50),
+                'seconds_p99': percentile(seconds, 99),
+                'retained_bytes_median': median(retained) if retained else 0,
+                'peak_bytes_median': median(peaks) if peaks else 0,
+                'peak_bytes_max': max(peaks, default=0),
+            }
+    finally:
+        CubeData.copy = cube_data_copy
+
+    print_report('Tree paths', report)
+
+
+def bench_tree_trie(args):
+    """
+    Исполнение путей дерева решений по одному пути от корня против
+    обхода префиксного дерева путей. Результаты обоих способов
+    сравниваются по всем вопросам тестов по кубам
+    """
+
+    from core.cube_docs_processing import CubeProcessor
+    from core.graph import Graph
+    from core.support_library import FunctionExecutionError
+    from core.support_library import FunctionExecutionErrorNoMembers
+    from model_manager import MODEL_CONFIG
+
+    tree = Graph.inst(MODEL_CONFIG['tree_k_path_threshold'])
+
+    def run_path_by_path(cube_data):
+        cube_data_list = []
+        for tree_path in tree.tree_paths:
+            cube_data_copy = cube_data.copy()
+            cube_data_copy.tree_path = tree_path
+            try:
+                for node_id in tree_path:
+                    tree.node[node_id]['function'](cube_data_copy)
+                cube_data_list.append(cube_data_copy)
+            except FunctionExecutionErrorNoMembers:
+                cube_data_list.append(cube_data_copy)
+            except FunctionExecutionError:
+                pass
+        return cube_data_list
+
+    prepared = prepare_cube_data(args.limit)
+
+    seconds, results = {}, {}
+    for mode, run in (('path_by_path', run_path_by_path),
+                      ('trie', CubeProcessor._get_several_cube_answers)):
+        results[mode], seconds[mode] = timed_map(run, prepared)
+
+    mismatches = count_mismatches(
+        prepared,
+        [[vars(item) for item in items] for items in results['path_by_path']],
+        [[vars(item) for item in items] for items in results['trie']],
+        label=lambda cube_data: cube_data.user_request
+    )
+
+    print_report('Tree trie', {
+        'requests': len(prepared),
+        'mismatches': mismatches,
+        'seconds_path_by_path': seconds['path_by_path'],
+        'seconds_trie': seconds['trie'],
+    })
+
+
+def bench_answer_cache(args):
+    """
+    Время ответа DataRetrieving.get_data на вопросы тестов
+    без кеша ответов и с ним. Вопросы прогоняются дважды,
+    как повторяющиеся запросы пользователей
+    """
+
+    from core.answer_cache import AnswerCache
+    from data_retrieving import DataRetrieving
+
+    questions = (
+        read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+        read_test_questions(TEST_PATH_MINFIN)[:args.limit or None]
+    )
+
+    answer_cache = AnswerCache.inst()
+    enabled = answer_cache.enabled
+
+    report = {}
+    try:
+        for mode, use_cache in (('without_cache', False), ('with_cache', True)):
+            answer_cache.enabled = use_cache
+            answer_cache.invalidate()
+            hits_before = answer_cache.stats()['hits']
+
+            seconds = []
+            for _ in range(2):
+                for question in questions:
+                    start = time.monotonic()
+                    DataRetrieving.get_data(question, 'benchmark')
+                    seconds.append(time.monotonic() - start)
+
+            seconds.sort()
+            report[mode] = {
+                'requests': len(seconds),
+                'hit_ratio': (answer_cache.stats()['hits'] - hits_before) / len(seconds),
+                'seconds_p50': percentile(seconds, 50),
+                'seconds_p99': percentile(seconds, 99),
+            }
+    finally:
+        answer_cache.enabled = enabled
+
+    print_report('Answer cache', report)
+
+
+def bench_batch(args):
+    """
+    Пропускная способность (вопросов в секунду) на вопросах тестов:
+    DataRetrieving.get_data в цикле против get_data_batch пакетами
+    """
+
+    from core.answer_cache import AnswerCache
+    from data_retrieving import DataRetrieving
+
+    batch_size = 32
+    questions = (
+        read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+        read_test_questions(TEST_PATH_MINFIN)[:args.limit or None]
+    )
+    request_ids = ['benchmark'] * len(questions)
+
+    def run_single():
+        for question in questions:
+            DataRetrieving.get_data(question, 'benchmark')
+
+    def run_batch():
+        for start in range(0, len(questions), batch_size):
+            DataRetrieving.get_data_batch(
+                questions[start:start + batch_size],
+                request_ids[start:start + batch_size]
+            )
+
+    # кеш ответов сделал бы второй прогон бесплатным
+    answer_cache = AnswerCache.inst()
+    enabled, answer_cache.enabled = answer_cache.enabled, False
+
+    report = {}
+    try:
+        for mode, run in (('single', run_single), ('batch', run_batch)):
+            start = time.monotonic()
+            run()
+            seconds = time.monotonic() - start
+
+            report[mode] = {
+                'questions': len(questions),
+                'seconds': seconds,
+                'questions_per_second': len(questions) / seconds if seconds else 0,
+            }
+    finally:
+        answer_cache.enabled = enabled
+
+    report['batch']['batch_size'] = batch_size
+    print_report('Batch API', report)
+
+
+def bench_classifier(args):
+    """
+    Время классификации 1, 32 и 1024 запросов: predict_proba по одному
+    запросу в цикле против одного вызова predict_proba_batch
+    """
+
+    from core.cube_classifier import CubeClassifier
+    from core.cube_or_minfin_classifier import CubeOrMinfinClassifier
+
+    questions = (
+        read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+        read_test_questions(TEST_PATH_MINFIN)[:args.limit or None]
+    )
+
+    classifiers = (
+        ('cube', CubeClassifier.inst()),
+        ('cube_or_minfin', CubeOrMinfinClassifier.inst()),
+    )
+
+    for clf_name, clf in classifiers:
+        report = {}
+        for size in (1, 32, 1024):
+            reqs = [questions[idx % len(questions)] for idx in range(size)]
+
+            start = time.monotonic()
+            for req in reqs:
+                clf.predict_proba(req, top_k=1)
+            loop_seconds = time.monotonic() - start
+
+            start = time.monotonic()
+            clf.predict_proba_batch(reqs, top_k=1)
+            batch_seconds = time.monotonic() - start
+
+            report[size] = {
+                'loop_seconds': loop_seconds,
+                'batch_seconds': batch_seconds,
+            }
+
+        print_report('Classifier, {}'.format(clf_name), report)
+
+
+class StubMdxServer(ThreadingMixIn, HTTPServer):
+    """
+    Локальная заглушка сервера MDX-запросов: отвечает с задержкой,
+    данных нет для запросов, оканчивающихся на нечетную цифру
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.requests_count = 0
+        super().__init__(('127.0.0.1', 0), StubMdxHandler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/mdxexpert/CellsetByMdx'.format(self.server_port)
+
+
+class StubMdxHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов заглушки сервера MDX-запросов"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers['Content-Length'])
+        mdx_query = parse_qs(self.rfile.read(length).decode())['mdxQuery'][0]
+
+        self.server.requests_count += 1
+        time.sleep(self.server.delay)
+
+        value = None if int(mdx_query[-1]) % 2 else 42
+        body = json.dumps({'cells': [[{'value': value}]]}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def bench_mdx_checks(args):
+    """
+    Проверка наличия данных у кандидатов в ответы по кубам и получение
+    главного ответа на локальной заглушке сервера: последовательные
+    запросы без пула соединений против параллельных с переиспользованием
+    полученного значения
+    """
+
+    import requests
+
+    from core.mdx_server import MdxCache, MdxServer
+    from core.support_library import CubeData, mdx_cell_value
+    import core.support_library as csl
+
+    delay = 0.1
+    candidates = 10
+    rounds = args.limit or 10
+
+    stub = StubMdxServer(delay)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    def make_candidates():
+        cube_data_list = []
+        for idx in range(candidates):
+            cube_data = CubeData(request_id='benchmark')
+            cube_data.selected_cube = {'cube': 'CLDO01'}
+            cube_data.mdx_query = 'SELECT {}'.format(idx)
+            cube_data_list.append(cube_data)
+        return cube_data_list
+
+    def run_sequential():
+        cube_data_list = make_candidates()
+        for cube_data in list(cube_data_list):
+            response = requests.post(stub.url, {
+                'dataMartCode': cube_data.selected_cube['cube'],
+                'mdxQuery': cube_data.mdx_query
+            })
+            if mdx_cell_value(response) is None:
+                cube_data_list.remove(cube_data)
+
+        # повторный запрос для главного ответа
+        requests.post(stub.url, {
+            'dataMartCode': cube_data_list[0].selected_cube['cube'],
+            'mdxQuery': cube_data_list[0].mdx_query
+        })
+
+    def run_parallel():
+        # без кеша результатов, иначе сервер вызывается только в первом раунде
+        mdx_server.cache = MdxCache(file_path=None)
+
+        cube_data_list = make_candidates()
+        csl.filter_cube_data_without_answer(cube_data_list)
+
+        if cube_data_list[0].mdx_value is None:
+            MdxServer.inst().cellset(
+                cube_data_list[0].mdx_query,
+                cube_data_list[0].selected_cube['cube']
+            )
+
+    mdx_server = MdxServer.inst()
+    server_url, mdx_server.url = mdx_server.url, stub.url
+    server_cache = mdx_server.cache
+
+    report = {}
+    try:
+        for mode, run in (('sequential', run_sequential), ('parallel', run_parallel)):
+            stub.requests_count = 0
+            seconds = []
+            for _ in range(rounds):
+                start = time.monotonic()
+                run()
+                seconds.append(time.monotonic() - start)
+
+            seconds.sort()
+            report[mode] = {
+                'rounds': rounds,
+                'server_delay': delay,
+                'requests_per_round': stub.requests_count / rounds,
+                'seconds_p50': percentile(seconds, 50),
+                'seconds_p99': percentile(seconds, 99),
+            }
+    finally:
+        mdx_server.url = server_url
+        mdx_server.cache = server_cache
+        stub.shutdown()
+
+    print_report('MDX existence checks', report)
+
+
+def prepare_cube_candidates(limit: int):
+    """
+    Варианты ответов по кубам (MDX-запрос и вопрос) для вопросов
+    тестов по кубам, собранные так же, как в CubeProcessor.get_data,
+    но без проверки наличия данных
+    """
+
+    from core.cube_docs_processing import CubeProcessor
+    import core.support_library as csl
+
+    candidates = []
+    for cube_data in prepare_cube_data(limit):
+        cube_data_list = CubeProcessor._get_several_cube_answers(cube_data)
+        if not cube_data_list:
+            continue
+
+        for item in cube_data_list:
+            csl.select_measure_for_selected_cube(item)
+            csl.preprocess_territory_member(item)
+            csl.score_cube_question(item)
+
+        cube_data_list = CubeProcessor._take_best_cube_data(cube_data_list, None)
+
+        for item in cube_data_list:
+            csl.process_with_members(item)
+            csl.process_with_member_for_territory(item)
+            csl.process_default_members(item)
+            csl.process_default_measures(item)
+            csl.create_mdx_query(item)
+
+        csl.delete_repetitions(cube_data_list)
+
+        candidates.extend(
+            (item.mdx_query, item.user_request) for item in cube_data_list)
+
+    return candidates
+
+
+def bench_kb_feedback(args):
+    """
+    Время form_feedback на один вариант ответа по кубам:
+    запросы к базе знаний через peewee против снимка в памяти
+    """
+
+    import core.support_library as csl
+    import kb.kb_db_creation as dbc
+    import kb.kb_support_library as kbsl
+
+    def caption_for_measure(cube_value, cube_name):
+        return (dbc.Measure
+                .select(dbc.Measure.caption)
+                .join(dbc.CubeMeasure)
+                .join(dbc.Cube)
+                .where(dbc.Measure.cube_value == cube_value, dbc.Cube.name == cube_name)
+                )[0].caption
+
+    def cube_caption(cube_name):
+        return dbc.Cube.get(dbc.Cube.name == cube_name).caption
+
+    def captions_for_dimensions(cube_value, cube_name):
+        member = (dbc.Member
+                  .select()
+                  .join(dbc.DimensionMember)
+                  .join(dbc.Dimension)
+                  .join(dbc.CubeDimension)
+                  .join(dbc.Cube)
+                  .where(dbc.Member.cube_value == cube_value, dbc.Cube.name == cube_name)
+                  )[0]
+
+        dimension = (dbc.Dimension
+                     .select()
+                     .join(dbc.DimensionMember)
+                     .join(dbc.Member)
+                     .where(dbc.Member.id == member.id)
+                     )[0]
+
+        return {'dimension_caption': dimension.caption,
+                'member_caption': member.caption}
+
+    candidates = prepare_cube_candidates(args.limit)
+
+    start = time.monotonic()
+    kbsl.reload_kb_snapshot()
+    kbsl.kb_snapshot()
+    snapshot_seconds = time.monotonic() - start
+
+    getters = ('get_caption_for_measure', 'get_cube_caption', 'get_captions_for_dimensions')
+    snapshot_getters = {name: getattr(csl, name) for name in getters}
+    peewee_getters = {
+        'get_caption_for_measure': caption_for_measure,
+        'get_cube_caption': cube_caption,
+        'get_captions_for_dimensions': captions_for_dimensions,
+    }
+
+    report = {'snapshot_build_seconds': snapshot_seconds}
+    feedbacks = {}
+    try:
+        for mode, mode_getters in (('before', peewee_getters), ('after', snapshot_getters)):
+            for name, getter in mode_getters.items():
+                setattr(csl, name, getter)
+
+            seconds, feedbacks[mode] = [], []
+            for mdx_query, user_request in candidates:
+                start = time.monotonic()
+                feedbacks[mode].append(csl.form_feedback(mdx_query, user_request))
+                seconds.append(time.monotonic() - start)
+
+            seconds.sort()
+            report[mode] = {
+                'candidates': len(candidates),
+                'seconds_p50': percentile(seconds, 50),
+                'seconds_p99': percentile(seconds, 99),
+                'seconds_mean': sum(seconds) / len(seconds) if seconds else 0,
+            }
+    finally:
+        for name, getter in snapshot_getters.items():
+            setattr(csl, name, getter)
+
+    report['mismatches'] = count_mismatches(
+        candidates, feedbacks['before'], feedbacks['after'],
+        label=lambda candidate: candidate[1])
+
+    print_report('KB feedback', report)
+
+
+def bench_db_concurrency(args):
+    """
+    Поиск элементов в базе знаний из нескольких потоков во время
+    записи журнала запросов: настройки SQLite по умолчанию против
+    общих подключений с WAL и базой знаний только на чтение
+    """
+
+    from peewee import OperationalError
+
+    from utils.database import reopen_database
+    import dbs.query_db as query_db
+    import kb.kb_db_creation as dbc
+
+    lookups_per_thread = args.limit or 500
+    threads = args.threads
+    kb_path = SETTINGS.PATH_TO_KNOWLEDGEBASE
+
+    member_values = [row.cube_value for row in dbc.Member.select(dbc.Member.cube_value)]
+
+    def default_database(database, file_path, read_only):
+        database.init(file_path)
+
+    def lookup(lookup_seconds, errors):
+        for _ in range(lookups_per_thread):
+            value = random.choice(member_values)
+            start = time.monotonic()
+            try:
+                (dbc.Member
+                 .select()
+                 .join(dbc.DimensionMember)
+                 .join(dbc.Dimension)
+                 .where(dbc.Member.cube_value == value)
+                 )[0]
+            except OperationalError:
+                errors.append(1)
+            lookup_seconds.append(time.monotonic() - start)
+        dbc.database.close()
+
+    def write_log(stop, write_seconds, errors):
+        while not stop.is_set():
+            start = time.monotonic()
+            try:
+                query_db.save_queries([{
+                    'date': datetime.datetime.now(),
+                    'request_id': 'benchmark',
+                    'user_id': 'benchmark',
+                    'user_name': None,
+                    'platform': 'benchmark',
+                    'query': 'вопрос',
+                    'query_type': 'text',
+                }])
+            except OperationalError:
+                errors.append(1)
+            write_seconds.append(time.monotonic() - start)
+        query_db._database.close()
+
+    report = {'threads': threads, 'lookups_per_thread': lookups_per_thread}
+    temp_dir = tempfile.mkdtemp()
+
+    try:
+        for mode, open_database in (('before', default_database), ('after', reopen_database)):
+            query_log_path = path.join(temp_dir, '{}.db'.format(mode))
+            open_database(dbc.database, kb_path, True)
+            open_database(query_db._database, query_log_path, False)
+            query_db._is_inited = False
+            query_db._init_db()
+
+            lookup_seconds, write_seconds, errors = [], [], []
+            stop = threading.Event()
+            writer = threading.Thread(target=write_log, args=(stop, write_seconds, errors))
+            readers = [
+                threading.Thread(target=lookup, args=(lookup_seconds, errors))
+                for _ in range(threads)
+            ]
+
+            start = time.monotonic()
+            writer.start()
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+            seconds = time.monotonic() - start
+            stop.set()
+            writer.join()
+
+            lookup_seconds.sort()
+            write_seconds.sort()
+            report[mode] = {
+                'lookups_per_second': len(lookup_seconds) / seconds if seconds else 0,
+                'lookup_seconds_p50': percentile(lookup_seconds, 50),
+                'lookup_seconds_p99': percentile(lookup_seconds, 99),
+                'writes': len(write_seconds),
+                'write_seconds_p50': percentile(write_seconds, 50),
+                'write_seconds_p99': percentile(write_seconds, 99),
+                'errors': len(errors),
+            }
+    finally:
+        reopen_database(dbc.database, kb_path, True)
+        reopen_database(query_db._database, QUERY_DB_PATH, False)
+        query_db._is_inited = False
+
+    print_report('DB concurrency', report)
+
+
+def write_synthetic_log(file_path: str, size_mb: int, days: int = 30):
+    """
+    Синтетический файл логов в формате logs_helper размером около
+    size_mb мегабайт, равномерно за последние days дней
+    """
+
+    from config import DATETIME_FORMAT
+
+    line_template = (
+        '{} INFO  get_data at data_retrieving:{} Query_ID: {}\t'
+        'Message: Служебное сообщение о ходе обработки запроса\n'
+    )
+    query_template = (
+        '{} INFO  log_user_query at messenger_manager:30 Query_ID: {}\t'
+        'ID-пользователя: {}\tИмя пользователя: benchmark\tПлатформа: web\t'
+        'Запрос: сколько было потрачено на образование\tФормат: text\n'
+    )
+
+    size = size_mb * 1024 * 1024
+    lines_per_query = 20
+    approx_lines = size // len(line_template.encode('utf-8'))
+    start = datetime.datetime.now() - datetime.timedelta(days=days)
+    step = datetime.timedelta(days=days) / max(approx_lines, 1)
+
+    written = 0
+    line_num = 0
+    with open(file_path, 'w', encoding='utf-8') as log_out:
+        while written < size:
+            line_time = (start + step * line_num).strftime(DATETIME_FORMAT)
+            query_id = 'query-{}'.format(line_num // lines_per_query)
+
+            if line_num % lines_per_query == 0:
+                line = query_template.format(line_time, query_id, line_num % 7)
+            else:
+                line = line_template.format(line_time, line_num % 300, query_id)
+
+            log_out.write(line)
+            written += len(line.encode('utf-8'))
+            line_num += 1
+
+    return line_num
+
+
+def bench_log_index(args):
+    """
+    Время выдачи логов за последние 15 минут (/getinfolog и
+    /getsessionlog) на синтетическом файле логов в несколько гигабайт:
+    полный просмотр файла против перехода по индексу смещений.
+    --limit задает размер файла в мегабайтах
+    """
+
+    from logs_helper import LogsRetriever
+
+    size_mb = args.limit or 2048
+    temp_dir = tempfile.mkdtemp()
+    log_path = path.join(temp_dir, 'logs.log')
+
+    start = time.monotonic()
+    lines = write_synthetic_log(log_path, size_mb)
+    report = {
+        'log_megabytes': size_mb,
+        'log_lines': lines,
+        'generation_seconds': time.monotonic() - start,
+    }
+
+    retriever = LogsRetriever(log_path)
+    log_index = retriever._log_index
+
+    start = time.monotonic()
+    log_index.refresh()
+    report['index_build_seconds'] = time.monotonic() - start
+    report['index_bytes'] = path.getsize(log_index.path_to_index_file)
+
+    def full_scan():
+        offset_since, read_lines_from = log_index.offset_since, log_index.read_lines_from
+        log_index.offset_since = lambda since: 0
+        log_index.read_lines_from = lambda offset: read_lines_from(0)
+        return offset_since, read_lines_from
+
+    def indexed(originals):
+        log_index.offset_since, log_index.read_lines_from = originals
+
+    time_delta = datetime.timedelta(minutes=15)
+    results = {}
+    for mode in ('before', 'after'):
+        originals = full_scan() if mode == 'before' else None
+
+        try:
+            start = time.monotonic()
+            results[(mode, 'info')] = retriever._get_logs_at_level('INFO', time_delta)
+            info_seconds = time.monotonic() - start
+
+            start = time.monotonic()
+            results[(mode, 'session')] = retriever._get_session_logs(1, time_delta)
+            session_seconds = time.monotonic() - start
+        finally:
+            if originals is not None:
+                indexed(originals)
+
+        report[mode] = {
+            'info_log_seconds': info_seconds,
+            'session_log_seconds': session_seconds,
+        }
+
+    # дописывание в конец индексируется без перечитывания файла
+    write_synthetic_log(log_path + '.tail', 1, days=0)
+    with open(log_path + '.tail', encoding='utf-8') as tail_in, \
+            open(log_path, 'a', encoding='utf-8') as log_out:
+        log_out.write(tail_in.read())
+
+    start = time.monotonic()
+    log_index.refresh()
+    report['index_refresh_after_1mb_seconds'] = time.monotonic() - start
+
+    kinds = ('info', 'session')
+    report['mismatches'] = count_mismatches(
+        kinds,
+        [results[('before', kind)] for kind in kinds],
+        [results[('after', kind)] for kind in kinds]
+    )
+
+    print_report('Log index', report)
+
+
+def bench_tonita_parser(args):
+    """
+    Последовательное применение обработчиков TonitaParser против
+    скомпилированного парсера: сравнение результатов по всем
+    тестовым вопросам и пропускная способность нормализации
+    TextPreprocessing.normalize в обоих режимах
+    """
+
+    from model_manager import MODEL_CONFIG
+    from text_preprocessing import TextPreprocessing, _mc_get
+
+    questions = (read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+                 read_test_questions(TEST_PATH_MINFIN)[:args.limit or None])
+
+    parser = TextPreprocessing._make_tonita_parser(True, True, True, True)
+    compiled_parser = parser.compile()
+
+    tokens = [TextPreprocessing._pymorphy_lem(question.lower()) for question in questions]
+
+    seconds, results = {}, {}
+    for mode, run in (('sequential', parser), ('compiled', compiled_parser)):
+        results[mode], seconds[mode] = timed_map(run, tokens)
+
+    mismatches = count_mismatches(questions, results['sequential'], results['compiled'])
+
+    previous_mode = _mc_get("parser_compiled")
+    normalize = {}
+    try:
+        for mode, compiled in (('sequential', False), ('compiled', True)):
+            MODEL_CONFIG['parser_compiled'] = compiled
+            text_pp = TextPreprocessing(log=False)
+            text_pp.normalize(questions[0])
+
+            start = time.monotonic()
+            for question in questions:
+                text_pp.normalize(question)
+            normalize[mode] = len(questions) / (time.monotonic() - start)
+    finally:
+        MODEL_CONFIG['parser_compiled'] = previous_mode
+
+    print_report('Tonita parser', {
+        'requests': len(questions),
+        'handlers': len(parser.handlers),
+        'mismatches': mismatches,
+        'parser_seconds_sequential': seconds['sequential'],
+        'parser_seconds_compiled': seconds['compiled'],
+        'normalize_per_second_sequential': normalize['sequential'],
+        'normalize_per_second_compiled': normalize['compiled'],
+    })
+
+
+def bench_normalize_overhead(args):
+    """
+    Накладные расходы вызова TextPreprocessing.normalize на коротких
+    запросах: прежний путь (параметры через __getattr__, сборка
+    парсера и стоп-слов на каждый вызов, фильтры через filter)
+    против собранного при создании конвейера. Лемматизация общая,
+    поэтому для каждого слова ее результат берется из кеша
+    """
+
+    from text_preprocessing import TextPreprocessing
+
+    questions = (read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+                 read_test_questions(TEST_PATH_MINFIN)[:args.limit or None])
+    short_questions = [q for q in questions if len(q.split()) <= 4]
+
+    text_pp = TextPreprocessing(log=False)
+
+    def legacy_normalize(text):
+        if '+' in text:
+            text = text.replace('\\+', '')
+            text = text.replace('+', '')
+        if 'ъем' in text:
+            text = text.replace('ъем', 'ъём')
+        text = TextPreprocessing._filter_symbols(text)
+        tokens = text_pp.lemmatizer(text)
+        if text_pp.combined_parser is not None:
+            tokens = text_pp.combined_parser(tokens)
+        if text_pp.delete_digits:
+            tokens = filter(lambda t: not t.isdigit(), tokens)
+        if text_pp.delete_question_words:
+            stop_words = text_pp.stop_words.union(text_pp.question_words)
+        else:
+            stop_words = text_pp.stop_words
+        tokens = filter(lambda t: t not in stop_words, tokens)
+        if text_pp.delete_repeatings:
+            tokens = list(tokens)
+            tokens = [t for n, t in enumerate(tokens) if t not in tokens[:n]]
+        return ' '.join(tokens)
+
+    # прогрев кеша лемм, чтобы сравнивались только накладные расходы
+    for question in short_questions:
+        text_pp.normalize(question)
+
+    mismatches = count_mismatches(
+        short_questions,
+        [legacy_normalize(question) for question in short_questions],
+        [text_pp.normalize(question) for question in short_questions]
+    )
+
+    repeats = 20
+    microseconds = {}
+    for mode, normalize in (('legacy', legacy_normalize), ('pipeline', text_pp.normalize)):
+        start = time.monotonic()
+        for _ in range(repeats):
+            for question in short_questions:
+                normalize(question)
+        microseconds[mode] = (
+            10 ** 6 * (time.monotonic() - start) /
+            max(1, repeats * len(short_questions))
+        )
+
+    print_report('Normalize overhead', {
+        'requests': len(short_questions),
+        'mismatches': mismatches,
+        'microseconds_per_call_legacy': microseconds['legacy'],
+        'microseconds_per_call_pipeline': microseconds['pipeline'],
+    })
+
+
+def bench_tokenizer(args):
+    """
+    Прежний advanced_tokenizer с проверками TokenTypes.in_type для
+    каждого фрагмента против однопроходного scan_tokens. Результаты
+    сравниваются на вопросах тестов во всех сочетаниях параметров
+    """
+
+    from nlp import nlp_utils
+    from nlp.nlp_utils import TokenTypes
+
+    def legacy_tokenizer(text, with_punct=False, with_spaces=False):
+        tokens = nlp_utils.token_split_re.split(text)
+        for idx, token in enumerate(tokens):
+            if TokenTypes.in_type(token, 'whitespace'):
+                tokens[idx] = (token if with_spaces else None,)
+            elif TokenTypes.in_type(token, 'punctuation'):
+                tokens[idx] = (token if with_punct else None,)
+            elif TokenTypes.in_type(token, ('null', 'word')):
+                tokens[idx] = (token,)
+            else:
+                tokens[idx] = nlp_utils.nltk_tokens(token, with_punct)
+        return [t for t in itertools.chain.from_iterable(tokens) if t]
+
+    questions = (read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+                 read_test_questions(TEST_PATH_MINFIN)[:args.limit or None])
+
+    cases = [(params, question)
+             for params in ((False, False), (True, True)) for question in questions]
+
+    seconds, results = {}, {}
+    for mode, tokenizer in (('legacy', legacy_tokenizer),
+                            ('scanner', nlp_utils.advanced_tokenizer)):
+        results[mode], seconds[mode] = timed_map(
+            lambda case, tokenizer=tokenizer: tokenizer(case[1], *case[0]), cases)
+
+    mismatches = count_mismatches(cases, results['legacy'], results['scanner'])
+
+    print_report('Tokenizer', {
+        'requests': len(questions),
+        'mismatches': mismatches,
+        'seconds_legacy': seconds['legacy'],
+        'seconds_scanner': seconds['scanner'],
+    })
+
+
+def bench_lemma_cache(args):
+    """
+    Лемматизация слов тестовых вопросов через pymorphy2 против
+    поиска в словаре лемм, построенном во временном файле. Леммы
+    обоих способов сравниваются, доля попаданий в рабочий словарь
+    считается отдельно
+    """
+
+    from nlp import nlp_utils
+    from nlp.lemma_dictionary import LemmaDictionary, build_lemma_dictionary
+    from text_preprocessing import TextPreprocessing
+
+    questions = (read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+                 read_test_questions(TEST_PATH_MINFIN)[:args.limit or None])
+    words = [
+        word for question in questions
+        for word in nlp_utils.advanced_tokenizer(question)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = path.join(tmp_dir, 'lemmas.db')
+
+        start = time.monotonic()
+        size = build_lemma_dictionary(
+            TextPreprocessing.lemma_dictionary_words(questions),
+            TextPreprocessing.pymorphy_lemma,
+            file_path
+        )
+        build_seconds = time.monotonic() - start
+
+        dictionary = LemmaDictionary(file_path)
+
+        expected, pymorphy_seconds = timed_map(TextPreprocessing.pymorphy_lemma, words)
+        actual, dictionary_seconds = timed_map(dictionary.get, words)
+
+        mismatches = count_mismatches(words, expected, actual)
+        dictionary.close()
+
+    # попадания в рабочий словарь, если он построен
+    working = LemmaDictionary(LemmaDictionary.inst().file_path)
+    for word in words:
+        working.get(word)
+
+    print_report('Lemma cache', {
+        'words': len(words),
+        'dictionary_size': size,
+        'mismatches': mismatches,
+        'seconds_build': build_seconds,
+        'seconds_pymorphy': pymorphy_seconds,
+        'seconds_dictionary': dictionary_seconds,
+        'working_dictionary': working.stats(),
+    })
+
+
+def bench_ml_preprocess(args):
+    """
+    Предобработка запросов для классификаторов: прежний перебор всех
+    территорий и членов федерального бюджета через issubset против
+    инвертированного индекса. Результаты сравниваются, время
+    поиска замеряется отдельно от нормализации
+    """
+
+    from core import ml_helper
+
+    def legacy_match(res):
+        for terr in ml_helper.get_territories():
+            if terr.issubset(res):
+                res = res.difference(terr)
+                res.add("члентерритория")
+                break
+        for fb in ml_helper.FB_MEMBERS:
+            if fb.issubset(res):
+                res = res.difference(fb)
+                res.add("членфедбюджет")
+                break
+        return res
+
+    def index_match(res):
+        terr = ml_helper.get_territory_index().first_subset(res)
+        if terr is not None:
+            res = res.difference(terr)
+            res.add("члентерритория")
+        fb = ml_helper.preprocess.fb_index.first_subset(res)
+        if fb is not None:
+            res = res.difference(fb)
+            res.add("членфедбюджет")
+        return res
+
+    questions = (read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+                 read_test_questions(TEST_PATH_MINFIN)[:args.limit or None])
+
+    start = time.monotonic()
+    word_sets = []
+    for question in questions:
+        text = ml_helper.TPP(question)
+        text = text.replace("2017", "текущийгод")
+        text = ml_helper.YEARS_RE.sub("нетекущийгод", text)
+        word_sets.append(set(ml_helper.WORDS_RE.findall(text)))
+    normalize_seconds = time.monotonic() - start
+
+    # построение индекса не входит в замер
+    ml_helper.get_territory_index()
+
+    seconds, results = {}, {}
+    for mode, match in (('legacy', legacy_match), ('index', index_match)):
+        results[mode], seconds[mode] = timed_map(
+            lambda words, match=match: match(set(words)), word_sets)
+
+    mismatches = count_mismatches(questions, results['legacy'], results['index'])
+
+    print_report('ML preprocess', {
+        'requests': len(questions),
+        'territories': len(ml_helper.get_territories()),
+        'mismatches': mismatches,
+        'seconds_normalize': normalize_seconds,
+        'seconds_match_legacy': seconds['legacy'],
+        'seconds_match_index': seconds['index'],
+    })
+
+
+def bench_minfin_exact(args):
+    """
+    Поиск точного ответа по Минфину среди некорректных авто-тестов:
+    перебор всех вопросов файла со сравнением множеств слов против
+    одного обращения к индексу. Файл растет до десятков тысяч
+    вопросов, половина запросов находит ответ
+    """
+
+    from data_retrieving import DataRetrieving
+
+    questions = [
+        question.lower().replace('?', '')
+        for question in read_test_questions(TEST_PATH_MINFIN)
+    ]
+    vocabulary = sorted({word for question in questions for word in question.split()})
+
+    def legacy_lookup(data, user_request):
+        user_request = user_request.lower().replace('?', '')
+        for key in data.keys():
+            if set(user_request.split()) == set(key.split()):
+                return data.get(key, 0)
+
+    rnd = random.Random(0)
+    report = {}
+    for size in (100, 1000, 10000, 50000):
+        data = {}
+        while len(data) < size:
+            words = rnd.sample(vocabulary, rnd.randint(3, 8))
+            data[' '.join(words)] = '{}.{}'.format(rnd.randint(1, 20), rnd.randint(1, 99))
+
+        keys = list(data)
+        requests = []
+        for _ in range(200):
+            words = rnd.choice(keys).split()
+            rnd.shuffle(words)
+            requests.append(' '.join(words))
+            requests.append(rnd.choice(questions))
+
+        start = time.monotonic()
+        index = DataRetrieving._minfin_auto_wrong_questions_index(data)
+        build_seconds = time.monotonic() - start
+
+        seconds, results = {}, {}
+        results['legacy'], seconds['legacy'] = timed_map(
+            lambda user_request: legacy_lookup(data, user_request), requests)
+        results['index'], seconds['index'] = timed_map(
+            lambda user_request: index.get(
+                frozenset(user_request.lower().replace('?', '').split())),
+            requests)
+
+        mismatches = count_mismatches(requests, results['legacy'], results['index'])
+
+        report[size] = {
+            'mismatches': mismatches,
+            'seconds_build_index': build_seconds,
+            'microseconds_per_request_legacy': 10 ** 6 * seconds['legacy'] / len(requests),
+            'microseconds_per_request_index': 10 ** 6 * seconds['index'] / len(requests),
+        }
+
+    print_report('Minfin exact answers', report)
+
+
+def bench_personalization(args):
+    """
+    Поиск фраз small-talk: перебор всех фраз групп с мерой Жаккара
+    против инвертированного индекса PhraseIndex. Группы дополнены
+    несколькими тысячами фраз из слов тестовых вопросов, сообщения -
+    тестовые вопросы и сами фразы. Отдельно замеряется пропускная
+    способность MessengerManager.personalization с рабочим индексом
+    """
+
+    from manual_testing import get_jaccard
+    from messenger_manager import JACCARD_SIMILARITY_THRESHOLD
+    from messenger_manager import MessengerManager, PhraseIndex
+    import constants
+
+    questions = (read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+                 read_test_questions(TEST_PATH_MINFIN)[:args.limit or None])
+    vocabulary = sorted({
+        word for question in questions
+        for word in MessengerManager._simple_split(question)[1]
+    })
+
+    rnd = random.Random(0)
+    groups = [
+        list(constants.HOW_ARE_YOU),
+        list(constants.WHO_YOU_ARE),
+        list(constants.WHAT_CAN_YOU_DO),
+        list(constants.WHO_IS_YOUR_CREATOR),
+    ]
+    for _ in range(4000):
+        rnd.choice(groups).append(' '.join(rnd.sample(vocabulary, rnd.randint(2, 6))))
+
+    def legacy_find_group(tokens):
+        for group_num, phrases in enumerate(groups):
+            for phrase in phrases:
+                if get_jaccard(tokens, set(phrase.split())) > JACCARD_SIMILARITY_THRESHOLD:
+                    return group_num
+        return None
+
+    start = time.monotonic()
+    index = PhraseIndex([(phrases, (group_num,)) for group_num, phrases in enumerate(groups)])
+    build_seconds = time.monotonic() - start
+
+    messages = questions + [phrase for phrases in groups for phrase in phrases[:50]]
+    token_sets = [set(MessengerManager._simple_split(message)[1]) for message in messages]
+
+    seconds, results = {}, {}
+    for mode, find_group in (('legacy', legacy_find_group), ('index', index.find_group)):
+        results[mode], seconds[mode] = timed_map(find_group, token_sets)
+
+    mismatches = count_mismatches(messages, results['legacy'], results['index'])
+
+    start = time.monotonic()
+    for message in messages:
+        MessengerManager.personalization(message)
+    personalization_seconds = time.monotonic() - start
+
+    print_report('Personalization', {
+        'messages': len(messages),
+        'phrases': sum(len(phrases) for phrases in groups),
+        'mismatches': mismatches,
+        'seconds_build_index': build_seconds,
+        'messages_per_second_legacy': len(messages) / max(seconds['legacy'], 1e-9),
+        'messages_per_second_index': len(messages) / max(seconds['index'], 1e-9),
+        'messages_per_second_personalization': len(messages) / max(personalization_seconds, 1e-9),
+    })
+
+
+def bench_obscene_filter(args):
+    """
+    Цепочка ReplaceHandler по словоформам obscene.txt против одного
+    MultiReplaceHandler: время построения, совпадение результатов
+    и пропускная способность на тестовых вопросах, в которые
+    вставлены словоформы, в том числе подряд и по нескольку
+    """
+
+    from nlp import nlp_utils
+    from nlp.parsers.obscene_parser import _obs_words, obs_tp
+    from nlp.tonita_parser import MultiReplaceHandler, ReplaceHandler
+    from nlp.tonita_parser import TonitaParser
+
+    questions = (read_test_questions(TEST_PATH_CUBE)[:args.limit or None] +
+                 read_test_questions(TEST_PATH_MINFIN)[:args.limit or None])
+
+    start = time.monotonic()
+    chain = ReplaceHandler.fromdict(_obs_words)
+    build_seconds_chain = time.monotonic() - start
+
+    start = time.monotonic()
+    handler = MultiReplaceHandler('<censored>', _obs_words)
+    build_seconds_automaton = time.monotonic() - start
+
+    rnd = random.Random(0)
+    obs_words = list(_obs_words)
+    texts = []
+    for question in questions:
+        words = nlp_utils.advanced_tokenizer(question.lower(), False, False)
+        texts.append(' '.join(words))
+        for _ in range(rnd.randint(1, 3)):
+            word = rnd.choice(obs_words)
+            pos = rnd.randint(0, len(words))
+            words[pos:pos] = [word] * rnd.randint(1, 3)
+        texts.append(' '.join(words))
+
+    def run_chain(text):
+        for replace_handler in chain:
+            text = replace_handler.process(text)
+        return text
+
+    seconds, results = {}, {}
+    for mode, run in (('chain', run_chain), ('automaton', handler.process)):
+        results[mode], seconds[mode] = timed_map(run, texts)
+
+    mismatches = count_mismatches(texts, results['chain'], results['automaton'])
+
+    legacy_parser = TonitaParser(handlers=chain + obs_tp.handlers[1:])
+    parser_seconds = {}
+    for mode, parser in (('chain', legacy_parser), ('automaton', obs_tp)):
+        start = time.monotonic()
+        for text in texts:
+            parser(text)
+        parser_seconds[mode] = time.monotonic() - start
+
+    print_report('Obscene filter', {
+        'texts': len(texts),
+        'word_forms': len(_obs_words),
+        'mismatches': mismatches,
+        'seconds_build_chain': build_seconds_chain,
+        'seconds_build_automaton': build_seconds_automaton,
+        'texts_per_second_chain': len(texts) / max(seconds['chain'], 1e-9),
+        'texts_per_second_automaton': len(texts) / max(seconds['automaton'], 1e-9),
+        'obs_tp_per_second_chain': len(texts) / max(parser_seconds['chain'], 1e-9),
+        'obs_tp_per_second_automaton': len(texts) / max(parser_seconds['automaton'], 1e-9),
+    })
+
+
+def bench_early_exit(args):
+    """
+    Точность и задержка DataRetrieving.get_data на тестах по кубам
+    и Минфину при разных порогах minfin_early_exit_threshold: доля
+    верных главных ответов (MDX-запрос для кубов, номер для Минфина),
+    доля запросов без обработки кубов и перцентили времени ответа.
+    Порог None - обработка кубов для всех запросов
+    """
+
+    from core.answer_cache import AnswerCache
+    from core.mdx_server import MdxCache, MdxServer
+    from manual_testing import CubeTester
+    from model_manager import MODEL_CONFIG
+    import data_retrieving
+
+    thresholds = (None, 0.99, 0.95, 0.9, 0.8, 0.7, 0.6)
+    cases = (
+        [('cube', q, a) for q, a in read_test_cases(TEST_PATH_CUBE)[:args.limit or None]] +
+        [('minfin', q, a) for q, a in read_test_cases(TEST_PATH_MINFIN)[:args.limit or None]]
+    )
+    mdx_equal = CubeTester()._mdx_queries_equality
+
+    def is_correct(kind, expected, answer):
+        if answer is None:
+            return False
+        if kind == 'cube':
+            mdx_query = getattr(answer, 'mdx_query', None)
+            return bool(mdx_query) and mdx_equal(expected, mdx_query)
+        return getattr(answer, 'number', None) == expected
+
+    cube_processor = data_retrieving.CubeProcessor
+    cube_get_data = cube_processor.get_data
+    cube_calls = [0]
+
+    def counting_cube_get_data(*cube_args, **cube_kwargs):
+        cube_calls[0] += 1
+        return cube_get_data(*cube_args, **cube_kwargs)
+
+    # кеш ответов сделал бы прогоны после первого бесплатными
+    answer_cache = AnswerCache.inst()
+    enabled, answer_cache.enabled = answer_cache.enabled, False
+    has_threshold = 'minfin_early_exit_threshold' in MODEL_CONFIG
+    previous_threshold = (
+        MODEL_CONFIG['minfin_early_exit_threshold'] if has_threshold else None)
+    cube_processor.get_data = staticmethod(counting_cube_get_data)
+    mdx_server = MdxServer.inst()
+    server_cache = mdx_server.cache
+
+    report = {}
+    try:
+        for threshold in thresholds:
+            MODEL_CONFIG['minfin_early_exit_threshold'] = threshold
+            # каждый порог начинает с пустого кеша MDX-запросов, иначе
+            # следующие прогоны пользуются результатами предыдущих
+            mdx_server.cache = MdxCache(file_path=None)
+            cube_calls[0] = 0
+            correct = {'cube': 0, 'minfin': 0}
+            seconds = []
+            for kind, question, expected in cases:
+                start = time.monotonic()
+                core_answer = data_retrieving.DataRetrieving.get_data(
+                    question, 'benchmark')
+                seconds.append(time.monotonic() - start)
+                correct[kind] += is_correct(kind, expected, core_answer.answer)
+
+            seconds.sort()
+            totals = {
+                kind: sum(case[0] == kind for case in cases) for kind in correct
+            }
+            report[str(threshold)] = {
+                'accuracy': sum(correct.values()) / max(len(cases), 1),
+                'accuracy_cube': correct['cube'] / max(totals['cube'], 1),
+                'accuracy_minfin': correct['minfin'] / max(totals['minfin'], 1),
+                'cube_processing_share': cube_calls[0] / max(len(cases), 1),
+                'p50_ms': 1000 * percentile(seconds, 50),
+                'p95_ms': 1000 * percentile(seconds, 95),
+                'mean_ms': 1000 * sum(seconds) / max(len(seconds), 1),
+            }
+    finally:
+        cube_processor.get_data = staticmethod(cube_get_data)
+        mdx_server.cache = server_cache
+        answer_cache.enabled = enabled
+        if has_threshold:
+            MODEL_CONFIG['minfin_early_exit_threshold'] = previous_threshold
+        else:
+            del MODEL_CONFIG.params['minfin_early_exit_threshold']
+
+    print_report('Minfin early exit', report)
+
+
+BENCHMARKS = {
+    'solr-payload': bench_solr_payload,
+    'tech-join': bench_tech_join,
+    'tree-paths': bench_tree_paths,
+    'tree-trie': bench_tree_trie,
+    'mdx-checks': bench_mdx_checks,
+    'answer-cache': bench_answer_cache,
+    'batch': bench_batch,
+    'classifier': bench_classifier,
+    'kb-feedback': bench_kb_feedback,
+    'db-concurrency': bench_db_concurrency,
+    'log-index': bench_log_index,
+    'tonita-parser': bench_tonita_parser,
+    'normalize-overhead': bench_normalize_overhead,
+    'tokenizer': bench_tokenizer,
+    'lemma-cache': bench_lemma_cache,
+    'ml-preprocess': bench_ml_preprocess,
+    'minfin-exact': bench_minfin_exact,
+    'personalization': bench_personalization,
+    'obscene-filter': bench_obscene_filter,
+    'early-exit': bench_early_exit,
+}
+
+
+def _main():
+    # pylint: disable=invalid-name
+    parser = argparse.ArgumentParser(
+        description="Замеры производительности частей системы"
+    )
+
+    parser.add_argument(
+        "benchmark",
+        choices=sorted(BENCHMARKS),
+        help='Название замера',
+    )
+
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=0,
+        help='Ограничение на количество вопросов из каждого набора тестов',
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=8,
+        help='Количество параллельных потоков для замеров с конкуренцией',
+    )
+
+    args = parser.parse_args()
+
+    # замеры не должны тонуть в логах
+    logging.getLogger().setLevel(logging.ERROR)
+
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    _main()
@@ -77,6 +77,8 @@ TECH_CUBE_DOCS_FILE = fixed_path(
 
 TECH_MINFIN_DOCS_FILE = 'tech_minfin_data_for_indexing.json'
 
+LEMMA_DICTIONARY_PATH = fixed_path(path.join('nlp', 'lemmas.db'))
+
 
 DATE_FORMAT = "%Y.%m.%d"
 TIME_FORMAT = "%H:%M:%S"
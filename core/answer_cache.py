@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Кеш готовых ответов системы по тексту запроса
+"""
+
+from glob import glob
+from os import path, stat
+import hashlib
+import json
+import pickle
+import time
+
+from config import DATA_PATH, MODEL_CONFIG_PATH, SETTINGS
+from config import TECH_CUBE_DOCS_FILE, TECH_MINFIN_DOCS_FILE
+from config import TEST_PATH_RESULTS, WRONG_AUTO_MINFIN_TESTS_FILE
+from model_manager import MODEL_CONFIG
+from utils.cache import LRUCache, SQLiteCache
+
+
+# Настройки кеша, которые можно переопределить в settings.json (раздел ANSWER_CACHE)
+CACHE_SETTINGS = getattr(SETTINGS, 'ANSWER_CACHE', None)
+
+ENABLED = getattr(CACHE_SETTINGS, 'ENABLED', True)
+CACHE_SIZE = getattr(CACHE_SETTINGS, 'SIZE', 1024)
+CACHE_TTL = getattr(CACHE_SETTINGS, 'TTL', 60 * 60)
+
+# как часто проверяются файлы данных, секунд
+CHECK_INTERVAL = getattr(CACHE_SETTINGS, 'CHECK_INTERVAL', 1)
+
+# файл SQLite для общего кеша нескольких процессов сервера (None - только в памяти)
+CACHE_PATH = getattr(CACHE_SETTINGS, 'PATH', None)
+
+# максимальное число записей в файле SQLite
+CACHE_MAX_ROWS = getattr(CACHE_SETTINGS, 'MAX_ROWS', 100000)
+
+
+def _data_files():
+    """
+    Файлы, от которых зависит ответ: база знаний, технические документы,
+    модели классификаторов, настройки модели и логи некорректных тестов.
+    Их переиндексация, переобучение или обновление меняют отпечаток
+    """
+
+    return (
+        SETTINGS.PATH_TO_KNOWLEDGEBASE,
+        TECH_CUBE_DOCS_FILE,
+        path.join(SETTINGS.PATH_TO_MINFIN_ATTACHMENTS, TECH_MINFIN_DOCS_FILE),
+        path.join(TEST_PATH_RESULTS, WRONG_AUTO_MINFIN_TESTS_FILE),
+        MODEL_CONFIG_PATH,
+    ) + tuple(sorted(glob(path.join(DATA_PATH, '*.pkl'))))
+
+
+def _data_stamps():
+    """Отметки (время изменения, размер) файлов данных"""
+
+    stamps = []
+    for file_path in _data_files():
+        try:
+            file_stat = stat(file_path)
+            stamps.append((file_path, file_stat.st_mtime_ns, file_stat.st_size))
+        except OSError:
+            stamps.append((file_path, 0, 0))
+    return stamps
+
+
+class AnswerCache:
+    """
+    Кеш объектов CoreAnswer. Ответы хранятся сериализованными,
+    поэтому каждый вызов получает собственную копию ответа.
+    Ключ - исходный текст запроса (по нему работают классификаторы),
+    поколение - отпечаток MODEL_CONFIG
+    и отметок файлов данных, так что смена настроек модели,
+    переиндексация, переобучение классификаторов и обновление даты
+    данных в кубах делают старые ответы недоступными. Синглтон! Singleton!
+    """
+
+    __instance = None
+
+    @staticmethod
+    def inst():
+        """Реализует Синглтон"""
+        if AnswerCache.__instance is None:
+            AnswerCache.__instance = AnswerCache()
+        return AnswerCache.__instance
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, file_path=CACHE_PATH):
+        self.enabled = ENABLED
+        self.ttl = ttl
+        self.check_interval = CHECK_INTERVAL
+        self._memory = LRUCache(maxsize, ttl)
+        self._generation = None
+        self._checked_at = 0
+        self._stamps = None
+        self._params = None
+        self._disk = None
+
+        if file_path:
+            self._disk = SQLiteCache(file_path, 'answer_cache', CACHE_MAX_ROWS)
+
+    @staticmethod
+    def fingerprint(stamps: list = None):
+        """Отпечаток настроек модели и отметок файлов данных"""
+
+        if stamps is None:
+            stamps = _data_stamps()
+
+        fingerprint = hashlib.sha1()
+        fingerprint.update(json.dumps(MODEL_CONFIG.params, sort_keys=True).encode())
+        fingerprint.update(json.dumps(stamps).encode())
+        return fingerprint.hexdigest()
+
+    def _check_generation(self):
+        """
+        Поколение кеша. Файлы данных проверяются не чаще, чем раз
+        в check_interval секунд, а отпечаток пересчитывается, только
+        если изменились их отметки или настройки модели заменены
+        целиком (set_default_model). Сохраненные настройки меняют
+        отметку файла модели. При смене отпечатка уровень в памяти
+        сбрасывается
+        """
+
+        now = time.monotonic()
+        if (self._generation is not None and
+                now - self._checked_at < self.check_interval):
+            return self._generation
+
+        stamps = _data_stamps()
+        params = MODEL_CONFIG.params
+
+        if (self._generation is None or stamps != self._stamps or
+                params is not self._params):
+            generation = AnswerCache.fingerprint(stamps)
+            if generation != self._generation:
+                self._memory.clear()
+            self._generation, self._stamps, self._params = generation, stamps, params
+
+        self._checked_at = now
+        return self._generation
+
+    def get(self, key: str):
+        """Копия закешированного ответа или None"""
+
+        if not self.enabled:
+            return None
+
+        generation = self._check_generation()
+        content = self._memory.get(key)
+
+        if content is None and self._disk is not None:
+            content = self._disk.get(key, generation)
+            if content is not None:
+                self._memory.put(key, content)
+
+        if content is None:
+            return None
+
+        return pickle.loads(content)
+
+    def put(self, key: str, core_answer):
+        """Сохранение ответа"""
+
+        if not self.enabled:
+            return
+
+        generation = self._check_generation()
+        content = pickle.dumps(core_answer, protocol=pickle.HIGHEST_PROTOCOL)
+        self._memory.put(key, content)
+
+        if self._disk is not None:
+            self._disk.put(key, generation, self.ttl, content)
+
+    def invalidate(self):
+        """Полный сброс кеша, включая уровень на диске"""
+
+        self._generation = None
+        self._memory.clear()
+
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+
+        stats = self._memory.stats()
+        stats['disk_hits'] = self._disk.hits if self._disk is not None else 0
+        return stats
@@ -5,15 +5,13 @@
 Работа с документами по кубам
 """
 
-import copy
-import logging
-
 from config import SETTINGS
 from core.graph import Graph
 from core.support_library import CubeData
 from core.support_library import FunctionExecutionError
 from core.support_library import FunctionExecutionErrorNoMembers
 from model_manager import MODEL_CONFIG
+from utils.trace import get_trace, trace_event
 import core.support_library as csl
 import logs_helper  # pylint: disable=unused-import
 
@@ -29,12 +27,15 @@ class CubeProcessor:
         # уверенность ответа по кубам
         confidence = True
 
-        # увеличения скора корректного по мнению классификатора куба
-        CubeProcessor._boost_correct_cube_from_clf(cube_data, correct_cube)
+        trace = get_trace(cube_data.request_id)
+
+        with trace.stage('cube_boost'):
+            # увеличения скора корректного по мнению классификатора куба
+            CubeProcessor._boost_correct_cube_from_clf(cube_data, correct_cube)
 
-        # увеличения скора мер от корректного по мнеию классификатора куба
-        CubeProcessor._boost_measures_of_correct_cube_from_clf(
-            cube_data, correct_cube)
+            # увеличения скора мер от корректного по мнеию классификатора куба
+            CubeProcessor._boost_measures_of_correct_cube_from_clf(
+                cube_data, correct_cube)
 
         # увеличения скора элементов измерений
         # CubeProcessor._boost_members_of_correct_cube_form_clf(
@@ -44,57 +45,48 @@ class CubeProcessor:
         cube_data_list = []
 
         if cube_data:
-            # проверка на правдоподобность найденного уровня бюджета
-            csl.check_real_bglevel_existence(cube_data)
+            with trace.stage('cube_preprocess'):
+                # проверка на правдоподобность найденного уровня бюджета
+                csl.check_real_bglevel_existence(cube_data)
 
-            # некоторая предобработка
-            csl.preprocess_bglevels_member(cube_data)
+                # некоторая предобработка
+                csl.preprocess_bglevels_member(cube_data)
 
-            # проверка на правдоподобность найденной территории
-            csl.check_real_territory_existence(cube_data)
+                # проверка на правдоподобность найденной территории
+                csl.check_real_territory_existence(cube_data)
 
             # получение нескольких возможных вариантов
-            cube_data_list = CubeProcessor._get_several_cube_answers(cube_data)
+            with trace.stage('tree') as fields:
+                cube_data_list = CubeProcessor._get_several_cube_answers(cube_data)
+                fields['paths_succeeded'] = len(cube_data_list)
 
             if cube_data_list:
-                logging.info(
-                    "Query_ID: {}\tMessage: Собрано {} ответов "
-                    "по кубам".format(
-                        cube_data_list[0].request_id,
-                        len(cube_data_list)
-                    )
-                )
-            else:
-                logging.info(
-                    "Query_ID: {}\tMessage: Собрано 0 ответов "
-                    "по кубам".format(cube_data.request_id)
-                )
+                with trace.stage('cube_refine'):
+                    # доработка вариантов
+                    for item in cube_data_list:
+                        csl.select_measure_for_selected_cube(item)
+                        csl.preprocess_territory_member(item)
+                        csl.score_cube_question(item)
 
-            if cube_data_list:
-                # доработка вариантов
-                for item in cube_data_list:
-                    csl.select_measure_for_selected_cube(item)
-                    csl.preprocess_territory_member(item)
-                    csl.score_cube_question(item)
-
-                cube_data_list = CubeProcessor._take_best_cube_data(
-                    cube_data_list, correct_cube[0])
+                    cube_data_list = CubeProcessor._take_best_cube_data(
+                        cube_data_list, correct_cube[0])
 
-                for item in cube_data_list:
-                    # обработка связанных значений
-                    csl.process_with_members(item)
+                with trace.stage('cube_postprocess'):
+                    for item in cube_data_list:
+                        # обработка связанных значений
+                        csl.process_with_members(item)
 
-                    # обработка связанного значения для территории
-                    csl.process_with_member_for_territory(item)
+                        # обработка связанного значения для территории
+                        csl.process_with_member_for_territory(item)
 
-                    # обработка дефолтных значений элементов измерений
-                    csl.process_default_members(item)
+                        # обработка дефолтных значений элементов измерений
+                        csl.process_default_members(item)
 
-                    # обработка дефолтных значений для меры
-                    csl.process_default_measures(item)
+                        # обработка дефолтных значений для меры
+                        csl.process_default_measures(item)
 
-                    # создание MDX-запросов
-                    csl.create_mdx_query(item)
+                        # создание MDX-запросов
+                        csl.create_mdx_query(item)
 
             # удаление повторяющихся после обработки
             csl.delete_repetitions(cube_data_list)
@@ -103,16 +95,18 @@ class CubeProcessor:
             # когда собран MDX-запрос
             if SETTINGS.CHECK_CUBE_DATA_EXISTENCE:
                 confidence = csl.filter_cube_data_without_answer(
-                    cube_data_list)
+                    cube_data_list, correct_cube[0])
 
                 # после фильтрации по наличию данных можно выбрать лучший
                 # как с помощью классификатора, так и по умолчанию (то есть по скору)
                 csl.best_answer_depending_on_cube(
                     cube_data_list, correct_cube[0])
 
-        answers = CubeProcessor._format_final_cube_answer(
-            cube_data_list
-        )
+        # обратная связь по каждому ответу строится по базе знаний
+        with trace.stage('cube_feedback'):
+            answers = CubeProcessor._format_final_cube_answer(
+                cube_data_list
+            )
 
         return answers, confidence
 
@@ -186,48 +180,75 @@ class CubeProcessor:
 
     @staticmethod
     def _get_several_cube_answers(cube_data: CubeData):
-        """Формирование нескольких ответов по кубам"""
-
-        cube_data_list = []
+        """
+        Формирование нескольких ответов по кубам. Пути дерева
+        исполняются обходом в глубину по префиксному дереву путей:
+        общее начало путей считается один раз, а ошибка в узле
+        отсекает все проходящие через него пути
+        """
 
         tree = Graph.inst(MODEL_CONFIG['tree_k_path_threshold'])
 
-        for path in tree.tree_paths:
+        # результаты по номерам путей, чтобы сохранить порядок путей
+        results = {}
 
-            # копия для каждого прогона
-            cube_data_copy = copy.deepcopy(cube_data)
+        CubeProcessor._execute_paths_trie(
+            tree, tree.paths_trie, cube_data, results)
 
-            try:
-                # последовательное исполнение функций узлов
-                for node_id in path:
-                    tree.node[node_id]['function'](cube_data_copy)
+        return [results[path_idx] for path_idx in sorted(results)]
 
-                # занесение сработавшего пути
-                cube_data_copy.tree_path = path
+    @staticmethod
+    def _execute_paths_trie(
+            tree: Graph,
+            trie_node: dict,
+            cube_data: CubeData,
+            results: dict
+    ):
+        """Исполнение функций узлов поддерева путей"""
+
+        for node_id, child in trie_node['children'].items():
+
+            # копия для каждой ветки, документы общие
+            cube_data_copy = cube_data.copy()
 
-                # добавление успешного результата прогона в лист
-                cube_data_list.append(cube_data_copy)
+            try:
+                tree.node[node_id]['function'](cube_data_copy)
             except FunctionExecutionErrorNoMembers as error:
-                # все равно добавление элемента список,
+                # все равно добавление элемента список для каждого пути,
                 # так как есть еще есть дефолтные значения
-                cube_data_copy.tree_path = path
-                cube_data_list.append(cube_data_copy)
-
-                msg = error.args[0]
-                logging.info('Query_ID: {}\tTree_path: {}\tMessage: {}-{}'.format(
-                    cube_data_copy.request_id,
-                    path,
-                    msg['function'],
-                    msg['message']))
+                for path_idx in child['paths']:
+                    path_cube_data = cube_data_copy.copy()
+                    path_cube_data.tree_path = tree.tree_paths[path_idx]
+                    results[path_idx] = path_cube_data
+
+                    CubeProcessor._log_path_error(path_cube_data, error)
+                continue
             except FunctionExecutionError as error:
-                msg = error.args[0]
-                logging.info('Query_ID: {}\tTree_path: {}\tMessage: {}-{}'.format(
-                    cube_data_copy.request_id,
-                    path,
-                    msg['function'],
-                    msg['message']))
+                for path_idx in child['paths']:
+                    cube_data_copy.tree_path = tree.tree_paths[path_idx]
+                    CubeProcessor._log_path_error(cube_data_copy, error)
+                continue
+
+            if child['path_end'] is not None:
+                # занесение сработавшего пути
+                cube_data_copy.tree_path = tree.tree_paths[child['path_end']]
 
-        return cube_data_list
+                # добавление успешного результата прогона
+                results[child['path_end']] = cube_data_copy
+
+            CubeProcessor._execute_paths_trie(
+                tree, child, cube_data_copy, results)
+
+    @staticmethod
+    def _log_path_error(cube_data: CubeData, error: Exception):
+        """Логирование ошибки исполнения функции узла на пути"""
+
+        msg = error.args[0]
+        trace_event(
+            cube_data.request_id, 'tree_path_error',
+            tree_path=cube_data.tree_path,
+            function=msg['function'],
+            message=msg['message'])
 
     @staticmethod
     def _take_best_cube_data(cube_data_list: list, correct_cube: str):
@@ -243,13 +264,10 @@ class CubeProcessor:
             key=lambda cube_data: cube_data.score[scoring_model],
             reverse=True)
 
-        logging.info(
-            "Query_ID: {}\tMessage: Алгоритмически лучший "
-            "ответ создан на пути {}".format(
-                cube_data_list[0].request_id,
-                cube_data_list[0].tree_path
-            )
-        )
+        # алгоритмически лучший ответ
+        trace_event(
+            cube_data_list[0].request_id, 'best_tree_path',
+            tree_path=cube_data_list[0].tree_path)
 
         # Выбор главного ответа по классификатору
         # Альтернативная версия выбора главного ответа
@@ -284,7 +302,8 @@ class CubeProcessor:
                     item.score,
                     item.mdx_query,
                     cube,
-                    feedback
+                    feedback,
+                    item.mdx_value
                 )
             )
 
@@ -313,7 +332,10 @@ class CubeAnswer:
     Возвращаемый объект этого модуля
     """
 
-    def __init__(self, request_id, user_request, score, mdx_query, cube, feedback):
+    def __init__(
+            self, request_id, user_request, score,
+            mdx_query, cube, feedback, mdx_value=None
+    ):
         self.status = True
         self.request_id = request_id
         self.user_request = user_request
@@ -327,6 +349,9 @@ class CubeAnswer:
         self.feedback = feedback
         self.order = None
 
+        # значение, полученное при проверке наличия данных
+        self.mdx_value = mdx_value
+
     def get_score(
             self,
             scoring_model=MODEL_CONFIG["cube_answers_scoring_model"]
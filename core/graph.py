@@ -29,6 +29,7 @@ class Graph(nx.DiGraph):
         self._define_nodes()
         self._define_edges()
         self.tree_paths = list(self._k_shortest_paths(0, 16, num_of_variants))
+        self.paths_trie = self._paths_trie(self.tree_paths)
 
     def _define_nodes(self):
         """Определение вершин"""
@@ -110,3 +111,27 @@ class Graph(nx.DiGraph):
         """k наиболее коротких путей от source-node до target-node"""
 
         return islice(nx.shortest_simple_paths(self, source, target, weight='weight'), k)
+
+    @staticmethod
+    def _paths_trie(paths: list):
+        """
+        Префиксное дерево путей: общие начала путей хранятся один раз.
+        Узел префиксного дерева - словарь с ключами children
+        (id узла графа -> узел префиксного дерева), paths (номера путей,
+        проходящих через узел) и path_end (номер пути, который
+        заканчивается в узле, или None)
+        """
+
+        def trie_node():
+            return {'children': {}, 'paths': [], 'path_end': None}
+
+        root = trie_node()
+
+        for path_idx, path in enumerate(paths):
+            node = root
+            for node_id in path:
+                node = node['children'].setdefault(node_id, trie_node())
+                node['paths'].append(path_idx)
+            node['path_end'] = path_idx
+
+        return root
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Взаимодействие с сервером Кристы, исполняющим MDX-запросы
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from os import stat
+import json
+import logging
+import re
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+import requests
+
+from config import MODEL_CONFIG_PATH, SETTINGS
+from model_manager import MODEL_CONFIG, load_model_value
+from utils.cache import LRUCache, SQLiteCache
+from utils.metrics import Histogram
+import logs_helper  # pylint: disable=unused-import
+
+
+# Настройки клиента, которые можно переопределить в settings.json (раздел MDX_SERVER)
+MDX_SETTINGS = getattr(SETTINGS, 'MDX_SERVER', None)
+
+URL = getattr(
+    MDX_SETTINGS, 'URL',
+    'http://conf.prod.fm.epbs.ru/mdxexpert/CellsetByMdx'
+)
+CONNECT_TIMEOUT = getattr(MDX_SETTINGS, 'CONNECT_TIMEOUT', 3)
+READ_TIMEOUT = getattr(MDX_SETTINGS, 'READ_TIMEOUT', 15)
+POOL_SIZE = getattr(MDX_SETTINGS, 'POOL_SIZE', 10)
+
+# Кеш результатов: размер в записях, время жизни в секундах
+# и путь к файлу дискового уровня (None - только в памяти)
+CACHE_SIZE = getattr(MDX_SETTINGS, 'CACHE_SIZE', 2048)
+CACHE_TTL = getattr(MDX_SETTINGS, 'CACHE_TTL', 24 * 60 * 60)
+CACHE_PATH = getattr(MDX_SETTINGS, 'CACHE_PATH', None)
+CACHE_MAX_ROWS = getattr(MDX_SETTINGS, 'CACHE_MAX_ROWS', 100000)
+
+# как часто проверяется файл настроек модели с датой обновления кубов, секунд
+CACHE_CHECK_INTERVAL = getattr(MDX_SETTINGS, 'CACHE_CHECK_INTERVAL', 1)
+
+WHERE_MEMBER_PATTERN = re.compile(r'\[[^\]]*\]\.\[[^\]]*\]')
+
+
+def canonical_mdx_query(mdx_query: str):
+    """
+    Канонический вид MDX-запроса: без лишних пробелов
+    и с упорядоченными элементами измерений в WHERE
+    """
+
+    mdx_query = ' '.join(mdx_query.split())
+
+    head, sep, where = mdx_query.partition(' WHERE ')
+    if not sep:
+        return mdx_query
+
+    members = sorted(WHERE_MEMBER_PATTERN.findall(where))
+    return '{} WHERE ({})'.format(head, ','.join(members))
+
+
+class MdxCache:
+    """
+    Кеш ответов сервера по (куб, канонический MDX-запрос).
+    Уровень в памяти с LRU и TTL, опционально уровень на диске (SQLite),
+    чтобы после перезапуска не начинать с пустого кеша.
+    Данные в кубах меняются только при обновлении, поэтому при смене
+    MODEL_CONFIG["cube_update_date"] кеш сбрасывается. Дату меняет
+    update_date.py в другом процессе, сохраняя файл настроек модели,
+    поэтому при изменении файла дата перечитывается из него
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, file_path=CACHE_PATH):
+        self.ttl = ttl
+        self.check_interval = CACHE_CHECK_INTERVAL
+        self._memory = LRUCache(maxsize, ttl)
+        self._update_date = MODEL_CONFIG["cube_update_date"]
+        self._checked_at = 0
+        self._model_stamp = None
+        self._disk = None
+
+        if file_path:
+            self._disk = SQLiteCache(file_path, 'mdx_cache', CACHE_MAX_ROWS)
+
+    @staticmethod
+    def key(mdx_query: str, cube: str):
+        """Ключ кеша"""
+
+        return '{}\n{}'.format(cube, canonical_mdx_query(mdx_query))
+
+    def _reload_update_date(self):
+        """
+        Дата обновления кубов из файла настроек модели, если отметка
+        (время изменения, размер) файла изменилась. Файл проверяется
+        не чаще, чем раз в check_interval секунд. Новая дата попадает
+        и в MODEL_CONFIG процесса, которым пользуются ответы по кубам
+        """
+
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        try:
+            file_stat = stat(MODEL_CONFIG_PATH)
+            stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+            if stamp == self._model_stamp:
+                return
+            update_date = load_model_value("cube_update_date")
+        except (OSError, ValueError, KeyError) as error:
+            # файл может читаться в момент записи, тогда повтор при следующей проверке
+            logging.warning(
+                'Message: Не удалось перечитать дату обновления кубов: {}'.format(error))
+            return
+
+        self._model_stamp = stamp
+        MODEL_CONFIG["cube_update_date"] = update_date
+
+    def _check_update_date(self):
+        """Сброс уровня в памяти, если данные в кубах обновились"""
+
+        self._reload_update_date()
+
+        update_date = MODEL_CONFIG["cube_update_date"]
+        if update_date != self._update_date:
+            self._update_date = update_date
+            self._memory.clear()
+
+    def get(self, mdx_query: str, cube: str):
+        """Закешированный ответ сервера (байты) или None"""
+
+        self._check_update_date()
+
+        key = MdxCache.key(mdx_query, cube)
+        content = self._memory.get(key)
+
+        if content is None and self._disk is not None:
+            content = self._disk.get(key, self._update_date)
+            if content is not None:
+                self._memory.put(key, content)
+
+        return content
+
+    def put(self, mdx_query: str, cube: str, content: bytes):
+        """Сохранение ответа сервера"""
+
+        self._check_update_date()
+
+        key = MdxCache.key(mdx_query, cube)
+        self._memory.put(key, content)
+
+        if self._disk is not None:
+            self._disk.put(key, self._update_date, self.ttl, content)
+
+    def invalidate(self):
+        """Полный сброс кеша, включая уровень на диске"""
+
+        self._update_date = MODEL_CONFIG["cube_update_date"]
+        self._memory.clear()
+
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+
+        stats = self._memory.stats()
+        stats['disk_hits'] = self._disk.hits if self._disk is not None else 0
+        return stats
+
+
+def _is_cacheable(response):
+    """В кеш попадают только корректные ответы сервера"""
+
+    if response.status_code != 200:
+        return False
+
+    try:
+        response_json = response.json()
+    except json.JSONDecodeError:
+        return False
+
+    return bool(response_json.get('success', 1)) and 'cells' in response_json
+
+
+def _cached_response(content: bytes):
+    """Ответ сервера, восстановленный из кеша"""
+
+    response = requests.Response()
+    response.status_code = 200
+    response._content = content  # pylint: disable=protected-access
+    return response
+
+
+class MdxServer:
+    """
+    Долгоживущий клиент сервера MDX-запросов с пулом keep-alive
+    соединений, таймаутами и кешем результатов. Позволяет отправлять
+    несколько запросов параллельно. Синглтон! Singleton!
+    """
+
+    __instance = None
+
+    @staticmethod
+    def inst():
+        """Реализует Синглтон"""
+        if MdxServer.__instance is None:
+            MdxServer.__instance = MdxServer()
+        return MdxServer.__instance
+
+    def __init__(self, url=URL):
+        self.url = url
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        # для параллельной проверки нескольких запросов
+        self._executor = ThreadPoolExecutor(max_workers=POOL_SIZE)
+
+        self._latency = Histogram()
+
+        self.cache = MdxCache()
+
+        # исполняющиеся запросы по ключу кеша
+        self._pending = {}
+        self._pending_lock = threading.RLock()
+
+    def cellset(self, mdx_query: str, cube: str):
+        """
+        Исполнение MDX-запроса. Возвращает ответ сервера или None,
+        если сервер недоступен или не ответил вовремя
+        """
+
+        content = self.cache.get(mdx_query, cube)
+        if content is not None:
+            return _cached_response(content)
+
+        data_to_post = {'dataMartCode': cube, 'mdxQuery': mdx_query}
+
+        start = time.monotonic()
+        try:
+            response = self._session.post(
+                self.url, data_to_post, timeout=self.timeout)
+
+            # TODO: костыль на тот случай пока сервер отвечает через раз
+            if response.status_code != 200:
+                response = self._session.post(
+                    self.url, data_to_post, timeout=self.timeout)
+        except requests.RequestException as error:
+            logging.error(
+                'Message: Сервер MDX-запросов недоступен: {}'.format(error)
+            )
+            return None
+        finally:
+            self._latency.observe(time.monotonic() - start)
+
+        if _is_cacheable(response):
+            self.cache.put(mdx_query, cube, response.content)
+
+        return response
+
+    def submit(self, mdx_query: str, cube: str):
+        """
+        Асинхронное исполнение MDX-запроса, возвращает Future.
+        Одинаковые запросы, которые уже исполняются, не дублируются
+        """
+
+        key = MdxCache.key(mdx_query, cube)
+
+        with self._pending_lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self.cellset, mdx_query, cube)
+                self._pending[key] = future
+                future.add_done_callback(
+                    lambda _: self._forget_pending(key, future))
+
+        return future
+
+    def _forget_pending(self, key: str, future):
+        """Удаление исполненного запроса из списка исполняющихся"""
+
+        with self._pending_lock:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def latency_stats(self):
+        """Гистограмма времени ответа сервера"""
+
+        return self._latency.snapshot()
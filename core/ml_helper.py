@@ -18,6 +18,7 @@ import pickle
 import re
 
 from peewee import fn
+from scipy import sparse
 from sklearn.ensemble import GradientBoostingClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score, log_loss, classification_report
@@ -88,23 +89,46 @@ class BaseTextClassifier():
         res = self._ind_to_class[self._clf.predict(preprocessed)[0]]
         return res
 
-    def predict_proba(self, req):
+    def predict_proba(self, req, top_k=None):
         """
         Возвращает по запросу значения:
         (ИМЯ_КЛАССА_1, вероятность_1), (ИМЯ_КЛАССА_2, вероятность_2), ...
 
         Гарантируется, что вероятность_1 >= вероятность_2 >= ..
+        Если задан top_k, то возвращаются только top_k наиболее вероятных
         """
-        res = self._clf.predict_proba(self._preprocess_query(req))[0]
-
-        # (ИНДЕКС_КУБА, вероятность) -> сортируем -> (ИМЯ_КУБА, вероятность)
-        return map(lambda x: (self._ind_to_class[x[0]], x[1]),
-                   sorted(
-                       list(enumerate(res.tolist())),
-                       key=lambda x: x[1],
-                       reverse=True
-        )
-        )
+        return self.predict_proba_batch([req], top_k)[0]
+
+    def predict_proba_batch(self, reqs: list, top_k=None):
+        """
+        Пакетная версия predict_proba: признаки всех запросов собираются
+        в одну матрицу, scaler и модель вызываются один раз.
+        Для каждого запроса возвращается список (ИМЯ_КЛАССА, вероятность)
+        по убыванию вероятности, при заданном top_k - только top_k первых
+        """
+        if not reqs:
+            return []
+
+        probas = self._clf.predict_proba(self._preprocess_queries(reqs))
+
+        # устойчивая сортировка: при равных вероятностях порядок классов
+        # тот же, что и у полной сортировки
+        if top_k is None or top_k >= probas.shape[1]:
+            order = np.argsort(-probas, axis=1, kind='stable')
+        else:
+            order = np.argpartition(-probas, top_k - 1, axis=1)[:, :top_k]
+            order.sort(axis=1)
+            top_probas = np.take_along_axis(probas, order, axis=1)
+            order = np.take_along_axis(
+                order,
+                np.argsort(-top_probas, axis=1, kind='stable'),
+                axis=1
+            )
+
+        return [
+            [(self._ind_to_class[ind], row_probas[ind]) for ind in row_order]
+            for row_probas, row_order in zip(probas.tolist(), order.tolist())
+        ]
 
     def train(self):
         """Полностью инкапсулирует обучение модели"""
@@ -122,14 +146,29 @@ class BaseTextClassifier():
 
     def _preprocess_query(self, req):
         """Предобрабатывает запрос так, чтобы его уже можно было отправлять в классификатор"""
-        X = np.zeros((1, len(self._words_to_ind)))
-        req_words = preprocess(req)
-        for word in req_words:
-            if word not in self._words_to_ind:
-                continue
-            X[0, self._words_to_ind[word]] += 1
-        X = self._scaler.transform(X)
-        return X
+        return self._preprocess_queries([req])
+
+    def _preprocess_queries(self, reqs: list):
+        """
+        Матрица признаков для нескольких запросов: счетчики слов
+        собираются в разреженную матрицу, а scaler применяется
+        ко всей матрице один раз
+        """
+        rows, cols = [], []
+        for row, req in enumerate(reqs):
+            for word in preprocess(req):
+                ind = self._words_to_ind.get(word)
+                if ind is not None:
+                    rows.append(row)
+                    cols.append(ind)
+
+        X = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(reqs), len(self._words_to_ind))
+        )
+
+        # scaler обучен с центрированием, поэтому результат плотный
+        return self._scaler.transform(X.toarray())
 
     def _load(self, path: str):
         """Загружает модель. Не должен вызываться явно."""
@@ -451,6 +490,54 @@ def get_folder_lines(test_path):
                 yield line
 
 
+# ToDo: Конечно, надо бы написать какой-нибудь модуль с синонимами, но пока излишне
+FB_MEMBERS = ({"фб"}, {"федеральный", "бюджет"},
+              {"фед", "бюджет"}, {"федбюджет"})
+
+
+class _SubsetIndex:
+    """
+    Инвертированный индекс по упорядоченным множествам слов:
+    каждое множество хранится под своим самым редким словом.
+    first_subset находит первое по порядку множество, которое
+    целиком содержится в наборе слов, просматривая только
+    множества под словами из набора
+    """
+
+    def __init__(self, word_sets):
+        word_sets = [frozenset(word_set) for word_set in word_sets]
+
+        frequency = Counter(word for word_set in word_sets for word in word_set)
+
+        self._postings = {}
+        # пустое множество содержится в любом наборе
+        self._first_empty = None
+        for position, word_set in enumerate(word_sets):
+            if not word_set:
+                if self._first_empty is None:
+                    self._first_empty = position
+                continue
+            key = min(word_set, key=lambda word: (frequency[word], word))
+            self._postings.setdefault(key, []).append((position, word_set))
+
+    def first_subset(self, words: set):
+        """Первое множество, содержащееся в words, или None"""
+
+        best_position, best = self._first_empty, None
+        if best_position is not None:
+            best = frozenset()
+
+        for word in words:
+            for position, word_set in self._postings.get(word, ()):
+                if best_position is not None and position >= best_position:
+                    break
+                if word_set <= words:
+                    best_position, best = position, word_set
+                    break
+
+        return best
+
+
 def preprocess(s: str):
     """
     Возвращает массив токенов по строке
@@ -460,24 +547,33 @@ def preprocess(s: str):
     s = s.replace("2017", "текущийгод")
     s = YEARS_RE.sub("нетекущийгод", s)
     res = set(WORDS_RE.findall(s))
-    for terr in get_territories():
-        if terr.issubset(res):
-            res = res.difference(terr)
-            res.add("члентерритория")
-            break
-
-    # ToDo: Конечно, надо бы написать какой-нибудь модуль с синонимами, но пока излишне
-    fb_members = [{"фб"}, {"федеральный", "бюджет"},
-                  {"фед", "бюджет"}, {"федбюджет"}]
-    for fb in fb_members:
-        if fb.issubset(res):
-            res = res.difference(fb)
-            res.add("членфедбюджет")
-            break
+
+    terr = get_territory_index().first_subset(res)
+    if terr is not None:
+        res = res.difference(terr)
+        res.add("члентерритория")
+
+    fb = preprocess.fb_index.first_subset(res)
+    if fb is not None:
+        res = res.difference(fb)
+        res.add("членфедбюджет")
 
     return tuple(res)
 
 
+preprocess.fb_index = _SubsetIndex(FB_MEMBERS)
+
+
+def get_territory_index():
+    """Индекс территорий для поиска в запросе. Кешируется"""
+    if get_territory_index.index is None:
+        get_territory_index.index = _SubsetIndex(get_territories())
+    return get_territory_index.index
+
+
+get_territory_index.index = None
+
+
 def get_territories():
     """Возвращает территории, которые хранятся в базе. Кешируется"""
     if get_territories.territories:
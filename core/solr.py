@@ -5,40 +5,167 @@
 Взаимодействие с Apache Solr
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
+import time
 
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 import requests
 
 from config import SETTINGS
 from model_manager import MODEL_CONFIG
+from utils.metrics import Histogram
 import logs_helper  # pylint: disable=unused-import
 
 
+# Настройки клиента, которые можно переопределить в settings.json (раздел SOLR)
+CONNECT_TIMEOUT = getattr(SETTINGS.SOLR, 'CONNECT_TIMEOUT', 3)
+READ_TIMEOUT = getattr(SETTINGS.SOLR, 'READ_TIMEOUT', 10)
+MAX_RETRIES = getattr(SETTINGS.SOLR, 'MAX_RETRIES', 2)
+RETRY_BACKOFF = getattr(SETTINGS.SOLR, 'RETRY_BACKOFF', 0.3)
+POOL_SIZE = getattr(SETTINGS.SOLR, 'POOL_SIZE', 10)
+
+# Поля, которые реально используются дальше по конвейеру, для каждого типа
+# документов. Территории хранят значения для кубов в полях с именами кубов,
+# поэтому для них запрашиваются все поля (используется только лучшая)
+DOC_TYPE_FIELDS = {
+    'dim_member': (
+        'cube', 'dimension', 'cube_value',
+        'connected_value.dimension_cube_value',
+        'connected_value.member_cube_value'
+    ),
+    'year_dim_member': ('dimension', 'cube_value'),
+    'terr_dim_member': ('*',),
+    'cube': ('cube', 'dimensions', 'default_measure'),
+    'measure': ('cube', 'cube_value', 'lem_member_caption'),
+    'minfin': (),
+}
+
+# Поля, которые при разделении поисковой и технической информации
+# подтягиваются из технических файлов, а иначе хранятся в Solr
+DOC_TYPE_TECH_FIELDS = {
+    'dim_member': ('member_caption',),
+    'measure': ('member_caption',),
+    'minfin': (
+        'number', 'question', 'short_answer', 'full_answer',
+        'link_name', 'link',
+        'picture_caption', 'picture',
+        'document_caption', 'document'
+    ),
+}
+
+COMMON_FIELDS = ('type', 'score', 'inner_id')
+
+BOOST_FUNCTION = (
+    "sum(if(exists(lem_member_caption_len),recip(lem_member_caption_len,1.2,2,0),0)," +
+    "if(exists(lem_question_len),recip(lem_question_len,1,5,2),0))"
+)
+
+
 class Solr:
     """
-    Класс для взимодействия с поисковой системой Apache Solr
+    Класс для взимодействия с поисковой системой Apache Solr.
+    Долгоживущий клиент с пулом keep-alive соединений, таймаутами
+    и ограниченным числом повторов. Синглтон! Singleton!
     """
 
+    __instance = None
+
     @staticmethod
-    def get_data(user_request: str, request_id: str, core: str):
-        """Реализация запроса к Solr"""
+    def inst():
+        """Реализует Синглтон"""
+        if Solr.__instance is None:
+            Solr.__instance = Solr()
+        return Solr.__instance
 
-        request = 'http://{}:8983/solr/{}/select'.format(
-            SETTINGS.SOLR_HOST,
-            core
+    def __init__(self, host=SETTINGS.SOLR_HOST):
+        self.host = host
+        self.timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+        # повторы только для идемпотентных запросов и ошибок сервера
+        retries = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=(500, 502, 503, 504)
+        )
+        adapter = HTTPAdapter(
+            pool_connections=POOL_SIZE,
+            pool_maxsize=POOL_SIZE,
+            max_retries=retries
         )
 
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+
+        # для параллельных запросов по типам документов. Пул общий для
+        # всех потоков сервера, поэтому он того же размера, что и пул
+        # соединений, а не одного запроса
+        self._executor = ThreadPoolExecutor(max_workers=POOL_SIZE)
+
+        self._admin_url = 'http://{}:8983/solr/admin/cores'.format(host)
+        self._core_urls = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+
+        # основное ядро известно заранее
+        self.core_url(SETTINGS.SOLR_MAIN_CORE)
+
+    def core_url(self, core: str):
+        """Базовый URL ядра, вычисляется один раз"""
+
+        url = self._core_urls.get(core)
+        if url is None:
+            with self._lock:
+                url = self._core_urls.get(core)
+                if url is None:
+                    # гистограмма появляется раньше URL: кто видит URL,
+                    # тот найдет и гистограмму
+                    self._latency[core] = Histogram()
+                    url = 'http://{}:8983/solr/{}'.format(self.host, core)
+                    self._core_urls[core] = url
+        return url
+
+    def get_data(self, user_request: str, request_id: str, core: str):
+        """Реализация запроса к Solr"""
+
         # обработка опечаток
         if MODEL_CONFIG["process_misspellings"]:
             user_request = Solr.screen_bad_spelling(user_request)
 
+        if MODEL_CONFIG["solr_split_request_by_doc_type"]:
+            docs, stats = self._select_by_doc_type(core, user_request)
+        else:
+            docs, stats = self.select(core, Solr.search_params(user_request))
+
+        logging.info(
+            'Query_ID: {}\tMessage: Solr нашел {} документ(ов), '
+            'макс. score = {}, за {:.3f} сек. ({} байт)'.format(
+                request_id,
+                docs['response']['numFound'],
+                docs['response'].get('maxScore', 0),
+                stats['seconds'],
+                stats['bytes']
+            )
+        )
+
+        return docs
+
+    @staticmethod
+    def search_params(user_request: str, doc_type: str = None):
+        """
+        Параметры поискового запроса. Если указан тип документов,
+        то запрашиваются только документы этого типа, только нужные
+        для него поля и не больше его бюджета строк
+        """
+
         params = {
             'q': user_request,
             'rows': MODEL_CONFIG["solr_documents_to_return"],
             'wt': 'json',
             'fl': '*,score',
-            "bf": "sum(if(exists(lem_member_caption_len),recip(lem_member_caption_len,1.2,2,0),0)," +
-                  "if(exists(lem_question_len),recip(lem_question_len,1,5,2),0))",
+            "bf": BOOST_FUNCTION,
             'defType': "edismax"  # тип парсера, этот самый мощный
         }
 
@@ -54,17 +181,121 @@ class Solr:
         # 1.5,5,0 -> 0.89,0.92 по минфину
         # 2.5, 8, 0 -> 0.89,0.92 по минфину
 
-        docs = requests.get(request, params=params).json()
+        if doc_type:
+            fields = COMMON_FIELDS + DOC_TYPE_FIELDS[doc_type]
+            if not MODEL_CONFIG['enable_searching_and_tech_info_separation']:
+                fields += DOC_TYPE_TECH_FIELDS.get(doc_type, ())
 
-        logging.info(
-            'Query_ID: {}\tMessage: Solr нашел {} документ(ов), макс. score = {}'.format(
-                request_id,
-                docs['response']['numFound'],
-                docs['response'].get('maxScore', 0)
+            params['fq'] = 'type:{}'.format(doc_type)
+            params['fl'] = ','.join(fields)
+            params['rows'] = MODEL_CONFIG["solr_documents_to_return_by_type"][doc_type]
+
+        return params
+
+    def _select_by_doc_type(self, core: str, user_request: str):
+        """
+        Параллельные запросы по каждому типу документов со своими
+        полями и бюджетом строк. Результат приводится к виду
+        обычного ответа Solr, документы упорядочены по убыванию score
+        и обрезаются до solr_documents_to_return, как и в общем запросе.
+        Фильтр fq не влияет на score, поэтому при бюджетах типов не
+        меньше того, сколько документов типа может попасть в общую
+        выдачу, набор и порядок документов те же (с точностью до
+        порядка документов с равным score)
+        """
+
+        def select_doc_type(doc_type):
+            return self.select(core, Solr.search_params(user_request, doc_type))
+
+        start = time.monotonic()
+        results = list(self._executor.map(select_doc_type, DOC_TYPE_FIELDS))
+        seconds = time.monotonic() - start
+
+        docs = []
+        num_found, max_score = 0, 0
+        stats = {'seconds': seconds, 'bytes': 0, 'decode_seconds': 0}
+
+        for type_docs, type_stats in results:
+            type_response = type_docs['response']
+            num_found += type_response['numFound']
+            max_score = max(max_score, type_response.get('maxScore', 0))
+            docs.extend(type_response['docs'])
+
+            stats['bytes'] += type_stats['bytes']
+            stats['decode_seconds'] += type_stats['decode_seconds']
+
+        docs.sort(key=lambda doc: doc['score'], reverse=True)
+        del docs[MODEL_CONFIG["solr_documents_to_return"]:]
+
+        response = {'numFound': num_found, 'maxScore': max_score, 'docs': docs}
+
+        return {'response': response}, stats
+
+    def select(self, core: str, params: dict):
+        """
+        Поисковый запрос к ядру. Возвращает JSON-ответ и статистику:
+        время получения, размер ответа и время декодирования JSON
+        """
+
+        url = self.core_url(core) + '/select'
+
+        start = time.monotonic()
+        response = self._session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+
+        decode_start = time.monotonic()
+        docs = response.json()
+        end = time.monotonic()
+
+        self._latency[core].observe(end - start)
+
+        stats = {
+            'seconds': end - start,
+            'bytes': len(response.content),
+            'decode_seconds': end - decode_start
+        }
+
+        return docs, stats
+
+    def clear_index(self, core: str):
+        """Удаление всех документов из ядра"""
+
+        return self._session.post(
+            self.core_url(core) + '/update',
+            params={'commit': 'true'},
+            json={'delete': {'query': '*:*'}},
+            timeout=self.timeout
+        )
+
+    def index_file(self, core: str, file_path: str):
+        """Отправка JSON файла с документами на индексацию в ядро"""
+
+        with open(file_path, 'rb') as file:
+            return self._session.post(
+                self.core_url(core) + '/update',
+                params={'commit': 'true'},
+                data=file,
+                headers={'Content-Type': 'application/json'},
+                # индексация может быть долгой
+                timeout=(CONNECT_TIMEOUT, None)
             )
+
+    def admin(self, params: dict):
+        """Запрос к API управления ядрами"""
+
+        return self._session.get(
+            self._admin_url,
+            params=params,
+            timeout=self.timeout
         )
 
-        return docs
+    def latency_stats(self):
+        """Гистограммы времени ответа Solr по ядрам"""
+
+        with self._lock:
+            latency = list(self._latency.items())
+
+        return {core: histogram.snapshot() for core, histogram in latency}
 
     @staticmethod
     def screen_bad_spelling(user_request: str):
@@ -5,17 +5,21 @@
 Вспомогательные методы для работы с кубами
 """
 
-from os import path
+from collections import ChainMap
+from os import path, stat
+import copy
 import datetime
 import json
 import logging
 import re
+import time
 
 import requests
 
 from config import SETTINGS
 from config import TECH_CUBE_DOCS_FILE, TECH_MINFIN_DOCS_FILE
 from constants import ERROR_GENERAL, ERROR_NULL_DATA_FOR_SUCH_REQUEST
+from core.mdx_server import MdxServer
 from kb.kb_support_library import get_caption_for_measure
 from kb.kb_support_library import get_captions_for_dimensions
 from kb.kb_support_library import get_cube_caption
@@ -23,11 +27,20 @@ from kb.kb_support_library import get_default_member_for_dimension
 from kb.kb_support_library import get_representation_format
 from model_manager import MODEL_CONFIG
 from nlp.feedback_maker import BackFeeder
+from utils.trace import trace_event
 import logs_helper  # pylint: disable=unused-import
 
 
+# как часто проверяются файлы технической информации, секунд
+TECH_DATA_CHECK_INTERVAL = 1
+
+
 class CubeData:
-    """Структура для данных передаваемых между узлами"""
+    """
+    Структура для данных передаваемых между узлами.
+    Документы Solr внутри общие для всех копий и не изменяются
+    на месте: функции узлов и постобработка заменяют их новыми
+    """
 
     def __init__(self, user_request='', norm_user_request='', request_id=''):
         self.user_request = user_request
@@ -42,8 +55,22 @@ class CubeData:
         self.selected_measure = None
         self.measures = []
         self.mdx_query = ''
+        self.mdx_value = None
         self.score = {}
 
+    def copy(self):
+        """
+        Копия для отдельного прогона дерева: собственные списки
+        и скор, но общие документы (копирование при записи)
+        """
+
+        cube_data_copy = copy.copy(self)
+        cube_data_copy.cubes = list(self.cubes)
+        cube_data_copy.members = list(self.members)
+        cube_data_copy.measures = list(self.measures)
+        cube_data_copy.score = dict(self.score)
+        return cube_data_copy
+
 
 class MinfinData:
     """Промежуточная структура данных по Минфину"""
@@ -73,21 +100,7 @@ def send_request_to_server(mdx_query: str, cube: str):
     ответа по MDX-запросу
     """
 
-    # Подготовка POST-данных и запрос к серверу
-    data_to_post = {'dataMartCode': cube, 'mdxQuery': mdx_query}
-    api_response = requests.post(
-        'http://conf.prod.fm.epbs.ru/mdxexpert/CellsetByMdx',
-        data_to_post
-    )
-
-    # TODO: костыль на тот случай пока сервер отвечает через раз
-    if api_response.status_code != 200:
-        api_response = requests.post(
-            'http://conf.prod.fm.epbs.ru/mdxexpert/CellsetByMdx',
-            data_to_post
-        )
-
-    return api_response
+    return MdxServer.inst().cellset(mdx_query, cube)
 
 
 def form_feedback(mdx_query: str, user_request: str):
@@ -278,7 +291,16 @@ def process_server_response(cube_answer, response: requests):
     от сервера Кристы
     """
 
-    if response.status_code == 200:
+    if response is None:
+        cube_answer.status = False
+        cube_answer.message = ERROR_GENERAL
+        logging.error(
+            'Query_ID: {}\tMessage: Сервер не ответил на запрос'.format(
+                cube_answer.request_id
+            )
+        )
+        return
+    elif response.status_code == 200:
         try:
             response = response.json()
         except json.JSONDecodeError:
@@ -317,37 +339,30 @@ def process_server_response(cube_answer, response: requests):
         cube_answer.status = False
         cube_answer.message = ERROR_NULL_DATA_FOR_SUCH_REQUEST
         cube_answer.response = None
-        logging.info(
-            "Query ID: {}\tMessage: Данных по запросу нет".format(
-                cube_answer.request_id
-            ))
+        trace_event(cube_answer.request_id, 'mdx_response', value=None)
 
         return
     # В остальных случаях, то есть когда все хорошо
     else:
         value = float(response["cells"][0][0]["value"])
 
-        logging.info(
-            "Query ID: {}\tMessage: Ответ на MDX-запрос -  {}".format(
-                cube_answer.request_id,
-                value
-            ))
+        trace_event(cube_answer.request_id, 'mdx_response', value=value)
 
         return value
 
 
-def check_mdx_returns_data(response: requests):
+def mdx_cell_value(response: requests):
     """
     Быстрая обработка ответа сервера, специально для отсеивания запросов,
-    не возвращающих данные
+    не возвращающих данные. Возвращает значение ячейки или None
     """
 
-    if response.status_code == 200:
-        try:
-            response = response.json()
-        except json.JSONDecodeError:
-            return
-    else:
+    if response is None or response.status_code != 200:
+        return
+
+    try:
+        response = response.json()
+    except json.JSONDecodeError:
         return
 
     # Обработка случая, когда MDX-запрос некорректный
@@ -358,7 +373,7 @@ def check_mdx_returns_data(response: requests):
         return
     # В остальных случаях, то есть когда все хорошо
     else:
-        return True
+        return float(response["cells"][0][0]["value"])
 
 
 def process_cube_answer(cube_answer, value):
@@ -420,11 +435,7 @@ def process_cube_answer(cube_answer, value):
     verbal += ' '.join([str(idx + 2) + '. ' + val['member_caption']
                         for idx, val in enumerate(feedback_verbal['dims'])])
 
-    logging.info(
-        'Query_ID: {}\tMessage: {}'.format(
-            cube_answer.request_id,
-            "Выделенные параметры - " + verbal
-        ))
+    trace_event(cube_answer.request_id, 'selected_params', verbal=verbal)
 
 
 def check_if_year_is_current(cube_data: CubeData):
@@ -498,8 +509,7 @@ def group_documents(
 
     for doc in solr_documents:
         if doc['type'] == 'dim_member':
-            combine_search_tech_cube_data(doc)
-            cube_data.members.append(doc)
+            cube_data.members.append(combine_search_tech_cube_data(doc))
         elif doc['type'] == 'year_dim_member':
             cube_data.year_member = doc
         elif doc['type'] == 'terr_dim_member':
@@ -509,87 +519,128 @@ def group_documents(
         elif doc['type'] == 'cube':
             cube_data.cubes.append(doc)
         elif doc['type'] == 'measure':
-            combine_search_tech_cube_data(doc)
-            cube_data.measures.append(doc)
+            cube_data.measures.append(combine_search_tech_cube_data(doc))
         elif doc['type'] == 'minfin':
-            combine_search_tech_minfin_data(doc)
-            minfin_data.documents.append(doc)
-
-    logging.info(
-        "Query_ID: {}\tMessage: Найдено {} cubes, "
-        "{} dim_members, {} year_dim_member, {} terr_dim_member, {} measures".format(
-            request_id,
-            len(cube_data.cubes),
-            len(cube_data.members),
-            1 if cube_data.year_member else 0,
-            1 if cube_data.terr_member else 0,
-            len(cube_data.measures)
-        ))
+            minfin_data.documents.append(
+                combine_search_tech_minfin_data(doc)
+            )
+
+    trace_event(
+        request_id, 'documents',
+        cubes=len(cube_data.cubes),
+        dim_members=len(cube_data.members),
+        year_dim_member=1 if cube_data.year_member else 0,
+        terr_dim_member=1 if cube_data.terr_member else 0,
+        measures=len(cube_data.measures),
+        minfin=len(minfin_data.documents)
+    )
 
     return minfin_data, cube_data
 
 
+def _index_tech_data(data: list):
+    """
+    Индекс технических документов по inner_id. В значениях
+    остаются только поля, которых нет в поисковом документе
+    """
+
+    index = {}
+    for doc in data:
+        tech_doc = dict(doc)
+        inner_id = tech_doc.pop('inner_id')
+        index[inner_id] = tech_doc
+    return index
+
+
+def _load_tech_data(cache, file_path: str):
+    """
+    Индекс технической информации из файла file_path, хранящийся
+    в атрибутах функции cache. Строится заново, если изменилась
+    отметка (время изменения, размер) файла: переиндексация базы
+    знаний в другом процессе видна работающему серверу. Отметка
+    проверяется не чаще, чем раз в TECH_DATA_CHECK_INTERVAL секунд,
+    а не на каждый найденный документ
+    """
+
+    now = time.monotonic()
+    if (cache.data is not None and
+            now - cache.checked_at < TECH_DATA_CHECK_INTERVAL):
+        return cache.data
+
+    file_stat = stat(file_path)
+    stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    if stamp != cache.stamp:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            data = _index_tech_data(json.loads(file.read()))
+        cache.data, cache.stamp = data, stamp
+
+    cache.checked_at = now
+    return cache.data
+
+
 def minfin_tech_data():
     """Чтение технической информации по Минфину"""
 
-    if not minfin_tech_data.data:
-        file_to_minfin_tech_file = path.join(
-            SETTINGS.PATH_TO_MINFIN_ATTACHMENTS,
-            TECH_MINFIN_DOCS_FILE
-        )
-
-        with open(file_to_minfin_tech_file, 'r', encoding='utf-8') as file:
-            data = json.loads(file.read())
-            minfin_tech_data.data = data
-    return minfin_tech_data.data
+    return _load_tech_data(minfin_tech_data, path.join(
+        SETTINGS.PATH_TO_MINFIN_ATTACHMENTS,
+        TECH_MINFIN_DOCS_FILE
+    ))
 
 
 minfin_tech_data.data = None
+minfin_tech_data.stamp = None
+minfin_tech_data.checked_at = 0
 
 
 def cube_tech_data():
     """Чтение технической информации по кубам"""
 
-    if not cube_tech_data.data:
-        with open(TECH_CUBE_DOCS_FILE, 'r', encoding='utf-8') as file:
-            data = json.loads(file.read())
-            cube_tech_data.data = data
-
-    return cube_tech_data.data
+    return _load_tech_data(cube_tech_data, TECH_CUBE_DOCS_FILE)
 
 
 cube_tech_data.data = None
+cube_tech_data.stamp = None
+cube_tech_data.checked_at = 0
+
+
+def reload_tech_data():
+    """
+    Сброс закешированной технической информации. Изменения файлов
+    замечаются и без этого, сброс нужен, если файл подменен с той же
+    отметкой времени и размером. Индексы будут построены заново
+    при следующем обращении
+    """
+
+    cube_tech_data.data, cube_tech_data.stamp = None, None
+    minfin_tech_data.data, minfin_tech_data.stamp = None, None
 
 
 def combine_search_tech_minfin_data(found_minfin_doc: dict):
     """
     Объединение найденной и технической информации
-    по Минфину
+    по Минфину (см. combine_search_tech_cube_data)
     """
     if MODEL_CONFIG['enable_searching_and_tech_info_separation']:
-        data = minfin_tech_data()
-        needed_doc = [
-            doc for doc in data
-            if doc['inner_id'] == found_minfin_doc['inner_id']
-        ]
+        tech_doc = minfin_tech_data()[found_minfin_doc['inner_id']]
+        return ChainMap({}, tech_doc, found_minfin_doc)
 
-        for key, value in needed_doc[0].items():
-            found_minfin_doc[key] = value
+    return found_minfin_doc
 
 
 def combine_search_tech_cube_data(found_cube_doc: dict):
     """
-    Объединение найденной и технической информации по кубу
+    Объединение найденной и технической информации по кубу.
+    Поля не копируются: возвращается представление, в котором поиск
+    ключа идет сначала по собственным изменениям, затем по
+    техническому документу и по найденному. Запись попадает
+    в собственный словарь представления, а не в общий индекс
     """
     if MODEL_CONFIG['enable_searching_and_tech_info_separation']:
-        data = cube_tech_data()
-        needed_doc = [
-            doc for doc in data
-            if doc['inner_id'] == found_cube_doc['inner_id']
-        ]
+        tech_doc = cube_tech_data()[found_cube_doc['inner_id']]
+        return ChainMap({}, tech_doc, found_cube_doc)
 
-        for key, value in needed_doc[0].items():
-            found_cube_doc[key] = value
+    return found_cube_doc
 
 
 def score_cube_question(cube_data: CubeData):
@@ -657,12 +708,18 @@ def preprocess_territory_member(cube_data: CubeData):
     """
     if cube_data.terr_member:
         if cube_data.terr_member['cube_value'] != '08-2':
-            for member in list(cube_data.members):
+            members = []
+            for member in cube_data.members:
                 if member['cube_value'] in ('09-1', '09-8', '09-9', '09-10', '09-20'):
-                    cube_data.members.remove(member)
+                    continue
                 elif member['cube_value'].startswith('09-'):
+                    # документ общий для всех путей дерева, поэтому
+                    # связанные значения убираются в копии
+                    member = dict(member)
                     member.pop('connected_value.dimension_cube_value', None)
                     member.pop('connected_value.member_cube_value', None)
+                members.append(member)
+            cube_data.members = members
         else:
             for member in cube_data.members:
                 bglevels_without_territory = (
@@ -899,36 +956,25 @@ def best_answer_depending_on_cube(cube_data_list: list, correct_cube: str):
                         reverse=True
                     )
 
-                    logging.info(
-                        "Query_ID: {}\tMessage: {}".format(
-                            cube_data.request_id,
-                            'Лучший ответ был сменен. Был куб {}, '
-                            'стал {}, лучший путь {}'.format(
-                                used_cube,
-                                correct_cube,
-                                cube_data.tree_path
-                            )
-                        )
-                    )
+                    # лучший ответ сменен на ответ по кубу из классификатора
+                    trace_event(
+                        cube_data.request_id, 'best_cube',
+                        changed=True, before=used_cube, after=correct_cube,
+                        tree_path=cube_data.tree_path)
 
                     return
         else:
-            logging.info(
-                "Query_ID: {}\tMessage: {}".format(
-                    cube_data_list[0].request_id,
-                    'Куб алгоритмически лучшего ответа '
-                    'совпадает с кубом из классификатора'
-                )
-            )
+            # куб алгоритмически лучшего ответа совпадает с кубом из классификатора
+            trace_event(
+                cube_data_list[0].request_id, 'best_cube',
+                changed=False, cube=used_cube)
             return
 
-        logging.info(
-            "Query_ID: {}\tMessage: {}".format(
-                cube_data_list[0].request_id,
-                "Выбор лучшим запроса на основе куба из "
-                "классификатора не возможен, нет подходящих путей"
-            )
-        )
+        # выбор лучшего ответа на основе куба из
+        # классификатора не возможен, нет подходящих путей
+        trace_event(
+            cube_data_list[0].request_id, 'best_cube',
+            changed=False, cube=used_cube, classifier_cube=correct_cube)
     else:
         logging.info(
             "Message: нет данных для выбора лучшего "
@@ -972,46 +1018,80 @@ def delete_repetitions(cube_data_list: list):
 
         after_deleting = len(cube_data_list)
 
-        logging.info(
-            "Query_ID: {}\tMessage: Удаление {} повторяющихся запросов".format(
-                request_id,
-                before_deleting - after_deleting
-            )
-        )
+        trace_event(
+            request_id, 'delete_repetitions',
+            deleted=before_deleting - after_deleting)
 
 
-def filter_cube_data_without_answer(cube_data_list: list):
+def filter_cube_data_without_answer(cube_data_list: list, correct_cube: str = None):
     """
-    Метод, который оставляет в списке только возвращающие данные запросы
+    Метод, который оставляет в списке только возвращающие данные запросы.
+    Запросы к серверу отправляются параллельно волнами: впереди
+    разбираемого кандидата исполняется не больше запросов, чем не хватает
+    подтвержденных ответов (и ответа по кубу из классификатора, если он
+    еще не подтвержден). Результаты разбираются в порядке списка, и как
+    только подтверждено достаточно ответов, оставшиеся кандидаты
+    отбрасываются, не отправляясь на сервер. Полученное значение
+    сохраняется, чтобы не запрашивать его повторно для главного ответа.
+
+    В отличие от проверки всех кандидатов, в списке остаются не все
+    возвращающие данные запросы, а только первые
+    cube_answers_with_data_to_confirm подтвержденных (и дальше до
+    подтверждения куба из классификатора). Видимые ответы от этого
+    не меняются: список упорядочен по убыванию скора, кроме обмена
+    скором лучшего ответа и первого ответа по кубу классификатора,
+    который не дальше последнего оставленного. Поэтому каждый
+    оставленный ответ по скору не ниже любого отброшенного, а
+    показывается не больше главного и пяти "смотри также", то есть
+    не больше cube_answers_with_data_to_confirm (6) ответов по кубам
     """
 
     confidence = True
 
     if cube_data_list:
+        start = time.monotonic()
         request_id = cube_data_list[0].request_id
         before_filtering = len(cube_data_list)
+        enough = MODEL_CONFIG["cube_answers_with_data_to_confirm"]
 
-        for idx, cube_data in enumerate(list(cube_data_list)):
+        mdx_server = MdxServer.inst()
+        futures = []
 
-            response = send_request_to_server(
-                cube_data.mdx_query,
-                cube_data.selected_cube['cube']
-            )
+        confirmed, correct_cube_confirmed = [], not correct_cube
+        checked = 0
 
-            if not check_mdx_returns_data(response):
-                cube_data_list.remove(cube_data)
+        for idx, cube_data in enumerate(cube_data_list):
+            needed = max(enough - len(confirmed), 0 if correct_cube_confirmed else 1)
+            if not needed:
+                break
+
+            # следующая волна запросов, не больше, чем не хватает ответов
+            submit_until = min(idx + needed, len(cube_data_list))
+            for candidate in cube_data_list[len(futures):submit_until]:
+                futures.append(mdx_server.submit(
+                    candidate.mdx_query,
+                    candidate.selected_cube['cube']
+                ))
+
+            cube_data.mdx_value = mdx_cell_value(futures[idx].result())
+            checked += 1
+
+            if cube_data.mdx_value is not None:
+                confirmed.append(cube_data)
+                if cube_data.selected_cube['cube'] == correct_cube:
+                    correct_cube_confirmed = True
+            elif idx == 0:
                 # Если лучший ответ удаляется
-                if idx == 0:
-                    confidence = False
+                confidence = False
 
-        after_filtering = len(cube_data_list)
+        cube_data_list[:] = confirmed
 
-        logging.info(
-            'Query_ID: {}\tMessage: {} запрос(a/ов) не имели данных'.format(
-                request_id,
-                before_filtering - after_filtering
-            )
-        )
+        trace_event(
+            request_id, 'mdx_checks', time.monotonic() - start,
+            mdx_calls=checked,
+            mdx_submitted=len(futures),
+            confirmed=len(confirmed),
+            filtered=before_filtering - len(cube_data_list))
 
         return confidence
 
@@ -1055,10 +1135,7 @@ def check_real_territory_existence(cube_data: CubeData):
 
         if not count:
             cube_data.terr_member = None
-            logging.info(
-                'Query_ID: {}\tMessage: Найденная территория '
-                'была удалена'.format(cube_data.request_id)
-            )
+            trace_event(cube_data.request_id, 'territory_removed')
 
 
 def check_real_bglevel_existence(cube_data: CubeData):
@@ -1088,10 +1165,6 @@ def check_real_bglevel_existence(cube_data: CubeData):
 
             if bglevel and not any(kw in cube_data.norm_user_request for kw in bglevel):
                 cube_data.members.remove(member)
-                logging.info(
-                    "Query_ID: {}\tMessage: Элемент BGLEVELS {} "
-                    "был удален".format(
-                        cube_data.request_id,
-                        member['cube_value']
-                    )
-                )
+                trace_event(
+                    cube_data.request_id, 'bglevel_removed',
+                    cube_value=member['cube_value'])
@@ -5,13 +5,17 @@
 Управление классами ядра системы
 """
 
-from os import path
+from concurrent.futures import ThreadPoolExecutor
+from os import path, stat
+import copy
 import json
-import logging
+import time
 
 from config import SETTINGS
 from config import TEST_PATH_RESULTS, WRONG_AUTO_MINFIN_TESTS_FILE
+from constants import ERROR_GENERAL
 from constants import ERROR_NO_DOCS_FOUND, ERROR_REQUEST_CONTAINS_BAD_WORD
+from core.answer_cache import AnswerCache
 from core.answer_object import CoreAnswer
 from core.cube_classifier import CubeClassifier
 from core.cube_docs_processing import CubeAnswer
@@ -25,9 +29,15 @@ from core.support_library import process_server_response
 from core.support_library import send_request_to_server
 from model_manager import MODEL_CONFIG
 from text_preprocessing import TextPreprocessing
+from utils.metrics import MetricsRegistry
+from utils.trace import finish_trace, get_trace, start_trace, trace_event
 import logs_helper  # pylint: disable=unused-import
 
 
+# Сколько запросов пакета одновременно отправляется в Solr
+SOLR_BATCH_CONCURRENCY = getattr(SETTINGS.SOLR, 'BATCH_CONCURRENCY', 4)
+
+
 class DataRetrieving:
     """
     Модуль связывающие в себе результаты работы Apache Solr,
@@ -36,23 +46,165 @@ class DataRetrieving:
 
     TPP = TextPreprocessing(label='DATRET', delete_question_words=False)
 
-    # хранение данных в памяти
-    _minfin_auto_wrong_data = None
+    # индекс некорректных авто-тестов по Минфину в памяти
+    # и отметка (время изменения, размер) файла, по которому он построен
+    _minfin_auto_wrong_index = None
+    _minfin_auto_wrong_stamp = None
 
     @staticmethod
     def get_data(user_request: str, request_id: str):
         """API метод к ядру системы"""
 
+        trace = start_trace(request_id)
+        try:
+            with trace.stage('prepare'):
+                core_answer, prepared = DataRetrieving._prepare_request(
+                    user_request,
+                    request_id
+                )
+
+            if prepared is None:
+                return core_answer
+
+            # получение результатов поиска от Apache Solr в JSON-строке
+            with trace.stage('solr') as fields:
+                solr_response = Solr.inst().get_data(
+                    prepared['norm_user_request'],
+                    request_id,
+                    SETTINGS.SOLR_MAIN_CORE
+                )['response']
+                fields['num_found'] = solr_response['numFound']
+
+            return DataRetrieving._process_solr_response(
+                core_answer,
+                prepared,
+                solr_response,
+                request_id
+            )
+        finally:
+            finish_trace(request_id)
+
+    @staticmethod
+    def get_data_batch(user_requests: list, request_ids: list):
+        """
+        Пакетный API метод к ядру системы. Все запросы нормализуются
+        до поиска, одинаковые нормализованные запросы обрабатываются
+        один раз, запросы к Solr отправляются параллельно, а оба
+        классификатора вызываются один раз на весь пакет.
+        Ответы возвращаются в порядке запросов
+        """
+
+        for request_id in request_ids:
+            start_trace(request_id)
+
+        try:
+            return DataRetrieving._get_data_batch(user_requests, request_ids)
+        finally:
+            for request_id in request_ids:
+                finish_trace(request_id, batch_size=len(request_ids))
+
+    @staticmethod
+    def _get_data_batch(user_requests: list, request_ids: list):
+        """Обработка пакета запросов (см. get_data_batch)"""
+
+        answers, prepared_requests = [], []
+        for user_request, request_id in zip(user_requests, request_ids):
+            with get_trace(request_id).stage('prepare'):
+                core_answer, prepared = DataRetrieving._prepare_request(
+                    user_request,
+                    request_id
+                )
+            answers.append(core_answer)
+            prepared_requests.append(prepared)
+
+        # запросы, требующие поиска, без повторов внутри пакета
+        to_search, duplicates = [], {}
+        for idx, prepared in enumerate(prepared_requests):
+            if prepared is None:
+                continue
+            first_idx = duplicates.setdefault(prepared['cache_key'], idx)
+            if first_idx == idx:
+                to_search.append(idx)
+
+        def search(idx):
+            with get_trace(request_ids[idx]).stage('solr') as fields:
+                solr_response = Solr.inst().get_data(
+                    prepared_requests[idx]['norm_user_request'],
+                    request_ids[idx],
+                    SETTINGS.SOLR_MAIN_CORE
+                )['response']
+                fields['num_found'] = solr_response['numFound']
+            return solr_response
+
+        with ThreadPoolExecutor(max_workers=SOLR_BATCH_CONCURRENCY) as executor:
+            solr_responses = list(executor.map(search, to_search))
+
+        requests_to_classify = [user_requests[idx] for idx in to_search]
+        start = time.monotonic()
+        cube_predictions = CubeClassifier.inst().predict_proba_batch(
+            requests_to_classify, top_k=1)
+        type_predictions = CubeOrMinfinClassifier.inst().predict_proba_batch(
+            requests_to_classify, top_k=1)
+        classification_seconds = time.monotonic() - start
+
+        for idx in to_search:
+            trace_event(
+                request_ids[idx], 'classification', classification_seconds,
+                batch=len(to_search))
+
+        for idx, solr_response, cube_prediction, type_prediction in zip(
+                to_search, solr_responses, cube_predictions, type_predictions
+        ):
+            answers[idx] = DataRetrieving._process_solr_response(
+                answers[idx],
+                prepared_requests[idx],
+                solr_response,
+                request_ids[idx],
+                cube_prediction[0],
+                type_prediction[0]
+            )
+
+        # повторяющиеся запросы получают копию ответа
+        for idx, prepared in enumerate(prepared_requests):
+            if prepared is None:
+                continue
+            first_idx = duplicates[prepared['cache_key']]
+            if first_idx != idx:
+                answers[idx] = copy.deepcopy(answers[first_idx])
+                answers[idx].user_request = user_requests[idx]
+
+        return answers
+
+    @staticmethod
+    def _prepare_request(user_request: str, request_id: str):
+        """
+        Обработка запроса до поиска: нормализация, кеш ответов
+        и плохие слова. Возвращает ответ и данные для поиска,
+        либо готовый ответ и None, если поиск не нужен
+        """
+
         core_answer = CoreAnswer()
         core_answer.user_request = user_request
 
         if user_request.lower().startswith("кто будет"):
-            return core_answer
+            return core_answer, None
 
-        norm_user_request = DataRetrieving._preprocess_user_request(
-            core_answer.user_request,
-            request_id
-        )
+        # готовый ответ на такой же запрос: ключ - исходный текст,
+        # так как классификаторы работают не с нормализованным запросом
+        cache_key = user_request
+        cached_answer = AnswerCache.inst().get(cache_key)
+        if cached_answer is not None:
+            cached_answer.user_request = user_request
+
+            trace_event(request_id, 'answer_cache', hit=True)
+
+            return cached_answer, None
+
+        with get_trace(request_id).stage('normalization'):
+            norm_user_request = DataRetrieving._preprocess_user_request(
+                core_answer.user_request,
+                request_id
+            )
 
         correct_answer_num = DataRetrieving._process_exact_minfin_answers(
             user_request
@@ -64,39 +216,62 @@ class DataRetrieving:
             core_answer.bad_content = True
             core_answer.message = ERROR_REQUEST_CONTAINS_BAD_WORD
 
-            logging.info(
-                'Query_ID: {}\tMessage: Запрос содержал {}'.format(
-                    request_id,
-                    'плохое слово' if badcount == 1 else 'плохие слова'
-                )
-            )
+            trace_event(request_id, 'bad_words', count=badcount)
 
-            return core_answer
+            AnswerCache.inst().put(cache_key, core_answer)
+            return core_answer, None
 
-        # получение результатов поиска от Apache Solr в JSON-строке
-        solr_response = Solr.get_data(
-            norm_user_request,
-            request_id,
-            SETTINGS.SOLR_MAIN_CORE
-        )['response']
+        prepared = {
+            'norm_user_request': norm_user_request,
+            'correct_answer_num': correct_answer_num,
+            'cache_key': cache_key,
+        }
+
+        return core_answer, prepared
+
+    @staticmethod
+    def _process_solr_response(
+            core_answer: CoreAnswer,
+            prepared: dict,
+            solr_response: dict,
+            request_id: str,
+            cube_prediction: tuple = None,
+            type_prediction: tuple = None
+    ):
+        """
+        Формирование ответа по выдаче Solr. Предсказания классификаторов
+        (куб, вероятность) и (тип, вероятность) можно передать заранее
+        посчитанными, иначе они считаются здесь
+        """
+
+        norm_user_request = prepared['norm_user_request']
+        trace = get_trace(request_id)
 
         # Если хотя бы 1 документ найден:
         if solr_response['numFound']:
-            minfin_docs, cube_data = group_documents(
-                solr_response['docs'],
-                core_answer.user_request,
-                norm_user_request,
-                request_id
-            )
+            with trace.stage('group_documents'):
+                minfin_docs, cube_data = group_documents(
+                    solr_response['docs'],
+                    core_answer.user_request,
+                    norm_user_request,
+                    request_id
+                )
 
-            minfin_answers = MinfinProcessor.get_data(minfin_docs)
+            with trace.stage('minfin'):
+                minfin_answers = MinfinProcessor.get_data(minfin_docs)
 
-            clf = CubeClassifier.inst()
-            best_prediction = tuple(
-                clf.predict_proba(core_answer.user_request)
-            )[0]
+            if not isinstance(minfin_answers, list):
+                minfin_answers = [minfin_answers]
 
-            ans_type = None
+            # тип ответа нужен до обработки кубов: при уверенном
+            # ответе по Минфину кубы не обрабатываются
+            if type_prediction is None:
+                with trace.stage('type_classification'):
+                    type_prediction = CubeOrMinfinClassifier.inst().predict_proba(
+                        core_answer.user_request, top_k=1
+                    )[0]
+
+            ans_type = type_prediction[0].lower()
 
             # ручная проверка, актуальная для вопросов по pretty_feedback
             clf_status, cube = DataRetrieving._manual_cube_classification(
@@ -104,68 +279,148 @@ class DataRetrieving:
             )
 
             if clf_status:
-                best_prediction = (cube, 0.99)
+                cube_prediction = (cube, 0.99)
                 ans_type = 'cube'
 
-            cube_answers, cube_confidence = CubeProcessor.get_data(
-                cube_data, best_prediction)
-
-            logging.info(
-                "Query_ID: {}\tMessage: Найдено {} докумета(ов) по кубам и {} по Минфину".format(
-                    request_id,
-                    len(cube_answers),
-                    len(minfin_answers)
+            early_exit = None
+            if not clf_status:
+                early_exit = DataRetrieving._minfin_early_exit(
+                    minfin_answers,
+                    prepared['correct_answer_num'],
+                    type_prediction
                 )
-            )
+
+            if early_exit:
+                cube_answers, cube_confidence = [], None
+
+                trace.event(
+                    'minfin_early_exit', reason=early_exit,
+                    probability=type_prediction[1])
+                MetricsRegistry.inst().increment(
+                    'datatron_minfin_early_exit_total', reason=early_exit)
+            else:
+                best_prediction = cube_prediction
+                if best_prediction is None:
+                    with trace.stage('classification'):
+                        clf = CubeClassifier.inst()
+                        best_prediction = clf.predict_proba(
+                            core_answer.user_request, top_k=1
+                        )[0]
+
+                with trace.stage('cube'):
+                    cube_answers, cube_confidence = CubeProcessor.get_data(
+                        cube_data, best_prediction)
+
+            trace.event(
+                'answers', cube=len(cube_answers), minfin=len(minfin_answers))
 
             answers = DataRetrieving._sort_answers(
                 minfin_answers,
                 cube_answers,
-                correct_answer_num,
+                prepared['correct_answer_num'],
                 ans_type
             )
 
-            DataRetrieving._format_core_answer(
-                answers,
-                request_id,
-                core_answer,
-                cube_confidence
-            )
+            with trace.stage('format_answer'):
+                DataRetrieving._format_core_answer(
+                    answers,
+                    request_id,
+                    core_answer,
+                    cube_confidence
+                )
         else:
             # Обработка случая, когда документы не найдены
             core_answer.message = ERROR_NO_DOCS_FOUND
-            logging.info(
-                'Query_ID: {}\tMessage: Документа не найдены'.format(
-                    request_id)
-            )
+
+        # ошибки сервера по кубам временные, такие ответы не кешируются
+        if getattr(core_answer.answer, 'message', None) != ERROR_GENERAL:
+            AnswerCache.inst().put(prepared['cache_key'], core_answer)
 
         return core_answer
 
     @staticmethod
     def _process_exact_minfin_answers(user_request: str):
         if MODEL_CONFIG["use_local_file_processing_for_minfin"]:
-            minfin_auto_wrong_tests = DataRetrieving._minfin_auto_wrong_questions()
+            minfin_auto_wrong_index = DataRetrieving._minfin_auto_wrong_questions()
             user_request = user_request.lower()
 
             user_request = user_request.replace('?', '')
 
             # сработает для формулировки с любым порядком слов
-            for key in minfin_auto_wrong_tests.keys():
-                if set(user_request.split()) == set(key.split()):
-                    return minfin_auto_wrong_tests.get(key, 0)
+            return minfin_auto_wrong_index.get(frozenset(user_request.split()))
+
+    @staticmethod
+    def _minfin_early_exit(
+            minfin_answers: list,
+            correct_answer_num: str,
+            type_prediction: tuple
+    ):
+        """
+        Причина не обрабатывать кубы, если главным ответом в любом
+        случае станет ответ по Минфину, иначе None: 'exact' - среди
+        ответов есть точный ответ из некорректных авто-тестов,
+        'type' - классификатор куб/минфин уверен в Минфине не меньше
+        порога minfin_early_exit_threshold, а лучший ответ по Минфину
+        проходит порог главного ответа. По умолчанию ранний выход
+        выключен (minfin_early_exit_threshold равен null в model.json):
+        кубы обрабатываются всегда, в том числе при точном ответе
+        """
+
+        threshold = None
+        if "minfin_early_exit_threshold" in MODEL_CONFIG:
+            threshold = MODEL_CONFIG["minfin_early_exit_threshold"]
+
+        if threshold is None or not minfin_answers:
+            return None
+
+        if (MODEL_CONFIG["use_local_file_processing_for_minfin"] and
+                correct_answer_num and
+                any(answer.number == correct_answer_num for answer in minfin_answers)):
+            return 'exact'
+
+        ans_type, probability = type_prediction
+        if (ans_type.lower() == 'minfin' and probability >= threshold and
+                max(answer.get_score() for answer in minfin_answers) >=
+                MODEL_CONFIG["minfin_main_answer_confidence_threshold"]):
+            return 'type'
+
+        return None
 
     @staticmethod
     def _minfin_auto_wrong_questions():
-        if not DataRetrieving._minfin_auto_wrong_data:
-            minfin_wrong_auto_tests_file = path.join(
-                TEST_PATH_RESULTS, WRONG_AUTO_MINFIN_TESTS_FILE
-            )
+        """
+        Индекс некорректных авто-тестов по Минфину: множество слов
+        вопроса -> номер ответа. Строится заново, если QualityTester
+        перезаписал файл (в этом или другом процессе)
+        """
+        minfin_wrong_auto_tests_file = path.join(
+            TEST_PATH_RESULTS, WRONG_AUTO_MINFIN_TESTS_FILE
+        )
 
+        file_stat = stat(minfin_wrong_auto_tests_file)
+        stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+
+        if stamp != DataRetrieving._minfin_auto_wrong_stamp:
             with open(minfin_wrong_auto_tests_file, 'r', encoding='utf-8') as file:
-                DataRetrieving._minfin_auto_wrong_data = json.loads(
-                    file.read())
+                DataRetrieving._minfin_auto_wrong_index = (
+                    DataRetrieving._minfin_auto_wrong_questions_index(
+                        json.loads(file.read())
+                    )
+                )
+            DataRetrieving._minfin_auto_wrong_stamp = stamp
 
-        return DataRetrieving._minfin_auto_wrong_data
+        return DataRetrieving._minfin_auto_wrong_index
+
+    @staticmethod
+    def _minfin_auto_wrong_questions_index(minfin_auto_wrong_tests: dict):
+        """
+        Индекс по множеству слов вопроса. Из вопросов с одинаковым
+        набором слов остается первый, как и при переборе файла
+        """
+        index = {}
+        for key, value in minfin_auto_wrong_tests.items():
+            index.setdefault(frozenset(key.split()), value)
+        return index
 
     @staticmethod
     def _preprocess_user_request(user_request: str, request_id: str):
@@ -200,12 +455,9 @@ class DataRetrieving:
         if len(unique_of_request_words) != len(request_words):
             norm_user_request = ' '.join(unique_of_request_words)
 
-            logging.info(
-                "Query_ID: {}\tMessage: Удалено {} повторяющихся слов".format(
-                    request_id,
-                    len(request_words) - len(unique_of_request_words)
-                )
-            )
+            trace_event(
+                request_id, 'repeating_words',
+                deleted=len(request_words) - len(unique_of_request_words))
 
         return norm_user_request
 
@@ -224,14 +476,9 @@ class DataRetrieving:
                 [norm_user_request.strip()] * multiplier
             )
 
-            logging.info(
-                "Query_ID: {}\tMessage: Запрос из {} слов был "
-                "удлинен в {} раза".format(
-                    request_id,
-                    request_len,
-                    multiplier
-                )
-            )
+            trace_event(
+                request_id, 'short_request',
+                words=request_len, multiplier=multiplier)
 
         return norm_user_request
 
@@ -280,7 +527,7 @@ class DataRetrieving:
             user_request = all_answers[0].user_request
 
             clf = CubeOrMinfinClassifier.inst()
-            prediction = tuple(clf.predict_proba(user_request))[0]
+            prediction = clf.predict_proba(user_request, top_k=1)[0]
             ans_type = prediction[0].lower()
 
         if all_answers[0].type != ans_type:
@@ -289,20 +536,15 @@ class DataRetrieving:
                     all_answers.remove(elem)
                     all_answers.insert(0, elem)
 
-                    logging.info(
-                        "Query_ID: {}\tMessage: Главный ответ был "
-                        "сменен на тип: {}".format(
-                            elem.request_id,
-                            ans_type
-                        )
-                    )
+                    trace_event(
+                        elem.request_id, 'answer_type',
+                        type=ans_type, changed=True)
 
                     break
         else:
-            logging.info(
-                "Query_ID: {}\tMessage: Тип главного ответа совпадает с "
-                "типом из классификатора".format(all_answers[0].request_id)
-            )
+            trace_event(
+                all_answers[0].request_id, 'answer_type',
+                type=ans_type, changed=False)
 
     @staticmethod
     def _first_place_exact_minfin_answer(all_answers: list, correct_number: str):
@@ -316,22 +558,17 @@ class DataRetrieving:
                     if answer.get_score() < MODEL_CONFIG["relevant_minfin_main_answer_threshold"]:
                         score = MODEL_CONFIG["relevant_minfin_main_answer_threshold"]
 
-                        logging.info(
-                            "Query_ID: {}\tMessage: Score был увеличен с {} до {}".format(
-                                all_answers[0].request_id,
-                                answer.get_score(),
-                                score
-                            )
-                        )
+                        trace_event(
+                            all_answers[0].request_id, 'exact_minfin_score',
+                            before=answer.get_score(), after=score)
 
                         answer.score = score
 
-                    logging.info(
-                        "Query_ID: {}\tMessage: Главный ответ был сменен на основе"
-                        " логов некорректных автоматических тестов".format(
-                            all_answers[0].request_id
-                        )
-                    )
+                    # главный ответ сменен на основе логов
+                    # некорректных автоматических тестов
+                    trace_event(
+                        all_answers[0].request_id, 'exact_minfin',
+                        number=correct_number)
 
                     break
 
@@ -385,21 +622,26 @@ class DataRetrieving:
             core_answer.status = True
             core_answer.confidence = cube_confidence
 
-            logging.info(
-                "Query_ID: {}\tMessage: Главный ответ - "
-                "ответ по кубу - {} - {}".format(
-                    request_id,
-                    core_answer.answer.get_score(),
-                    core_answer.answer.mdx_query
-                ))
+            trace = get_trace(request_id)
+            trace.event(
+                'main_answer', type='cube',
+                score=core_answer.answer.get_score(),
+                mdx_query=core_answer.answer.mdx_query)
 
-            response = send_request_to_server(
-                core_answer.answer.mdx_query,
-                core_answer.answer.cube
-            )
+            value = core_answer.answer.mdx_value
+
+            if value is None:
+                with trace.stage('mdx'):
+                    response = send_request_to_server(
+                        core_answer.answer.mdx_query,
+                        core_answer.answer.cube
+                    )
 
-            # ответ с сервера
-            value = process_server_response(core_answer.answer, response)
+                    # ответ с сервера
+                    value = process_server_response(core_answer.answer, response)
+            else:
+                # ответ на MDX-запрос получен при проверке наличия данных
+                trace.event('mdx', value=value, from_existence_check=True)
 
             # форматирование ответа при его наличии
             if value is not None:
@@ -412,37 +654,28 @@ class DataRetrieving:
 
                 core_answer.status = True
 
-                logging.info(
-                    "Query_ID: {}\tMessage: Главный точный ответ - "
-                    "ответ по Минфину - {} - {}".format(
-                        request_id,
-                        core_answer.answer.get_score(),
-                        core_answer.answer.number
-                    ))
+                trace_event(
+                    request_id, 'main_answer', type='minfin', exact=True,
+                    score=core_answer.answer.get_score(),
+                    number=core_answer.answer.number)
             elif (core_answer.answer.get_score() >=
                   MODEL_CONFIG["minfin_main_answer_confidence_threshold"]):
 
                 core_answer.status = True
                 core_answer.confidence = False
 
-                logging.info(
-                    "Query_ID: {}\tMessage: Главный возможный ответ - "
-                    "ответ по Минфину - {} - {}".format(
-                        request_id,
-                        core_answer.answer.get_score(),
-                        core_answer.answer.number
-                    ))
+                trace_event(
+                    request_id, 'main_answer', type='minfin', exact=False,
+                    score=core_answer.answer.get_score(),
+                    number=core_answer.answer.number)
             else:
                 # Обнуление найденого ответа
                 core_answer.answer = None
 
-                logging.info(
-                    "Query_ID: {}\tMessage: Главный ответ по Минфину "
-                    "не прошел порог ({} vs {})".format(
-                        request_id,
-                        answers[0].get_score(),
-                        MODEL_CONFIG["relevant_minfin_main_answer_threshold"]
-                    ))
+                trace_event(
+                    request_id, 'main_answer', type=None,
+                    minfin_score=answers[0].get_score(),
+                    threshold=MODEL_CONFIG["relevant_minfin_main_answer_threshold"])
 
     @staticmethod
     def _process_more_answers(
@@ -477,13 +710,9 @@ class DataRetrieving:
         if more_answers_order:
             core_answer.more_answers_order = more_answers_order
 
-        logging.info(
-            "Query_ID: {}\tMessage: В смотри также {} "
-            "ответ(а, ов) по кубам и {} по Минфину".format(
-                request_id,
-                len(more_cube_answers),
-                len(more_minfin_answers)
-            ))
+        trace_event(
+            request_id, 'more_answers',
+            cube=len(more_cube_answers), minfin=len(more_minfin_answers))
 
     @staticmethod
     def _manual_cube_classification(user_request: str):
@@ -5,14 +5,39 @@
 База данных с запросами
 """
 
+from collections import OrderedDict
+from itertools import count
+import atexit
 import datetime
+import logging
+import queue
+import threading
+import time
 
-from peewee import SqliteDatabase, DateTimeField, CharField, Model
+from peewee import DateTimeField, CharField, Model
 
-from config import QUERY_DB_PATH
+from config import QUERY_DB_PATH, SETTINGS
+from utils.database import sqlite_database
+from utils.metrics import Histogram
 
 
-_database = SqliteDatabase(QUERY_DB_PATH)
+_database = sqlite_database(QUERY_DB_PATH)
+
+# Настройки фоновой записи, которые можно переопределить
+# в settings.json (раздел QUERY_LOG)
+QUERY_LOG_SETTINGS = getattr(SETTINGS, 'QUERY_LOG', None)
+
+# сколько записей может ждать записи в базу
+QUEUE_SIZE = getattr(QUERY_LOG_SETTINGS, 'QUEUE_SIZE', 10000)
+
+# записи сохраняются пачками по BATCH_SIZE штук
+# или не реже, чем раз в FLUSH_INTERVAL секунд
+BATCH_SIZE = getattr(QUERY_LOG_SETTINGS, 'BATCH_SIZE', 100)
+FLUSH_INTERVAL = getattr(QUERY_LOG_SETTINGS, 'FLUSH_INTERVAL', 1.0)
+
+# сколько секунд запрос ждет места в переполненной очереди,
+# прежде чем запись будет отброшена
+PUT_TIMEOUT = getattr(QUERY_LOG_SETTINGS, 'PUT_TIMEOUT', 0.05)
 
 
 class UserQuery(Model):
@@ -29,62 +54,291 @@ class UserQuery(Model):
 
     class Meta:
         database = _database
+        indexes = (
+            (('user_id', 'date'), False),
+            (('date',), False),
+        )
 
 
 def _init_db():
     """
-    Создаёт таблицы, если ещё не были созданы
+    Создаёт таблицы и индексы, если ещё не были созданы.
+    Вызывается и из потоков сервера, и из потока записи,
+    поэтому выполняется под блокировкой один раз
     """
     global _is_inited
-    _database.connect()
-    _database.create_table(UserQuery, safe=True)
-    _is_inited = True
+    with _init_lock:
+        if _is_inited:
+            return
 
+        _database.connect()
+        _database.create_table(UserQuery, safe=True)
 
-def log_query_to_db(request_id, user_id, user_name, platform, query, query_type):
+        # в уже существующей таблице индексов может не быть
+        _database.execute_sql(
+            'CREATE INDEX IF NOT EXISTS userquery_user_id_date ON userquery (user_id, date)')
+        _database.execute_sql(
+            'CREATE INDEX IF NOT EXISTS userquery_date ON userquery (date)')
+        _is_inited = True
+
+
+def save_queries(records: list):
     """
-    Выполняет сохранение запроса в БД.
-    Предполгается, что они приосходят не слишком часто.
+    Синхронное сохранение запросов (словарей с полями UserQuery)
+    в БД одной транзакцией
     """
     if not _is_inited:
         _init_db()
-    query_to_save = UserQuery(
-        date=datetime.datetime.now(),
-        request_id=request_id,
-        user_id=user_id,
-        user_name=user_name,
-        platform=platform,
-        query=query,
-        query_type=query_type
-    )
-    query_to_save.save()
+    # не больше 999 параметров на одно выражение для старых версий SQLite
+    chunk_size = 100
+    with _database.atomic():
+        for start in range(0, len(records), chunk_size):
+            UserQuery.insert_many(records[start:start + chunk_size]).execute()
+
+
+class QueryLogWriter:
+    """
+    Фоновая запись пользовательских запросов в БД, чтобы запрос
+    не ждал INSERT и commit. Записи попадают в ограниченную очередь,
+    единственный поток пишет их пачками. Если очередь переполнена
+    дольше PUT_TIMEOUT, запись отбрасывается и учитывается в метриках.
+    Еще не сохраненные записи доступны через pending_records.
+    При завершении процесса очередь дописывается. Синглтон! Singleton!
+    """
+
+    __instance = None
+
+    @staticmethod
+    def inst():
+        """Реализует Синглтон"""
+        if QueryLogWriter.__instance is None:
+            QueryLogWriter.__instance = QueryLogWriter()
+        return QueryLogWriter.__instance
+
+    def __init__(
+            self,
+            queue_size=QUEUE_SIZE,
+            batch_size=BATCH_SIZE,
+            flush_interval=FLUSH_INTERVAL,
+            put_timeout=PUT_TIMEOUT
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._sequence = count()
+
+        # записи, еще не сохраненные в БД, по порядковому номеру
+        self._pending = OrderedDict()
+        self._pending_lock = threading.Lock()
+
+        # сохранение пачки и чтение БД вместе с pending не пересекаются,
+        # чтобы читатель не увидел запись дважды или ни разу
+        self._commit_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        self._batch_latency = Histogram()
+        self._counters = {
+            'enqueued': 0,
+            'written': 0,
+            'dropped': 0,
+            'failed': 0,
+            'batches': 0,
+        }
+
+    def _ensure_started(self):
+        """Запуск потока записи при первом обращении"""
+
+        if self._thread is not None:
+            return
+
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='query-log-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def put(self, record: dict):
+        """
+        Постановка записи в очередь. Возвращает False,
+        если запись отброшена из-за переполнения очереди
+        """
+
+        self._ensure_started()
+
+        seq = next(self._sequence)
+        with self._pending_lock:
+            self._pending[seq] = record
+
+        try:
+            self._queue.put((seq, record), timeout=self.put_timeout)
+        except queue.Full:
+            with self._pending_lock:
+                self._pending.pop(seq, None)
+                self._counters['dropped'] += 1
+            logging.warning(
+                'Query_ID: {}\tMessage: Очередь журнала запросов '
+                'переполнена, запрос не сохранен'.format(record['request_id'])
+            )
+            return False
+
+        with self._pending_lock:
+            self._counters['enqueued'] += 1
+        return True
+
+    def _take_batch(self):
+        """
+        Ожидание первой записи и добор пачки до batch_size
+        в течение flush_interval
+        """
+
+        batch = []
+        deadline = None
+
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+        return batch
+
+    def _write(self, batch: list):
+        """Сохранение пачки записей"""
+
+        start = time.monotonic()
+
+        with self._commit_lock:
+            try:
+                save_queries([record for _, record in batch])
+                failed = False
+            except Exception as err:  # pylint: disable=broad-except
+                # любая ошибка пачки не должна останавливать поток записи,
+                # иначе очередь перестанет разбираться
+                failed = True
+                logging.exception(
+                    'Message: Не удалось сохранить {} запросов '
+                    'в журнал: {}'.format(len(batch), err)
+                )
+
+            with self._pending_lock:
+                for seq, _ in batch:
+                    self._pending.pop(seq, None)
+
+                self._counters['failed' if failed else 'written'] += len(batch)
+                self._counters['batches'] += 1
+
+        self._batch_latency.observe(time.monotonic() - start)
+
+    def _run(self):
+        """Цикл потока записи"""
+
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+
+        _database.close()
+
+    def close(self):
+        """Запись оставшихся запросов и остановка потока"""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def pending_records(self):
+        """Еще не сохраненные записи в порядке поступления"""
+
+        with self._pending_lock:
+            return list(self._pending.values())
+
+    def read(self, select):
+        """
+        Исполнение запроса к журналу и еще не сохраненные записи,
+        согласованные между собой
+        """
+
+        with self._commit_lock:
+            return list(select), self.pending_records()
+
+    def stats(self):
+        """Счетчики записей, размер очереди и время записи пачек"""
+
+        with self._pending_lock:
+            stats = dict(self._counters)
+        stats['queue_size'] = self._queue.qsize()
+        stats['batch_seconds'] = self._batch_latency.snapshot()
+        return stats
+
+
+def log_query_to_db(request_id, user_id, user_name, platform, query, query_type):
+    """
+    Ставит запрос в очередь на сохранение в БД, сама запись
+    происходит в фоне (см. QueryLogWriter)
+    """
+    QueryLogWriter.inst().put({
+        'date': datetime.datetime.now(),
+        'request_id': request_id,
+        'user_id': user_id,
+        'user_name': user_name,
+        'platform': platform,
+        'query': query,
+        'query_type': query_type,
+    })
 
 
 def get_queries(user_id, time_delta):
     """
-    Возвращает последние запросы
+    Возвращает последние запросы, включая еще не сохраненные
     Если user_id пустой, то возвращает по всем
     """
     if not _is_inited:
         _init_db()
+    since = datetime.datetime.now() - time_delta
     select = UserQuery.select(
         UserQuery.date,
         UserQuery.user_id,
         UserQuery.query
     )
     if user_id:
-        db_res = select.where(
+        select = select.where(
             (UserQuery.user_id == str(user_id)) &
-            (UserQuery.date >= datetime.datetime.now() - time_delta)
+            (UserQuery.date >= since)
         )
     else:
-        db_res = select.where(
-            (UserQuery.date >= datetime.datetime.now() - time_delta))
+        select = select.where(
+            (UserQuery.date >= since))
+
+    db_res, pending = QueryLogWriter.inst().read(select)
+
+    rows = [(row.date, row.user_id, row.query) for row in db_res]
+    rows.extend(
+        (record['date'], record['user_id'], record['query'])
+        for record in pending
+        if record['date'] >= since and (not user_id or str(record['user_id']) == str(user_id))
+    )
 
     if user_id:
-        return tuple(["{} {}".format(row.date, row.query) for row in db_res])
+        return tuple(["{} {}".format(date, query) for date, _, query in rows])
 
-    return tuple(["{} {}: {}".format(row.date, row.user_id, row.query) for row in db_res])
+    return tuple(["{} {}: {}".format(date, row_user_id, query) for date, row_user_id, query in rows])
 
 
 _is_inited = False
+_init_lock = threading.Lock()
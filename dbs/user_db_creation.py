@@ -8,18 +8,19 @@
 import argparse
 import sys
 
-from peewee import Model, SqliteDatabase, IntegerField, CharField, ForeignKeyField
+from peewee import Model, IntegerField, CharField, ForeignKeyField
 
 from config import SETTINGS
+from utils.database import sqlite_database
 
 
-database = SqliteDatabase(
+database = sqlite_database(
     SETTINGS.PATH_TO_USER_DB)  # pylint: disable=invalid-name
 
 
 class BaseModel(Model):
     class Meta:
-        database = SqliteDatabase(SETTINGS.PATH_TO_USER_DB)
+        database = database
 
 
 class User(BaseModel):
@@ -56,10 +56,13 @@ class KnowledgeBaseSupport:
     def _create_db(self):
         """Пересоздание базы данных"""
 
-        try:
-            remove(path.join('kb', self.db_file))
-        except FileNotFoundError:
-            pass
+        # вместе с файлами журнала WAL, иначе новая база
+        # может подхватить журнал старой
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                remove(path.join('kb', self.db_file + suffix))
+            except FileNotFoundError:
+                pass
 
         dbc.create_tables()
 
@@ -12,9 +12,9 @@ import json
 import subprocess
 
 from peewee import fn
-import requests
 
 from config import SETTINGS, TECH_CUBE_DOCS_FILE
+from core.solr import Solr
 from kb.kb_support_library import TOO_LONG_ELEMS, USELESS_BGLEVELS
 from kb.kb_support_library import get_cube_dimensions
 from kb.kb_support_library import get_default_cube_measure
@@ -22,7 +22,6 @@ from kb.kb_support_library import get_measure_lem_key_words
 from kb.kb_support_library import get_with_member_to_given_member
 from model_manager import MODEL_CONFIG
 import kb.kb_db_creation as dbc
-import pycurl
 
 
 class CubeDocsGeneration:
@@ -57,14 +56,7 @@ class CubeDocsGeneration:
     def clear_index(self):
         """Очистка ядра в Apache Solr"""
 
-        dlt_str = (
-            'http://' +
-            SETTINGS.SOLR_HOST +
-            ':8983/solr/{}/update?stream.' +
-            'body=%3Cdelete%3E%3Cquery%3E*:*%3C/' +
-            'query%3E%3C/delete%3E&commit=true'
-        )
-        requests.get(dlt_str.format(self.core))
+        Solr.inst().clear_index(self.core)
 
     def create_core(self):
         """
@@ -74,19 +66,19 @@ class CubeDocsGeneration:
         solr create -c <core_name>
         """
 
-        status_str = 'http://localhost:8983/solr/admin/cores?action=STATUS&core={}&wt=json'
-        solr_response = requests.get(status_str.format(self.core))
+        solr = Solr.inst()
+        solr_response = solr.admin(
+            {'action': 'STATUS', 'core': self.core, 'wt': 'json'}
+        )
         solr_response = json.loads(solr_response.text)
         if solr_response['status'][self.core]:
             print('Ядро {} уже существует'.format(self.core))
         else:
-            create_core_str = (
-                'http://' +
-                SETTINGS.SOLR_HOST +
-                ':8983/solr/admin/cores?action=CREATE' +
-                '&name={}&configSet=basic_configs'
-            )
-            solr_response = requests.get(create_core_str.format(self.core))
+            solr_response = solr.admin({
+                'action': 'CREATE',
+                'name': self.core,
+                'configSet': 'basic_configs'
+            })
             if solr_response.status_code == 200:
                 print('Ядро {} автоматически создано'.format(self.core))
             else:
@@ -313,7 +305,7 @@ class CubeDocsGeneration:
     def index_created_documents_via_curl(self):
         """
         Отправа JSON файла с документами по кубам
-        на индексацию в Apache Solr через cURL
+        на индексацию в Apache Solr через общий HTTP-клиент
         """
 
         indexed_file = self.file_name
@@ -321,22 +313,8 @@ class CubeDocsGeneration:
         if MODEL_CONFIG['enable_searching_and_tech_info_separation']:
             indexed_file = self.search_file_name
 
-        pycrl = pycurl.Curl()
-        curl_addr = (
-            'http://' +
-            SETTINGS.SOLR_HOST +
-            ':8983/solr/{}/update?commit=true'
-        )
-        pycrl.setopt(pycrl.URL, curl_addr.format(self.core))
-        pycrl.setopt(pycrl.HTTPPOST,
-                     [
-                         ('fileupload',
-                          (pycrl.FORM_FILE, indexed_file,
-                           pycrl.FORM_CONTENTTYPE, 'application/json')
-                          ),
-                     ])
-        pycrl.perform()
-        print('Документ {} проиндексирован через CURL'.format(
+        Solr.inst().index_file(self.core, indexed_file)
+        print('Документ {} проиндексирован через HTTP'.format(
             indexed_file
         ))
 
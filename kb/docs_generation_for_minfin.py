@@ -14,12 +14,12 @@ import subprocess
 import sys
 
 from config import SETTINGS, TEST_PATH_MINFIN, TECH_MINFIN_DOCS_FILE
+from core.solr import Solr
 from kb.kb_support_library import read_minfin_data
 from model_manager import MODEL_CONFIG
 from text_preprocessing import TextPreprocessing
 import logs_helper  # pylint: disable=unused-import
 import pandas as pd
-import pycurl
 
 
 # Название файла с готовой структурой данных
@@ -285,34 +285,20 @@ def _get_manual_synonym_questions(question_number):
 
 def _index_data_via_curl():
     """
-    Отправа JSON файла с документами по кубам
-    на индексацию в Apache Solr через cURL
+    Отправа JSON файла с документами по Минфину
+    на индексацию в Apache Solr через общий HTTP-клиент
     """
 
     indexed_file = OUTPUT_FILE
     if MODEL_CONFIG['enable_searching_and_tech_info_separation']:
         indexed_file = SEARCH_OUTPUT_FILE
 
-    curl_instance = pycurl.Curl()
-    curl_instance.setopt(
-        curl_instance.URL,
-        'http://{}:8983/solr/{}/update?commit=true'.format(
-            SETTINGS.SOLR_HOST,
-            SETTINGS.SOLR_MAIN_CORE
-        )
+    Solr.inst().index_file(
+        SETTINGS.SOLR_MAIN_CORE,
+        path.join(path_to_folder_file, indexed_file)
     )
 
-    curl_instance.setopt(curl_instance.HTTPPOST, [(
-        'fileupload',
-        (
-            curl_instance.FORM_FILE,
-            path.join(path_to_folder_file, indexed_file),
-            curl_instance.FORM_CONTENTTYPE, 'application/json'
-        )
-    ), ])
-    curl_instance.perform()
-
-    logging.info('Документ {} проиндексирован через CURL'.format(
+    logging.info('Документ {} проиндексирован через HTTP'.format(
         indexed_file
     ))
 
@@ -5,17 +5,20 @@
 Определение структуры базы знаний по OLAP-кубам
 """
 
-from peewee import Model, SqliteDatabase, CharField, ForeignKeyField, CompositeKey
+from peewee import Model, CharField, ForeignKeyField, CompositeKey
 
 from config import SETTINGS
+from utils.database import reopen_database, sqlite_database
 
 
-database = SqliteDatabase(SETTINGS.PATH_TO_KNOWLEDGEBASE)
+# Сервер базу знаний только читает, на запись она
+# открывается при пересоздании (см. create_tables)
+database = sqlite_database(SETTINGS.PATH_TO_KNOWLEDGEBASE, read_only=True)
 
 
 class BaseModel(Model):
     class Meta:
-        database = SqliteDatabase(SETTINGS.PATH_TO_KNOWLEDGEBASE)
+        database = database
 
 
 class Member(BaseModel):
@@ -156,6 +159,7 @@ class CubeMeasure(BaseModel):
 def create_tables():
     """Создание таблиц базы знаний по кубам"""
 
+    reopen_database(database, SETTINGS.PATH_TO_KNOWLEDGEBASE, read_only=False)
     database.connect()
     database.create_tables([
         Dimension,
@@ -171,6 +175,8 @@ def create_tables():
 def drop_tables():
     """Удаление таблиц базы знаний"""
 
+    reopen_database(database, SETTINGS.PATH_TO_KNOWLEDGEBASE, read_only=False)
+
     database.drop_tables([
         Dimension,
         Cube,
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Снимок базы знаний по кубам в памяти для быстрых
+справочных запросов в процессе обработки запроса
+"""
+
+import kb.kb_db_creation as dbc
+
+
+class KnowledgeBaseSnapshot:
+    """
+    Неизменяемая копия таблиц базы знаний с индексами по
+    (куб, формальное значение) и (куб, измерение). Строится
+    за несколько полных чтений таблиц вместо запросов с join
+    на каждое обращение. Строки - словари с полями таблиц,
+    внешние ключи представлены id
+    """
+
+    def __init__(self):
+        self.members = {row['id']: row for row in dbc.Member.select().dicts()}
+        self.measures = {row['id']: row for row in dbc.Measure.select().dicts()}
+        self.dimensions = {row['id']: row for row in dbc.Dimension.select().dicts()}
+        self.cubes = {row['name']: row for row in dbc.Cube.select().dicts()}
+
+        cube_names = {row['id']: name for name, row in self.cubes.items()}
+
+        # мера по формальному значению (первая, как Measure.get)
+        self.measure_by_value = {}
+        for measure in sorted(self.measures.values(), key=lambda row: row['id']):
+            self.measure_by_value.setdefault(measure['cube_value'], measure)
+
+        # (куб, мера) -> мера
+        self.cube_measures = {}
+        for link in dbc.CubeMeasure.select().dicts():
+            measure = self.measures[link['measure']]
+            self.cube_measures.setdefault(
+                (cube_names[link['cube']], measure['cube_value']), measure)
+
+        # (куб, измерение) -> измерение и измерения куба по порядку
+        self.cube_dimensions = {}
+        self.dimensions_of_cube = {}
+        for link in dbc.CubeDimension.select().dicts():
+            cube_name = cube_names[link['cube']]
+            dimension = self.dimensions[link['dimension']]
+            self.cube_dimensions.setdefault(
+                (cube_name, dimension['cube_value']), dimension)
+            self.dimensions_of_cube.setdefault(cube_name, []).append(
+                dimension['cube_value'])
+
+        # кубы, в которые входит измерение
+        cubes_of_dimension = {}
+        for (cube_name, _), dimension in self.cube_dimensions.items():
+            cubes_of_dimension.setdefault(dimension['id'], []).append(cube_name)
+
+        # элемент -> его измерение, (куб, элемент) -> элемент
+        self.member_dimension = {}
+        self.cube_members = {}
+        for link in dbc.DimensionMember.select().dicts():
+            member = self.members[link['member']]
+            dimension = self.dimensions[link['dimension']]
+            self.member_dimension.setdefault(member['id'], dimension)
+
+            for cube_name in cubes_of_dimension.get(dimension['id'], ()):
+                self.cube_members.setdefault(
+                    (cube_name, member['cube_value']), member)
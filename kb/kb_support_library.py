@@ -5,12 +5,14 @@
 Поддерживающие скрипты к базе знаний
 """
 
-from os import listdir, path
+from os import listdir, path, stat
 import logging
 import random
 import re
+import time
 
 from config import SETTINGS, TEST_PATH_RESULTS
+from kb.kb_snapshot import KnowledgeBaseSnapshot
 from text_preprocessing import TextPreprocessing
 import kb.kb_db_creation as dbc
 import logs_helper  # pylint: disable=unused-import
@@ -26,6 +28,77 @@ TPP = TextPreprocessing(
     parse_obsc=False
 )
 
+# как часто проверяется файл базы знаний, секунд
+KB_CHECK_INTERVAL = 1
+
+
+def _kb_stamp():
+    """
+    Отметки (время изменения, размер) файла базы знаний и его журнала
+    WAL: при записи в режиме WAL изменения сначала попадают в журнал
+    """
+
+    stamps = []
+    for file_path in (SETTINGS.PATH_TO_KNOWLEDGEBASE,
+                      SETTINGS.PATH_TO_KNOWLEDGEBASE + '-wal'):
+        try:
+            file_stat = stat(file_path)
+            stamps.append((file_stat.st_mtime_ns, file_stat.st_size))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+def kb_snapshot():
+    """
+    Снимок базы знаний в памяти, по которому работают справочные
+    функции ниже. Строится при первом обращении и заново, если
+    изменилась отметка файла базы знаний: пересоздание базы в другом
+    процессе видно работающему серверу. Отметка проверяется не чаще,
+    чем раз в KB_CHECK_INTERVAL секунд
+    """
+
+    now = time.monotonic()
+    if (kb_snapshot.data is not None and
+            now - kb_snapshot.checked_at < KB_CHECK_INTERVAL):
+        return kb_snapshot.data
+
+    stamp = _kb_stamp()
+    if kb_snapshot.data is None or stamp != kb_snapshot.stamp:
+        kb_snapshot.data, kb_snapshot.stamp = KnowledgeBaseSnapshot(), stamp
+
+    kb_snapshot.checked_at = now
+    return kb_snapshot.data
+
+
+kb_snapshot.data = None
+kb_snapshot.stamp = None
+kb_snapshot.checked_at = 0
+
+
+def reload_kb_snapshot():
+    """
+    Сброс снимка базы знаний, например, после ее пересоздания
+    в этом же процессе. Снимок будет построен заново при следующем
+    обращении
+    """
+
+    kb_snapshot.data = None
+    kb_snapshot.stamp = None
+
+
+def _find(index: dict, key, not_found=IndexError):
+    """
+    Строка из индекса снимка по ключу. Если ее нет, выбрасывается
+    то же исключение, что и при запросе к базе знаний: IndexError
+    для первой строки выборки, DoesNotExist модели для get
+    """
+
+    try:
+        return index[key]
+    except KeyError:
+        raise not_found('{} нет в базе знаний'.format(key)) from None
+
 
 def get_caption_for_measure(cube_value, cube_name):
     """
@@ -33,14 +106,7 @@ def get_caption_for_measure(cube_value, cube_name):
     по формальному значению и кубу
     """
 
-    measure = (dbc.Measure
-               .select(dbc.Measure.caption)
-               .join(dbc.CubeMeasure)
-               .join(dbc.Cube)
-               .where(dbc.Measure.cube_value == cube_value, dbc.Cube.name == cube_name)
-               )[0]
-
-    return measure.caption
+    return _find(kb_snapshot().cube_measures, (cube_name, cube_value))['caption']
 
 
 def get_measure_lem_key_words(cube_value: str, cube_name: str):
@@ -48,28 +114,14 @@ def get_measure_lem_key_words(cube_value: str, cube_name: str):
     Получение нормализованных ключевых слов для меры, если они есть
     """
 
-    measure = (dbc.Measure
-               .select()
-               .join(dbc.CubeMeasure)
-               .join(dbc.Cube)
-               .where(dbc.Measure.cube_value == cube_value, dbc.Cube.name == cube_name)
-               )[0]
-
-    return measure.lem_key_words
+    measure = _find(kb_snapshot().cube_measures, (cube_name, cube_value))
+    return measure['lem_key_words']
 
 
 def get_cube_dimensions(cube_name):
     """Получение списка измерения куба"""
 
-    query = (dbc.Dimension
-             .select()
-             .join(dbc.CubeDimension)
-             .join(dbc.Cube)
-             .where(dbc.Cube.name == cube_name))
-
-    dimensions = [dimension.cube_value for dimension in query]
-
-    return dimensions
+    return list(kb_snapshot().dimensions_of_cube.get(cube_name, []))
 
 
 def create_automative_cube_description(cube_name):
@@ -112,61 +164,58 @@ def get_representation_format(mdx_query):
 
     left_part = mdx_query.split('(')[0]
     measure_value = left_part.split('}')[0].split('.')[1][1:-1]
-    measure = dbc.Measure.get(dbc.Measure.cube_value == measure_value)
-    return int(measure.format)
+    measure = _find(
+        kb_snapshot().measure_by_value, measure_value, dbc.Measure.DoesNotExist)
+    return int(measure['format'])
 
 
 def get_default_cube_measure(cube_name):
     """Получение меры для куба по умолчанию"""
 
-    cube = dbc.Cube.get(dbc.Cube.name == cube_name)
-    default_measure = dbc.Measure.get(
-        dbc.Measure.id == cube.default_measure_id)
-    return default_measure.cube_value
+    snapshot = kb_snapshot()
+    cube = _find(snapshot.cubes, cube_name, dbc.Cube.DoesNotExist)
+    measure = _find(
+        snapshot.measures, cube['default_measure'], dbc.Measure.DoesNotExist)
+    return measure['cube_value']
 
 
 def get_default_member_for_dimension(cube_name, dimension_cube_value):
     """Получение значения измерения по умолчанию"""
 
-    dimension = (dbc.Dimension
-                 .select()
-                 .join(dbc.CubeDimension)
-                 .join(dbc.Cube)
-                 .where(dbc.Cube.name == cube_name, dbc.Dimension.cube_value == dimension_cube_value)
-                 )[0]
+    snapshot = kb_snapshot()
+    dimension = _find(
+        snapshot.cube_dimensions, (cube_name, dimension_cube_value))
 
     # Если для измерения указано дефольное значение
     # И если оно не уровня All (в БД уровень All обозначается 0)
-    if dimension.default_value_id:
-        def_value = dbc.Member.get(dbc.Member.id == dimension.default_value_id)
+    if dimension['default_value']:
+        def_value = _find(
+            snapshot.members, dimension['default_value'], dbc.Member.DoesNotExist)
 
         return {'dimension_cube_value': dimension_cube_value,
-                'member_cube_value': def_value.cube_value}
+                'member_cube_value': def_value['cube_value']}
 
 
 def get_with_member_to_given_member(member_id):
     """Возвращает связанное значение измерения с данным"""
 
-    given_member = dbc.Member.get(dbc.Member.id == member_id)
+    snapshot = kb_snapshot()
+    given_member = _find(snapshot.members, member_id, dbc.Member.DoesNotExist)
 
-    if given_member.with_member:
-        with_member = dbc.Member.get(dbc.Member.id == given_member.with_member)
+    if given_member['with_member']:
+        with_member = _find(
+            snapshot.members, int(given_member['with_member']),
+            dbc.Member.DoesNotExist)
+        dimension = _find(snapshot.member_dimension, with_member['id'])
 
-        dimension = (dbc.Dimension
-                     .select(dbc.Dimension.cube_value)
-                     .join(dbc.DimensionMember)
-                     .join(dbc.Member)
-                     .where(dbc.Member.id == with_member.id)
-                     )[0]
-
-        return {'dimension_cube_value': dimension.cube_value,
-                'member_cube_value': with_member.cube_value}
+        return {'dimension_cube_value': dimension['cube_value'],
+                'member_cube_value': with_member['cube_value']}
 
 
 def get_cube_caption(cube_name):
     """Возвращает описание куба"""
 
-    return dbc.Cube.get(dbc.Cube.name == cube_name).caption
+    return _find(kb_snapshot().cubes, cube_name, dbc.Cube.DoesNotExist)['caption']
 
 
 def get_captions_for_dimensions(cube_value, cube_name):
@@ -176,24 +225,12 @@ def get_captions_for_dimensions(cube_value, cube_name):
     - понятное пользователю элемента измерения
     """
 
-    member = (dbc.Member
-              .select()
-              .join(dbc.DimensionMember)
-              .join(dbc.Dimension)
-              .join(dbc.CubeDimension)
-              .join(dbc.Cube)
-              .where(dbc.Member.cube_value == cube_value, dbc.Cube.name == cube_name)
-              )[0]
-
-    dimension = (dbc.Dimension
-                 .select()
-                 .join(dbc.DimensionMember)
-                 .join(dbc.Member)
-                 .where(dbc.Member.id == member.id)
-                 )[0]
-
-    return {'dimension_caption': dimension.caption,
-            'member_caption': member.caption}
+    snapshot = kb_snapshot()
+    member = _find(snapshot.cube_members, (cube_name, cube_value))
+    dimension = _find(snapshot.member_dimension, member['id'])
+
+    return {'dimension_caption': dimension['caption'],
+            'member_caption': member['caption']}
 
 
 def create_cube_lem_key_words():
@@ -8,11 +8,17 @@
 одного логгера.
 """
 
+from bisect import bisect_left
 from logging import FileHandler, StreamHandler
+from os import path
 import datetime
+import fcntl
+import io
+import json
 import logging
 import re
 import sys
+import threading
 
 from config import DATETIME_FORMAT, LOG_LEVEL, LOGS_PATH
 from dbs.query_db import get_queries
@@ -136,6 +142,224 @@ def time_with_message(message, level="INFO", critical_seconds=None):
     return proc
 
 
+class LogIndex:
+    """
+    Разреженный индекс файла логов: смещения контрольных точек
+    по времени (примерно через каждые CHECKPOINT_BYTES байт) и смещения
+    строк с запросами пользователей по Query_ID. Файл логов только
+    дописывается, поэтому индекс достраивается с места, где остановился,
+    и хранится рядом с логами в файле, который тоже только дописывается
+    (строки JSON). Если файл логов стал меньше проиндексированного,
+    индекс строится заново.
+    Файл индекса общий для всех процессов, пишущих логи: перед
+    дописыванием процесс под блокировкой файла (flock) читает записи,
+    добавленные другими, и индексирует логи только дальше них.
+    Повторные и нарушающие порядок смещений записи при чтении
+    пропускаются, так что поиск (bisect) работает по упорядоченным данным
+    """
+
+    CHECKPOINT_BYTES = 64 * 1024
+
+    USER_QUERY_RE = re.compile(
+        r"Query_ID:\s*([\d\w-]+)\s*ID-пользователя:\s*([^\t]*)\t"
+    )
+
+    def __init__(self, path_to_log_file, path_to_index_file=None):
+        self.path_to_log_file = path_to_log_file
+        self.path_to_index_file = path_to_index_file or path_to_log_file + '.idx'
+
+        self._lock = threading.Lock()
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        # контрольные точки: время и смещение строки
+        self._checkpoint_times = []
+        self._checkpoint_offsets = []
+
+        # строки с запросами: (время, смещение, Query_ID, ID-пользователя)
+        self._queries = []
+
+        self._indexed_size = 0
+
+        # сколько байт файла индекса уже прочитано
+        self._index_pos = 0
+
+    def _add_record(self, record: dict):
+        """
+        Учет записи индекса. Записи со смещением не больше уже учтенного
+        (повторы, перемешанные записи нескольких процессов) пропускаются
+        """
+
+        if 'end' in record:
+            self._indexed_size = max(self._indexed_size, record['end'])
+            return
+
+        line_dt = datetime.datetime.strptime(record['t'], DATETIME_FORMAT)
+        if 'q' in record:
+            if self._queries and record['o'] <= self._queries[-1][1]:
+                return
+            self._queries.append((line_dt, record['o'], record['q'], record['u']))
+        else:
+            if self._checkpoint_offsets and record['o'] <= self._checkpoint_offsets[-1]:
+                return
+            self._checkpoint_times.append(line_dt)
+            self._checkpoint_offsets.append(record['o'])
+
+    def _sync(self, index_file):
+        """
+        Чтение записей, дописанных в файл индекса (открыт в двоичном
+        режиме под блокировкой) с прошлого чтения, в том числе другими
+        процессами
+        """
+
+        index_file.seek(0, io.SEEK_END)
+        if index_file.tell() < self._index_pos:
+            # индекс пересоздан другим процессом
+            self._reset()
+
+        index_file.seek(self._index_pos)
+        for line in index_file:
+            if not line.endswith(b'\n'):
+                # строка еще дописывается
+                break
+
+            self._index_pos += len(line)
+            try:
+                self._add_record(json.loads(line.decode('utf-8')))
+            except ValueError:
+                # недописанная при аварийном завершении строка
+                continue
+
+    def _load(self):
+        """Чтение сохраненного индекса"""
+
+        if not path.exists(self.path_to_index_file):
+            return
+
+        with open(self.path_to_index_file, 'rb') as index_in:
+            fcntl.flock(index_in, fcntl.LOCK_SH)
+            self._sync(index_in)
+
+    def refresh(self):
+        """Индексирование дописанной с прошлого раза части логов"""
+
+        with self._lock:
+            if not path.exists(self.path_to_log_file):
+                return
+
+            # блокировка снимается при закрытии файла
+            with open(self.path_to_index_file, 'ab+') as index_file:
+                fcntl.flock(index_file, fcntl.LOCK_EX)
+                self._sync(index_file)
+
+                index_file.seek(0, io.SEEK_END)
+                if index_file.tell() > self._index_pos:
+                    # недописанная при аварийном завершении строка
+                    index_file.write(b'\n')
+                    index_file.flush()
+                    self._index_pos = index_file.tell()
+
+                if path.getsize(self.path_to_log_file) < self._indexed_size:
+                    # файл логов пересоздан
+                    self._reset()
+                    index_file.truncate(0)
+
+                self._index_log(index_file)
+
+    def _index_log(self, index_file):
+        """
+        Индексирование логов после уже проиндексированной части
+        и дописывание записей в файл индекса (под блокировкой)
+        """
+
+        records = []
+        offset = self._indexed_size
+        last_checkpoint = self._checkpoint_offsets[-1] if self._checkpoint_offsets else None
+
+        with open(self.path_to_log_file, 'rb') as log_in:
+            log_in.seek(offset)
+            for raw_line in log_in:
+                if not raw_line.endswith(b'\n'):
+                    # строка еще дописывается
+                    break
+
+                line_offset, offset = offset, offset + len(raw_line)
+                line = raw_line.decode('utf-8', errors='replace')
+
+                need_checkpoint = (
+                    last_checkpoint is None or
+                    line_offset - last_checkpoint >= LogIndex.CHECKPOINT_BYTES
+                )
+                user_query = LogIndex.USER_QUERY_RE.search(line)
+                if not need_checkpoint and not user_query:
+                    continue
+
+                line_splitted = line.split()
+                try:
+                    line_time = line_splitted[0] + " " + line_splitted[1]
+                    LogsRetriever._get_dt_from_line(line_time)
+                except (IndexError, ValueError):
+                    # продолжение многострочной записи
+                    continue
+
+                if need_checkpoint:
+                    records.append({'t': line_time, 'o': line_offset})
+                    last_checkpoint = line_offset
+
+                if user_query:
+                    query_id, user_id = user_query.groups()
+                    records.append({
+                        't': line_time,
+                        'o': line_offset,
+                        'q': query_id.strip(),
+                        'u': user_id.strip(),
+                    })
+
+        if offset == self._indexed_size:
+            return
+
+        records.append({'end': offset})
+        index_file.write(b''.join(
+            json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+            for record in records
+        ))
+        index_file.flush()
+        self._index_pos = index_file.tell()
+
+        for record in records:
+            self._add_record(record)
+
+    def offset_since(self, since: datetime.datetime):
+        """
+        Смещение, начиная с которого в файле находятся
+        все строки не старше since
+        """
+
+        with self._lock:
+            # строки разных потоков могут немного перемешиваться
+            # по времени, поэтому берется на одну точку раньше
+            idx = bisect_left(self._checkpoint_times, since) - 2
+            if idx < 0:
+                return 0
+            return self._checkpoint_offsets[idx]
+
+    def queries_since(self, since: datetime.datetime):
+        """Запросы пользователей не старше since: (смещение, Query_ID, ID-пользователя)"""
+
+        with self._lock:
+            idx = bisect_left(self._queries, (since,))
+            return [(offset, query_id, user_id) for _, offset, query_id, user_id in self._queries[idx:]]
+
+    def read_lines_from(self, offset: int):
+        """Строки файла логов, начиная со смещения"""
+
+        with open(self.path_to_log_file, 'rb') as log_in:
+            log_in.seek(offset)
+            for line in io.TextIOWrapper(log_in, encoding='utf-8'):
+                yield line
+
+
 class LogsRetriever:
     """
     Класс для вывода логов в Телеграме. Используется как нами,
@@ -145,6 +369,7 @@ class LogsRetriever:
     # Должен быть именно в этом файле так как жёстко связан с форматом логов
     def __init__(self, path_to_log_file=LOGS_PATH):
         self.path_to_log_file = path_to_log_file
+        self._log_index = LogIndex(path_to_log_file)
 
     def get_log(self, kind='all', user_id=None, time_delta=15):
         """Возвращает лог"""
@@ -194,8 +419,20 @@ class LogsRetriever:
         logs = []
 
         dt_now = datetime.datetime.now()
+
+        # чтение начинается с первого запроса пользователя за период
+        self._log_index.refresh()
+        user_id_re = re.compile(str(user_id))
+        offsets = [
+            offset for offset, _, query_user_id
+            in self._log_index.queries_since(dt_now - time_delta)
+            if user_id_re.match(query_user_id)
+        ]
+        if not offsets:
+            return ''
+
         possible_querie_res = []
-        for line in open(self.path_to_log_file, encoding='utf-8'):
+        for line in self._log_index.read_lines_from(min(offsets)):
             line = line.strip()
             try:
                 is_found_in_query = False
@@ -240,7 +477,10 @@ class LogsRetriever:
         dt_now = datetime.datetime.now()
         need_level = string_to_log_level(min_level)
 
-        for line in open(self.path_to_log_file, encoding='utf-8'):
+        self._log_index.refresh()
+        offset = self._log_index.offset_since(dt_now - time_delta)
+
+        for line in self._log_index.read_lines_from(offset):
             try:
                 line_splitted = line.split()
                 line_dt = LogsRetriever._get_dt_from_line(
@@ -26,6 +26,9 @@ import uuid
 from config import DATETIME_FORMAT, LOG_LEVEL
 from config import TEST_PATH_CUBE, TEST_PATH_MINFIN, TEST_PATH_RESULTS
 from config import WRONG_AUTO_MINFIN_TESTS_FILE
+from core.answer_cache import AnswerCache
+from core.mdx_server import MdxServer
+from core.solr import Solr
 from data_retrieving import DataRetrieving
 from logs_helper import string_to_log_level
 from model_manager import MODEL_CONFIG
@@ -909,6 +912,19 @@ def _main():
     if not isnan(score):
         print("Score: {:.4f}".format(score))
 
+    # время Solr отдельно от остального конвейера
+    print("Solr latency: {}".format(
+        json.dumps(Solr.inst().latency_stats(), indent=4)
+    ))
+
+    print("MDX cache: {}".format(
+        json.dumps(MdxServer.inst().cache.stats(), indent=4)
+    ))
+
+    print("Answer cache: {}".format(
+        json.dumps(AnswerCache.inst().stats(), indent=4)
+    ))
+
 
 if __name__ == "__main__":
     _main()
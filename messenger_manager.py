@@ -14,6 +14,68 @@ from speechkit import speech_to_text
 import constants
 
 
+# чем меньше, тем больше примеров будет подходить
+JACCARD_SIMILARITY_THRESHOLD = 0.7
+
+
+class PhraseIndex:
+    """
+    Группы фраз small-talk с ответами. Фразы заранее разбиты на
+    множества слов и разложены по инвертированному индексу
+    слово -> (номер группы, фраза). Мера Жаккара больше нуля только
+    у фраз с общим с сообщением словом, поэтому оцениваются только
+    они. Как и при переборе групп по порядку, выбирается первая
+    группа, в которой есть фраза с мерой выше порога
+    """
+
+    def __init__(self, groups, threshold=JACCARD_SIMILARITY_THRESHOLD):
+        """groups - последовательность пар (фразы, ответы)"""
+        self.threshold = threshold
+        self._answers = []
+        self._postings = {}
+        for group_num, (phrases, answers) in enumerate(groups):
+            self._answers.append(answers)
+            for phrase in phrases:
+                phrase_set = frozenset(phrase.split())
+                for word in phrase_set:
+                    self._postings.setdefault(word, []).append((group_num, phrase_set))
+
+    def find_group(self, tokens: set):
+        """Номер первой подходящей группы или None"""
+        best = None
+        for word in tokens:
+            # списки упорядочены по номеру группы
+            for group_num, phrase_set in self._postings.get(word, ()):
+                if best is not None and group_num >= best:
+                    break
+                if get_jaccard(tokens, phrase_set) > self.threshold:
+                    best = group_num
+                    break
+        return best
+
+    def find(self, tokens: set):
+        """Ответы первой подходящей группы или None"""
+        group_num = self.find_group(tokens)
+        if group_num is None:
+            return None
+        return self._answers[group_num]
+
+
+HELLO_WORDS = frozenset(constants.HELLO)
+
+SMALL_TALK_INDEX = PhraseIndex((
+    (constants.HOW_ARE_YOU, constants.HOW_ARE_YOU_ANSWER),
+    (constants.WHO_YOU_ARE, constants.WHO_YOU_ARE_ANSWER),
+    (constants.WHAT_CAN_YOU_DO, constants.WHAT_CAN_YOU_DO_ANSWER),
+    (constants.WHO_IS_YOUR_CREATOR, constants.WHO_IS_YOUR_CREATOR_ANSWER),
+))
+
+# множество слов -> первый ключ EASTER_EGGS с таким набором слов
+EASTER_EGGS_INDEX = {
+    frozenset(key.split()): key for key in reversed(list(constants.EASTER_EGGS))
+}
+
+
 def log_user_query(request_id, user_id, user_name, platform, query, query_type):
     """
     Сохраняет пользовательский запрос как в самих логах,
@@ -71,6 +133,46 @@ class MessengerManager:
 
         return MessengerManager._querying(text, request_id)
 
+    @staticmethod
+    def make_request_batch(texts, source, user_id, user_name, request_ids):
+        """API метод для пакета текстовых запросов.
+
+        :param texts: список запросов
+        :param source: источник (web, cmd, telegram, unity)
+        :param user_id: идетификатор пользователя
+        :param user_name: имя пользователя
+        :param request_ids: идентификаторы запросов
+        :return: список объектов CoreAnswer в порядке запросов
+        """
+
+        texts = [' '.join(text.split()) for text in texts]
+        for text, request_id in zip(texts, request_ids):
+            log_user_query(
+                request_id,
+                user_id,
+                user_name,
+                source,
+                text,
+                'text'
+            )
+
+        try:
+            results = DataRetrieving.get_data_batch(texts, request_ids)
+        except Exception as err:
+            # пакет обрабатывается по одному запросу, чтобы ошибка
+            # в одном из них не лишала ответа остальные
+            logging.exception(err)
+            return [
+                MessengerManager._querying(text, request_id)
+                for text, request_id in zip(texts, request_ids)
+            ]
+
+        for result in results:
+            if result.status is True:
+                result.message = constants.MSG_WE_WILL_FORM_DATA_AND_SEND_YOU
+
+        return results
+
     @staticmethod
     def make_voice_request(
             source, user_id, user_name,
@@ -118,44 +220,19 @@ class MessengerManager:
         :return: либо строку, либо None
         """
 
-        # чем меньше, тем больше примеров будет подходить
-        JACCARD_SIMILARITY_THRESHOLD = 0.7
-
         text, tokens = MessengerManager._simple_split(text)
         tokens = set(tokens)
 
-        for word in tokens:
-            if word in constants.HELLO:
-                return random.choice(constants.HELLO_ANSWER)
-
-        for cur_const in constants.HOW_ARE_YOU:
-            cur_set = set(cur_const.split())
-            if get_jaccard(tokens, cur_set) > JACCARD_SIMILARITY_THRESHOLD:
-                return random.choice(constants.HOW_ARE_YOU_ANSWER)
-
-        for cur_const in constants.WHO_YOU_ARE:
-            cur_set = set(cur_const.split())
-            if get_jaccard(tokens, cur_set) > JACCARD_SIMILARITY_THRESHOLD:
-                return random.choice(constants.WHO_YOU_ARE_ANSWER)
-
-        for cur_const in constants.WHAT_CAN_YOU_DO:
-            cur_set = set(cur_const.split())
-            if get_jaccard(tokens, cur_set) > JACCARD_SIMILARITY_THRESHOLD:
-                return random.choice(constants.WHAT_CAN_YOU_DO_ANSWER)
-
-        for cur_const in constants.WHO_IS_YOUR_CREATOR:
-            cur_set = set(cur_const.split())
-            if get_jaccard(tokens, cur_set) > JACCARD_SIMILARITY_THRESHOLD:
-                return random.choice(constants.WHO_IS_YOUR_CREATOR_ANSWER)
-
-        for cur_const in constants.WHO_IS_YOUR_CREATOR:
-            cur_set = set(cur_const.split())
-            if get_jaccard(tokens, cur_set) > JACCARD_SIMILARITY_THRESHOLD:
-                return random.choice(constants.WHO_IS_YOUR_CREATOR_ANSWER)
-
-        for key in constants.EASTER_EGGS.keys():
-            if set(key.split()) == tokens:
-                return random.choice(constants.EASTER_EGGS[key])
+        if not HELLO_WORDS.isdisjoint(tokens):
+            return random.choice(constants.HELLO_ANSWER)
+
+        answers = SMALL_TALK_INDEX.find(tokens)
+        if answers is not None:
+            return random.choice(answers)
+
+        easter_egg = EASTER_EGGS_INDEX.get(frozenset(tokens))
+        if easter_egg is not None:
+            return random.choice(constants.EASTER_EGGS[easter_egg])
 
         for thank_you_word in constants.THANK_YOU:
             if thank_you_word in text:
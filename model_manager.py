@@ -65,6 +65,16 @@ def save_default_model(mdl: ModelManager):
     return MODEL_CONFIG
 
 
+def load_model_value(key: str, path: str = MODEL_CONFIG_PATH):
+    """
+    Значение key из файла настроек модели. Другие процессы (например,
+    update_date.py) сохраняют изменения в файл, а MODEL_CONFIG этого
+    процесса остается прежним
+    """
+    with open(path) as file_in:
+        return json.load(file_in)[key]
+
+
 def restore_default_model():
     """Восстанавливает настройки модели из файла"""
     global MODEL_CONFIG
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Заранее посчитанные леммы слов из базы знаний, вопросов Минфина
+и тестов. Словарь хранится в файле SQLite, который процессы сервера
+открывают только на чтение и отображают в память: страницы файла
+общие для всех процессов через кеш операционной системы
+"""
+
+from os import path, remove, replace
+from urllib.request import pathname2url
+import sqlite3
+import threading
+
+from config import LEMMA_DICTIONARY_PATH
+from utils.database import MMAP_SIZE
+
+
+class LemmaDictionary:
+    """
+    Словарь слово -> лемма, открытый на чтение. Если файла нет,
+    словарь пуст и все слова считаются промахами. Считает
+    попадания и промахи. Синглтон! Singleton!
+    """
+
+    __instance = None
+
+    @staticmethod
+    def inst():
+        """Реализует Синглтон"""
+        if LemmaDictionary.__instance is None:
+            LemmaDictionary.__instance = LemmaDictionary()
+        return LemmaDictionary.__instance
+
+    def __init__(self, file_path: str = LEMMA_DICTIONARY_PATH):
+        self.file_path = file_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._size = 0
+        self.reload()
+
+    def reload(self):
+        """
+        Открытие файла словаря заново, например, после его
+        пересоздания через build_lemma_dictionary
+        """
+
+        connection, size = None, 0
+
+        if path.isfile(self.file_path):
+            connection = sqlite3.connect(
+                'file:{}?mode=ro'.format(pathname2url(path.abspath(self.file_path))),
+                uri=True,
+                check_same_thread=False
+            )
+            connection.execute('PRAGMA query_only = 1')
+            connection.execute('PRAGMA mmap_size = {}'.format(MMAP_SIZE))
+            size = connection.execute('SELECT count(*) FROM lemma').fetchone()[0]
+
+        with self._lock:
+            old_connection = self._connection
+            self._connection, self._size = connection, size
+
+        if old_connection is not None:
+            old_connection.close()
+
+    def close(self):
+        """Закрытие файла словаря, дальше все слова - промахи"""
+
+        with self._lock:
+            connection, self._connection, self._size = self._connection, None, 0
+
+        if connection is not None:
+            connection.close()
+
+    def get(self, word: str):
+        """Лемма слова или None, если слова нет в словаре"""
+
+        with self._lock:
+            if self._connection is None:
+                self.misses += 1
+                return None
+
+            row = self._connection.execute(
+                'SELECT lemma FROM lemma WHERE word = ?', (word,)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return row[0]
+
+    def stats(self):
+        """Попадания, промахи и размер словаря"""
+
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': self._size,
+            }
+
+
+def build_lemma_dictionary(words, lemmatize, file_path: str = LEMMA_DICTIONARY_PATH):
+    """
+    Построение файла словаря для слов words функцией lemmatize.
+    Файл собирается рядом и подменяет старый целиком, поэтому
+    процессы, читающие старый файл, не видят его наполовину
+    записанным. Возвращает количество слов в словаре
+    """
+
+    tmp_path = '{}.tmp'.format(file_path)
+    if path.isfile(tmp_path):
+        remove(tmp_path)
+
+    rows = sorted((word, lemmatize(word)) for word in set(words) if word)
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute(
+            'CREATE TABLE lemma (word TEXT PRIMARY KEY, lemma TEXT NOT NULL) '
+            'WITHOUT ROWID'
+        )
+        with connection:
+            connection.executemany('INSERT INTO lemma VALUES (?, ?)', rows)
+        connection.execute('VACUUM')
+    finally:
+        connection.close()
+
+    replace(tmp_path, file_path)
+    return len(rows)
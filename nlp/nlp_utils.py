@@ -91,8 +91,13 @@ def clean_double_spaces(text):
 clean_double_spaces.regexp = re.compile(r'[\s_]+', re.DOTALL)
 
 
+_numeric_re = TokenTypes.type_re('numeric')
+
+
 def try_int(obj):
-    if not isinstance(obj, str) or not TokenTypes.in_type(obj, 'numeric'):
+    # строка с цифрами не может быть пустой, пробелом или пунктуацией,
+    # поэтому проверки TokenTypes.in_type сводятся к одной
+    if not isinstance(obj, str) or _numeric_re.fullmatch(obj) is None:
         return obj
     return int(obj)
 
@@ -100,36 +105,73 @@ def try_int(obj):
 token_split_re = re.compile(
     r'((?:[\s_]+)|(?<=[a-zа-яё])/(?=[a-zа-яё]))', re.DOTALL)
 
+# Тип фрагмента между разделителями за один fullmatch. Порядок
+# альтернатив повторяет порядок проверок TokenTypes.in_type.
+# Слово или число, окруженное только пунктуацией, nltk не разбивает
+# внутри, а re_strip снимает пунктуацию по краям, поэтому без
+# пунктуации в результате от фрагмента остается группа stripped.
+# Латинские слова туда не попадают из-за английских сокращений nltk
+_fragment_re = re.compile(r'''
+    (?P<whitespace> [\s_]+ )
+    | (?P<punctuation> \W+ )
+    | (?P<word> [a-zа-яё]+ )
+    | \W* (?P<stripped> [а-яё]+ (?: -[а-яё]+ )* | \d+ ) \W*
+    ''', re.IGNORECASE | re.VERBOSE)
+
+
+def scan_tokens(text: str, with_punct=False):
+    """
+    Фрагменты текста с типами за один проход: пары (тип, фрагмент),
+    где тип - whitespace, punctuation, word, stripped (слово или
+    число без окружающей пунктуации, только при with_punct=False)
+    или complex (фрагмент, который нужно разбирать через nltk)
+    """
+
+    for fragment in token_split_re.split(text):
+        if not fragment:
+            continue
+        match = _fragment_re.fullmatch(fragment)
+        if match is None:
+            yield 'complex', fragment
+        elif match.lastgroup == 'stripped':
+            if with_punct:
+                yield 'complex', fragment
+            else:
+                yield 'stripped', match.group('stripped')
+        else:
+            yield match.lastgroup, fragment
 
-def advanced_tokenizer(text: str, with_punct=False, with_spaces=False):
-    tokens = token_split_re.split(text)
 
-    for idx, token in enumerate(tokens):
-        if TokenTypes.in_type(token, 'whitespace'):
-            if not with_spaces:
-                token = None
-            tokens[idx] = (token,)
-            continue
-        if TokenTypes.in_type(token, 'punctuation'):
-            if not with_punct:
-                token = None
-            tokens[idx] = (token,)
-            continue
-        if TokenTypes.in_type(token, ('null', 'word')):
-            tokens[idx] = (token,)
-            continue
+def nltk_tokens(token: str, with_punct=False):
+    """Разбор сложного фрагмента через nltk со снятием пунктуации по краям"""
 
-        newtokens = nltk.word_tokenize(token)
-        for newidx, newtoken in enumerate(newtokens):
-            newtoken = re_strip(
-                TokenTypes.type_re('punctuation'), newtoken, only_text=False)
-            if not with_punct:
-                newtoken = (newtoken[1],)
-            else:
-                newtoken = [
-                    i[0] if isinstance(i, tuple) else i for i in newtoken
-                ]
-            newtokens[newidx] = newtoken
-        tokens[idx] = itertools.chain.from_iterable(newtokens)
+    newtokens = nltk.word_tokenize(token)
+    for newidx, newtoken in enumerate(newtokens):
+        newtoken = re_strip(
+            TokenTypes.type_re('punctuation'), newtoken, only_text=False)
+        if not with_punct:
+            newtoken = (newtoken[1],)
+        else:
+            newtoken = [
+                i[0] if isinstance(i, tuple) else i for i in newtoken
+            ]
+        newtokens[newidx] = newtoken
+    return [t for t in itertools.chain.from_iterable(newtokens) if t]
+
+
+def advanced_tokenizer(text: str, with_punct=False, with_spaces=False):
+    tokens = []
+
+    for token_type, token in scan_tokens(text, with_punct):
+        if token_type == 'whitespace':
+            if with_spaces:
+                tokens.append(token)
+        elif token_type == 'punctuation':
+            if with_punct:
+                tokens.append(token)
+        elif token_type == 'complex':
+            tokens.extend(nltk_tokens(token, with_punct))
+        else:
+            tokens.append(token)
 
-    return list(filter(None, itertools.chain.from_iterable(tokens)))
+    return tokens
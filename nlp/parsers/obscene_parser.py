@@ -7,7 +7,7 @@ Created on Tue Sep  5 02:43:14 2017
 """
 
 from nlp.obscene_preprocessor import process_file
-from nlp.tonita_parser import TonitaParser, ReHandler, ReplaceHandler
+from nlp.tonita_parser import TonitaParser, MultiReplaceHandler, ReHandler
 
 
 obs_tp = TonitaParser()
@@ -15,8 +15,8 @@ obs_tp = TonitaParser()
 _obs_regs, _obs_words = [dict.fromkeys(
     o, '<censored>') for o in process_file('nlp/obscene.txt')]
 
-obs_tp.handlers.extend(ReplaceHandler.fromdict(
-    _obs_words, sep_left=True, sep_right=True))
+# Все словоформы заменяются за один проход по словам текста
+obs_tp.handlers.append(MultiReplaceHandler('<censored>', _obs_words))
 obs_tp.handlers.extend(ReHandler.fromdict(
     _obs_regs, sep_left=True, sep_right=True, flags=34))
 
@@ -16,6 +16,9 @@ import re
 from nlp.nlp_utils import try_int
 
 
+_SEP_LEFT = r'(?<![\w-])'
+_SEP_RIGHT = r'(?![\w-])'
+
 class TonitaHandler(object):
     def __init__(self, process=None, check=None):
         self.process = process
@@ -58,9 +61,9 @@ class ReHandler(TonitaHandler):
                  sep_right=True):
         if isinstance(regexp, str):
             if sep_left:
-                regexp = r'(?<![\w-])' + regexp
+                regexp = _SEP_LEFT + regexp
             if sep_right:
-                regexp += r'(?![\w-])'
+                regexp += _SEP_RIGHT
             regexp = re.compile(regexp, flags)
         self.regexp = regexp
 
@@ -102,6 +105,101 @@ class ReHandler(TonitaHandler):
         return _wrapped
 
 
+class MultiReplaceHandler(TonitaHandler):
+    """
+    То же, что цепочка ReplaceHandler(repl, substr) с разделителями
+    с обеих сторон для substrs по порядку, но за один проход по словам
+    текста: все вхождения находятся по префиксному дереву слов, затем
+    отбираются так, как их заменила бы цепочка. Подстрока заменяет
+    вхождения, не задетые предыдущими подстроками, слева направо;
+    вхождение, начинающееся сразу за замененным этой же подстрокой,
+    str.replace пропускает, потому что пробел между ними уже занят
+    """
+
+    _end = None
+
+    def __init__(self, repl, substrs):
+        substrs = list(substrs)
+        self.repl = repl
+
+        self.trie = {}
+        pattern_words = set()
+        for idx, substr in enumerate(substrs):
+            words = substr.split(' ')
+            pattern_words.update(words)
+            node = self.trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node.setdefault(self._end, []).append(idx)
+
+        # Отбор вхождений по исходному тексту верен, если замена не
+        # создает новых вхождений, а пустых слов в подстроках нет.
+        # Иначе работает обычная цепочка
+        self._chain = None
+        if '' in pattern_words or not pattern_words.isdisjoint(repl.split(' ')):
+            self._chain = ReplaceHandler.fromdict(dict.fromkeys(substrs, repl))
+
+        super().__init__(process=self._process)
+
+    def _occurrences(self, words):
+        """Вхождения (номер подстроки, первое слово, слово после последнего)"""
+        res = []
+        for start, word in enumerate(words):
+            node = self.trie.get(word)
+            end = start + 1
+            while node is not None:
+                for idx in node.get(self._end, ()):
+                    res.append((idx, start, end))
+                if end == len(words):
+                    break
+                node = node.get(words[end])
+                end += 1
+        return res
+
+    def _process(self, text):
+        if self._chain is not None:
+            for handler in self._chain:
+                text = _apply_handler(handler, text)
+            return text
+
+        words = text.split(' ')
+        occurrences = self._occurrences(words)
+        if not occurrences:
+            return text
+
+        occurrences.sort()
+        replaced = [False] * len(words)
+        replacements = {}
+        last_idx, last_end = None, -1
+        for idx, start, end in occurrences:
+            if idx != last_idx:
+                last_idx, last_end = idx, -1
+            if start <= last_end or any(replaced[start:end]):
+                continue
+            replaced[start:end] = [True] * (end - start)
+            replacements[start] = end
+            last_end = end
+
+        res = []
+        pos = 0
+        while pos < len(words):
+            end = replacements.get(pos)
+            if end is None:
+                res.append(words[pos])
+                pos += 1
+            else:
+                res.append(self.repl)
+                pos = end
+        return ' '.join(res)
+
+
+def _apply_handler(handler, text):
+    if ((handler.check is None or handler.check(text)) and
+            handler.process is not None):
+        text = str(handler.process(text))
+    return text
+
+
 class TonitaParser(object):
     def __init__(self, *, handlers=None):
         self.handlers = handlers
@@ -150,13 +248,238 @@ class TonitaParser(object):
         else:
             res = str(text)
 
-        for handler in self.handlers:
-            if ((handler.check is None or handler.check(res)) and
-                    handler.process is not None):
-                res = str(handler.process(res))
+        res = self._process_str(res)
 
         if not isinstance(text, str) and isinstance(text, Iterable):
             return res.split(' ')
         return res
 
+    def _process_str(self, text):
+        for handler in self.handlers:
+            text = _apply_handler(handler, text)
+        return text
+
+    def compile(self):
+        return CompiledTonitaParser(handlers=self.handlers)
+
     __call__ = process
+
+
+class _HandlerStep(object):
+    """Обработчик, который не объединяется с соседними"""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __call__(self, text):
+        return _apply_handler(self.handler, text)
+
+
+class _FirstMatchStep(object):
+    """
+    Подряд идущие обработчики, для которых одним проходом можно
+    найти первый (по порядку) обработчик, находящий что-то в тексте.
+    Обработчики без совпадений ничего не меняют, поэтому достаточно
+    применить найденный и продолжить поиск со следующего за ним
+    по уже измененному тексту - результат тот же, что и у
+    последовательного применения всех обработчиков. Наследники
+    определяют _first_match(text, start) - номер первого обработчика
+    не раньше start, находящего что-то в тексте, или None
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+
+    def __call__(self, text):
+        idx = self._first_match(text, 0)
+        while idx is not None:
+            text = str(self.handlers[idx].process(text))
+            idx = self._first_match(text, idx + 1)
+        return text
+
+
+class _ReplaceStep(_FirstMatchStep):
+    """
+    ReplaceHandler с разделителями с обеих сторон: подстрока ищется
+    как последовательность слов, разделенных пробелами, поэтому все
+    подстроки находятся одним проходом по префиксному дереву слов
+    """
+
+    _end = None
+
+    def __init__(self, handlers):
+        super().__init__(handlers)
+
+        self.trie = {}
+        for idx, handler in enumerate(handlers):
+            node = self.trie
+            for field in handler.substr[1:-1].split(' '):
+                node = node.setdefault(field, {})
+            node.setdefault(self._end, []).append(idx)
+
+    @staticmethod
+    def accepts(handler):
+        return (isinstance(handler, ReplaceHandler) and
+                len(handler.substr) > 1 and
+                handler.substr[0] == handler.substr[-1] == ' ')
+
+    def _first_match(self, text, start):
+        fields = text.split(' ')
+        trie = self.trie
+        best = None
+
+        for pos, field in enumerate(fields):
+            node = trie.get(field)
+            pos += 1
+            while node is not None:
+                for idx in node.get(self._end, ()):
+                    if idx >= start and (best is None or idx < best):
+                        best = idx
+                if pos == len(fields):
+                    break
+                node = node.get(fields[pos])
+                pos += 1
+
+        return best
+
+
+class _ReStep(_FirstMatchStep):
+    """
+    ReHandler с одинаковыми флагами. Шаблоны объединяются в
+    альтернативы (?P<_hN>...) для отрезков дерева отрезков
+    по номерам обработчиков. Поиск по отрезку отвечает, есть
+    ли совпадение хотя бы у одного обработчика, а имя группы
+    совпадения - номер обработчика, дальше которого искать
+    первый совпавший не нужно. Общая для шаблонов проверка
+    левого разделителя выносится за альтернативы, чтобы
+    не повторяться для каждой из них в каждой позиции
+    """
+
+    _group_re = re.compile(r'\(\?(P<|P=|\()([^\W\d]\w*)')
+    _numeric_ref_re = re.compile(r'\\[1-9]|\(\?\(\d')
+
+    def __init__(self, handlers):
+        super().__init__(handlers)
+
+        self.flags = handlers[0].regexp.flags
+        self._gates = {}
+        self._build(0, len(handlers))
+
+    @staticmethod
+    def accepts(handler):
+        return (isinstance(handler, ReHandler) and
+                _ReStep._numeric_ref_re.search(handler.regexp.pattern) is None)
+
+    def _alternative(self, idx, pattern):
+        prefix = '_h{}'.format(idx)
+        pattern = _ReStep._group_re.sub(r'(?\1{}_\2'.format(prefix), pattern)
+        # в режиме VERBOSE шаблон может закончиться комментарием
+        if self.flags & re.VERBOSE:
+            pattern += '\n'
+        return '(?P<{}>{})'.format(prefix, pattern)
+
+    def _build(self, low, high):
+        alternatives, separated = [], []
+        for idx in range(low, high):
+            pattern = self.handlers[idx].regexp.pattern
+            if pattern.startswith(_SEP_LEFT):
+                separated.append(
+                    self._alternative(idx, pattern[len(_SEP_LEFT):]))
+            else:
+                alternatives.append(self._alternative(idx, pattern))
+
+        if separated:
+            alternatives.insert(0, '{}(?:{})'.format(
+                _SEP_LEFT, '|'.join(separated)))
+
+        self._gates[low, high] = re.compile('|'.join(alternatives), self.flags)
+
+        if high - low > 1:
+            mid = (low + high) // 2
+            self._build(low, mid)
+            self._build(mid, high)
+
+    def _first_match(self, text, start, low=0, high=None):
+        if high is None:
+            high = len(self.handlers)
+        if high <= start:
+            return None
+
+        found = None
+        if low >= start:
+            match = self._gates[low, high].search(text)
+            if match is None:
+                return None
+            found = int(match.lastgroup[2:])
+            if found == low:
+                return found
+
+        mid = (low + high) // 2
+        res = self._first_match(text, start, low, mid)
+        if res is None:
+            if found == mid:
+                return found
+            res = self._first_match(text, start, mid, high)
+        return res
+
+
+class CompiledTonitaParser(TonitaParser):
+    """
+    TonitaParser, который дает тот же результат за меньшее число
+    проходов по тексту: подряд идущие ReplaceHandler ищутся одним
+    проходом по префиксному дереву, подряд идущие ReHandler - одним
+    поиском по объединенному регулярному выражению. Отдельной
+    проверки check нет: обработчик применяется, только если
+    его шаблон найден. Обработчики, добавленные после компиляции,
+    не учитываются
+    """
+
+    def __init__(self, *, handlers=None):
+        super().__init__(handlers=handlers)
+        self.steps = self._compile_steps(self.handlers)
+
+    @staticmethod
+    def _compile_steps(handlers):
+        steps = []
+        group, group_key = [], None
+
+        def close_group():
+            if not group:
+                return
+            if group_key[0] is _ReplaceStep:
+                steps.append(_ReplaceStep(list(group)))
+                return
+            try:
+                steps.append(_ReStep(list(group)))
+            except re.error:
+                # шаблоны не объединились, например, из-за флагов внутри
+                steps.extend(_HandlerStep(handler) for handler in group)
+
+        for handler in handlers:
+            if _ReplaceStep.accepts(handler):
+                key = (_ReplaceStep,)
+            elif _ReStep.accepts(handler):
+                key = (_ReStep, handler.regexp.flags)
+            else:
+                key = None
+
+            if key != group_key or key is None:
+                close_group()
+                group.clear()
+                group_key = key
+
+            if key is None:
+                steps.append(_HandlerStep(handler))
+            else:
+                group.append(handler)
+
+        close_group()
+        return steps
+
+    def _process_str(self, text):
+        for step in self.steps:
+            text = step(text)
+        return text
+
+    def compile(self):
+        return self
@@ -6,21 +6,26 @@
 """
 
 from math import isnan
-from os import path
+from os import listdir, path
 import argparse
 import datetime
 import json
 import logging
 import sys
 
-from config import SETTINGS, TEST_PATH_RESULTS, DATETIME_FORMAT
+from config import SETTINGS, TEST_PATH_CUBE, TEST_PATH_MINFIN, TEST_PATH_RESULTS, DATETIME_FORMAT
+from core.answer_cache import AnswerCache
 from core.cube_classifier import train_and_save_cube_clf, select_best_cube_clf
 from core.cube_or_minfin_classifier import select_best_cube_or_minfin_clf, train_and_save_cube_or_minfin_clf
+from core.support_library import reload_tech_data
 from kb.db_filling import KnowledgeBaseSupport
 from kb.docs_generation_for_cubes import CubeDocsGeneration
 from kb.docs_generation_for_minfin import set_up_minfin_data
+from kb.kb_support_library import kb_snapshot, read_minfin_data, reload_kb_snapshot
 from manual_testing import get_results
 from model_manager import MODEL_CONFIG, set_default_model, restore_default_model
+from nlp.lemma_dictionary import LemmaDictionary, build_lemma_dictionary
+from text_preprocessing import TextPreprocessing
 import logs_helper
 
 
@@ -40,6 +45,9 @@ def set_up_db():
     kbs = KnowledgeBaseSupport('knowledge_base.db.sql', db_file)
     kbs.set_up_db()
 
+    # база знаний пересоздана, снимок нужно построить заново
+    reload_kb_snapshot()
+
 
 @logs_helper.time_with_message("set_up_cube_data", "info")
 def set_up_cube_data(index_way='curl'):
@@ -59,6 +67,44 @@ def set_up_cube_data(index_way='curl'):
     else:
         dga.index_created_documents_via_jar_file()
 
+    # технические данные изменились, индексы нужно построить заново
+    reload_tech_data()
+
+
+@logs_helper.time_with_message("set_up_lemma_dictionary", "info")
+def set_up_lemma_dictionary():
+    """
+    Построение словаря лемм по подписям и ключевым словам базы
+    знаний, вопросам и ключевым словам Минфина и тестам
+    """
+
+    texts = []
+
+    snapshot = kb_snapshot()
+    for rows in (snapshot.members, snapshot.measures, snapshot.dimensions):
+        for row in rows.values():
+            texts.append(row['caption'])
+            texts.append(row.get('key_words'))
+    for row in snapshot.cubes.values():
+        texts.append(row['caption'])
+        texts.append(row['key_words'])
+
+    _, dfs = read_minfin_data()
+    for df in dfs:
+        texts.extend(df['question'])
+        texts.extend(df['key_words'])
+
+    for test_path in (TEST_PATH_CUBE, TEST_PATH_MINFIN):
+        for file_name in listdir(test_path):
+            with open(path.join(test_path, file_name), encoding='utf-8-sig') as file_in:
+                texts.extend(line.rsplit(':', 1)[0] for line in file_in)
+
+    words = TextPreprocessing.lemma_dictionary_words(texts)
+    size = build_lemma_dictionary(words, TextPreprocessing.pymorphy_lemma)
+    LemmaDictionary.inst().reload()
+
+    logging.info('Словарь лемм построен: {} слов'.format(size))
+
 
 if __name__ == '__main__':
     # pylint: disable=invalid-name
@@ -96,6 +142,12 @@ if __name__ == '__main__':
         help='Создание и индексирование документов по минфину',
     )
 
+    parser.add_argument(
+        "--lemmas",
+        action='store_true',
+        help='Построение словаря лемм (строится и после --db или --minfin)',
+    )
+
     parser.add_argument(
         "--solr-index", nargs='?', choices=['curl', 'jar'],
         help=(
@@ -126,7 +178,7 @@ if __name__ == '__main__':
         select_best_cube_or_minfin_clf()
         args.clf = True
 
-    if not args.clf and not args.db and not args.cube and not args.minfin:
+    if not args.clf and not args.db and not args.cube and not args.minfin and not args.lemmas:
         print("Ничего не делаю. Если вы хотите иного, вызовите {} --help".format(
             sys.argv[0]
         ))
@@ -141,6 +193,14 @@ if __name__ == '__main__':
         set_up_cube_data(args.solr_index)
     if args.minfin:
         set_up_minfin_data(args.solr_index)
+        reload_tech_data()
+    if args.db or args.minfin or args.lemmas:
+        # словарь лемм собирается из базы знаний и вопросов Минфина
+        set_up_lemma_dictionary()
+
+    # ответы, построенные на старых данных и моделях, больше не верны
+    AnswerCache.inst().invalidate()
+
     if not args.disable_testing and args.cube and args.minfin:
         if args.turn_on_mwat:
             MODEL_CONFIG["use_local_file_processing_for_minfin"] = True
@@ -15,6 +15,7 @@ from pymorphy2 import MorphAnalyzer
 
 from model_manager import MODEL_CONFIG
 from nlp import nlp_utils
+from nlp.lemma_dictionary import LemmaDictionary
 from nlp.parsers.num_parser import num_tp
 from nlp.parsers.obscene_parser import obs_tp
 from nlp.parsers.syn_parser import syn_tp
@@ -29,6 +30,77 @@ def _mc_get(key):
     return MODEL_CONFIG[key] if key in MODEL_CONFIG else False
 
 
+# Символы, несущие смысловую нагрузку
+_SYMBOLS = {
+    '%': 'процент',
+    '$': 'доллар',
+    '€': 'евро',
+    '£': 'фунт стерлингов',
+    '₽': 'рубль',
+}
+_SYMBOLS_TABLE = str.maketrans(
+    {symb: ' {} '.format(repl) for symb, repl in _SYMBOLS.items()})
+
+
+class _NormalizationPipeline(object):
+    """
+    Этапы нормализации с параметрами, зафиксированными при создании
+    TextPreprocessing: парсер собран, множество стоп-слов объединено
+    с вопросительными словами заранее, поэтому вызов не обращается
+    к параметрам и не собирает ничего заново
+    """
+
+    __slots__ = (
+        'lemmatizer',
+        'parser',
+        'delete_digits',
+        'stop_words',
+        'delete_repeatings',
+    )
+
+    def __init__(self, lemmatizer, parser, delete_digits, stop_words, delete_repeatings):
+        self.lemmatizer = lemmatizer
+        self.parser = parser
+        self.delete_digits = delete_digits
+        self.stop_words = frozenset(stop_words)
+        self.delete_repeatings = delete_repeatings
+
+    def __call__(self, text: str):
+        # Убираем плюсы-ударения
+        if '+' in text:
+            text = text.replace('\\+', '').replace('+', '')
+
+        # TODO: убрать костыль
+        if 'ъем' in text:
+            text = text.replace('ъем', 'ъём')
+
+        # Фильтруем важные символы
+        text = text.translate(_SYMBOLS_TABLE)
+
+        # Токенизируем, лемматизируем и парсим
+        tokens = self.lemmatizer(text)
+        if self.parser is not None:
+            tokens = self.parser(tokens)
+
+        stop_words = self.stop_words
+        delete_digits = self.delete_digits
+        if self.delete_repeatings:
+            seen = set()
+            result = []
+            for token in tokens:
+                if (token in stop_words or token in seen or
+                        (delete_digits and token.isdigit())):
+                    continue
+                seen.add(token)
+                result.append(token)
+            return ' '.join(result)
+
+        return ' '.join([
+            token for token in tokens
+            if token not in stop_words and not (delete_digits and token.isdigit())
+        ])
+
+
 class TextPreprocessing(object):
     """
     Класс для предварительной обработки текста
@@ -86,51 +158,27 @@ class TextPreprocessing(object):
             self.lemmatizer = nlp_utils.advanced_tokenizer
             self.lemmatizer_name = 'nltk'
 
-        if self.log:
-            logging.info(self.setup_str)
-
-    def normalize(self, text, request_id='<NoID>'):
-        """Метод для нормализации текста"""
-
-        # Убираем плюсы-ударения
-        if '+' in text:
-            text = text.replace('\\+', '')
-            text = text.replace('+', '')
-
-        # TODO: убрать костыль
-        if 'ъем' in text:
-            text = text.replace('ъем', 'ъём')
-
-        # Фильтруем важные символы
-        text = TextPreprocessing._filter_symbols(text)
-
-        # Токенизируем и лемматизируем
-        tokens = self.lemmatizer(text)
-
-        # Парсинг всего
-        if self.combined_parser is not None:
-            tokens = self.combined_parser(tokens)
-
-        # Убираем цифры
-        if self.delete_digits:
-            tokens = filter(lambda t: not t.isdigit(), tokens)
-
         # Если вопросительные слова и другие частицы не должны быть
         # удалены из запроса, так как отражают его смысл
+        stop_words = self.stop_words
         if self.delete_question_words:
-            stop_words = self.stop_words.union(self.question_words)
-        else:
-            stop_words = self.stop_words
+            stop_words = stop_words.union(self.question_words)
+
+        self._pipeline = _NormalizationPipeline(
+            self.lemmatizer,
+            self.combined_parser,
+            self.delete_digits,
+            stop_words,
+            self.delete_repeatings,
+        )
 
-        # Убираем стоп-слова
-        tokens = filter(lambda t: t not in stop_words, tokens)
+        if self.log:
+            logging.info(self.setup_str)
 
-        # Убираем повторяющиеся слова
-        if self.delete_repeatings:
-            tokens = list(tokens)
-            tokens = [t for n, t in enumerate(tokens) if t not in tokens[:n]]
+    def normalize(self, text, request_id='<NoID>'):
+        """Метод для нормализации текста"""
 
-        normalized_request = ' '.join(tokens)
+        normalized_request = self._pipeline(text)
 
         if self.log:
             logging.info(
@@ -152,6 +200,7 @@ class TextPreprocessing(object):
             self.parse_nums,
             self.parse_time,
             self.parse_obsc,
+            _mc_get("parser_compiled"),
         )
 
     @property
@@ -196,13 +245,23 @@ class TextPreprocessing(object):
     morph = MorphAnalyzer()
 
     @staticmethod
-    @lru_cache(maxsize=16384)
-    def _pymorphy_normal(word: str):
+    def pymorphy_lemma(word: str):
+        """Лемма слова по pymorphy2 без кешей"""
         res = TextPreprocessing.morph.parse(word)[0].normal_form
         if 'ё' in res:
             res = res.replace('ё', 'е')
         return res
 
+    @staticmethod
+    @lru_cache(maxsize=16384)
+    def _pymorphy_normal(word: str):
+        # LRU процесса, за ним общий для процессов словарь лемм,
+        # и только потом pymorphy2
+        res = LemmaDictionary.inst().get(word)
+        if res is None:
+            res = TextPreprocessing.pymorphy_lemma(word)
+        return res
+
     @staticmethod
     def _pymorphy_lem(text: str):
         return list(map(
@@ -210,13 +269,42 @@ class TextPreprocessing(object):
             nlp_utils.advanced_tokenizer(text, False, False)
         ))
 
+    @staticmethod
+    def lemma_cache_stats():
+        """Попадания и промахи LRU процесса и словаря лемм"""
+        lru_info = TextPreprocessing._pymorphy_normal.cache_info()
+        stats = {
+            'lru_hits': lru_info.hits,
+            'lru_misses': lru_info.misses,
+            'lru_size': lru_info.currsize,
+        }
+        for key, value in LemmaDictionary.inst().stats().items():
+            stats['dictionary_{}'.format(key)] = value
+        return stats
+
+    @staticmethod
+    def lemma_dictionary_words(texts):
+        """
+        Слова текстов в том виде, в котором они попадают
+        в лемматизацию, и в нижнем регистре
+        """
+        words = set()
+        for text in texts:
+            if not isinstance(text, str):
+                continue
+            for word in nlp_utils.advanced_tokenizer(text, False, False):
+                words.add(word)
+                words.add(word.lower())
+        return words
+
     @staticmethod
     @lru_cache(maxsize=64)
     def _make_tonita_parser(
             parse_syns,
             parse_nums,
             parse_time,
-            parse_obsc
+            parse_obsc,
+            compiled=False
     ):
         parser = None
         if parse_syns:
@@ -227,22 +315,15 @@ class TextPreprocessing(object):
             parser += time_tp
         if parse_obsc:
             parser += obs_tp
+        # скомпилированный парсер дает тот же результат быстрее
+        if compiled and parser is not None:
+            parser = parser.compile()
         return parser
 
     @staticmethod
     def _filter_symbols(text: str):
         """Обработка символов, несущих смысловую нагрузку"""
-        symbols = {
-            '%': 'процент',
-            '$': 'доллар',
-            '€': 'евро',
-            '£': 'фунт стерлингов',
-            '₽': 'рубль',
-        }
-        for symb, repl in symbols.items():
-            if symb in text:
-                text = text.replace(symb, ' {} '.format(repl))
-        return text
+        return text.translate(_SYMBOLS_TABLE)
 
     @staticmethod
     def frequency_destribution(word_list, quantity):
@@ -15,11 +15,17 @@ from flask import Flask, request, make_response
 from flask_restful import reqparse, abort, Api, Resource
 
 from config import SETTINGS
+from core.answer_cache import AnswerCache
+from core.mdx_server import MdxServer
+from core.solr import Solr
+from dbs.query_db import QueryLogWriter
 from kb.kb_support_library import get_good_queries
 from kb.kb_support_library import read_minfin_data
 from logs_helper import time_with_message
 from messenger_manager import MessengerManager
 from models.responses.text_response_model import TextResponseModel
+from text_preprocessing import TextPreprocessing
+from utils.metrics import MetricsRegistry
 from utils.resource_helper import ResourceHelper
 import logs_helper
 import pandas as pd
@@ -231,6 +237,47 @@ class TextQueryV2(Resource):
         return result
 
 
+class TextQueryBatchV2(Resource):
+    """
+    Обрабатывает пакет текстовых запросов, переданных
+    в теле POST-запроса: {"queries": ["запрос 1", "запрос 2", ...]}
+    """
+
+    @time_with_message("TextQueryBatch API Post", "info", 30)
+    def post(self):
+        args = parser.parse_args()
+
+        if not is_valid_api_key(args["apikey"]):
+            abort(403, message="API key {} is NOT valid".format(
+                args["apikey"]))
+
+        body = request.get_json(silent=True) or {}
+        queries = body.get('queries')
+
+        if not queries or not isinstance(queries, list):
+            abort(400, message='You need "queries" list in request body')
+
+        if not all(isinstance(query, str) and query for query in queries):
+            abort(400, message='All "queries" must be non-empty strings')
+
+        if len(queries) > MAX_BATCH_SIZE:
+            abort(400, message='No more than {} queries per batch'.format(
+                MAX_BATCH_SIZE))
+
+        answers = MessengerManager.make_request_batch(
+            queries,
+            "API v2",
+            args["apikey"],
+            "",
+            [uuid4().hex for _ in queries]
+        )
+
+        return b'[' + b','.join(
+            TextResponseModel.form_answer(answer).toJSON_API()
+            for answer in answers
+        ) + b']'
+
+
 class MinfinListV2(Resource):
     """Возвращает весь список минфин вопросов. Актуально, пока их мало"""
 
@@ -256,6 +303,7 @@ class GoodQueries(Resource):
 app = Flask(__name__)  # pylint: disable=invalid-name
 api = Api(app)  # pylint: disable=invalid-name
 API_VERSION = getattr(SETTINGS.WEB_SERVER, 'VERSION', 'na')
+MAX_BATCH_SIZE = getattr(SETTINGS.WEB_SERVER, 'MAX_BATCH_SIZE', 100)
 
 parser = reqparse.RequestParser()  # pylint: disable=invalid-name
 parser.add_argument('apikey', type=str, required=True, help="You need API key")
@@ -284,10 +332,39 @@ api.add_resource(MinfinList, '/{}/minfin_docs'.format(API_VERSION))
 # Реализуем API v2
 api.add_resource(VoiceQueryV2, '/v2/voice')
 api.add_resource(TextQueryV2, '/v2/text')
+api.add_resource(TextQueryBatchV2, '/v2/text/batch')
 api.add_resource(MinfinListV2, '/v2/minfin_docs')
 api.add_resource(GoodQueries, '/v2/good_queries')
 
 
+# Показатели, которые считаются в самих компонентах
+METRICS = MetricsRegistry.inst()
+METRICS.register_collector(
+    'datatron_solr_seconds', lambda: Solr.inst().latency_stats(), 'histogram', 'core')
+METRICS.register_collector(
+    'datatron_mdx_server_seconds', lambda: MdxServer.inst().latency_stats(), 'histogram')
+METRICS.register_collector(
+    'datatron_mdx_cache', lambda: MdxServer.inst().cache.stats())
+METRICS.register_collector(
+    'datatron_answer_cache', lambda: AnswerCache.inst().stats())
+METRICS.register_collector(
+    'datatron_query_log', lambda: QueryLogWriter.inst().stats())
+METRICS.register_collector(
+    'datatron_lemma_cache', TextPreprocessing.lemma_cache_stats)
+
+
+@app.route('/metrics')
+def metrics():
+    """Метрики в текстовом формате Prometheus"""
+
+    if not METRICS.enabled:
+        abort(404)
+
+    resp = make_response(METRICS.render(), 200)
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return resp
+
+
 @app.route('/')
 def main():
     """Чтобы что-то выводило при GET запросе - простая проверка рабочего состояния серевера"""
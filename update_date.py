@@ -38,6 +38,10 @@ def refresh_cube_update_date():
         MODEL_CONFIG["cube_update_date"] = update_date
 
         MODEL_CONFIG.set_default()
+
+        # кеши сервера сбрасываются сами: кеш MDX-запросов перечитывает
+        # дату из сохраненного файла, а отпечаток кеша ответов зависит
+        # от времени изменения этого файла
         save_default_model(MODEL_CONFIG)
 
         logging.info(
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Кеши с ограничением размера и временем жизни записей:
+в памяти процесса и на диске
+"""
+
+from collections import OrderedDict
+import sqlite3
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Кеш с вытеснением давно не использованных записей (LRU)
+    и временем жизни записей (TTL, None - без ограничения).
+    Потокобезопасен, считает попадания и промахи
+    """
+
+    def __init__(self, maxsize: int, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Значение по ключу или default, если записи нет или она устарела"""
+
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is not None:
+                expires, value = item
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Добавление записи с вытеснением самой старой при переполнении"""
+
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Удаление всех записей"""
+
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов, текущий размер"""
+
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
+
+
+class SQLiteCache:
+    """
+    Дисковый уровень кеша в файле SQLite, общий для нескольких процессов.
+    Записи помечены поколением (например, датой обновления данных)
+    и устаревают по времени; значения - байты.
+    Раз в purge_interval секунд и после каждых max_rows // 10 добавлений
+    устаревшие записи удаляются, а при числе записей больше max_rows
+    вытесняются самые старые (с наименьшим сроком жизни), так что
+    файл не растет неограниченно (None - без ограничения числа записей)
+    """
+
+    def __init__(
+            self, file_path: str, table: str,
+            max_rows: int = 100000, purge_interval: float = 60
+    ):
+        self.table = table
+        self.max_rows = max_rows
+        self.purge_interval = purge_interval
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._purged_at = time.monotonic()
+        self._puts = 0
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS {} ('
+            'key TEXT PRIMARY KEY, generation TEXT, '
+            'expires REAL, content BLOB)'.format(table)
+        )
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS {0}_expires ON {0} (expires)'.format(table)
+        )
+        self._connection.commit()
+        self.purge()
+
+    def get(self, key: str, generation: str):
+        """Значение по ключу для поколения или None"""
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT content FROM {} '
+                'WHERE key = ? AND generation = ? AND expires > ?'.format(self.table),
+                (key, generation, time.time())
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, generation: str, ttl: float, content: bytes):
+        """Сохранение значения"""
+
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)'.format(self.table),
+                (key, generation, time.time() + ttl, content)
+            )
+            self._connection.commit()
+            self._puts += 1
+
+            if (time.monotonic() - self._purged_at >= self.purge_interval or
+                    self.max_rows is not None and
+                    self._puts >= max(self.max_rows // 10, 1)):
+                self._purge()
+
+    def _purge(self):
+        """Удаление устаревших записей и вытеснение самых старых (под блокировкой)"""
+
+        self._connection.execute(
+            'DELETE FROM {} WHERE expires <= ?'.format(self.table), (time.time(),)
+        )
+
+        if self.max_rows is not None:
+            rows = self._connection.execute(
+                'SELECT COUNT(*) FROM {}'.format(self.table)
+            ).fetchone()[0]
+
+            if rows > self.max_rows:
+                self._connection.execute(
+                    'DELETE FROM {0} WHERE key IN ('
+                    'SELECT key FROM {0} ORDER BY expires LIMIT ?)'.format(self.table),
+                    (rows - self.max_rows,)
+                )
+
+        self._connection.commit()
+        self._purged_at = time.monotonic()
+        self._puts = 0
+
+    def purge(self):
+        """Удаление устаревших записей и вытеснение самых старых"""
+
+        with self._lock:
+            self._purge()
+
+    def clear(self):
+        """Удаление всех записей"""
+
+        with self._lock:
+            self._connection.execute('DELETE FROM {}'.format(self.table))
+            self._connection.commit()
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Общие подключения к базам данных SQLite с настройками
+для многопоточного сервера
+"""
+
+from os import path
+from urllib.request import pathname2url
+import threading
+
+from peewee import SqliteDatabase
+
+from config import SETTINGS
+
+
+# Настройки, которые можно переопределить в settings.json (раздел SQLITE)
+SQLITE_SETTINGS = getattr(SETTINGS, 'SQLITE', None)
+
+# размер кеша страниц одного подключения в килобайтах
+CACHE_SIZE_KB = getattr(SQLITE_SETTINGS, 'CACHE_SIZE_KB', 16 * 1024)
+MMAP_SIZE = getattr(SQLITE_SETTINGS, 'MMAP_SIZE', 256 * 1024 * 1024)
+
+# сколько секунд ждать снятия блокировки другим подключением
+BUSY_TIMEOUT = getattr(SQLITE_SETTINGS, 'BUSY_TIMEOUT', 5)
+
+# размер кеша подготовленных выражений одного подключения
+CACHED_STATEMENTS = getattr(SQLITE_SETTINGS, 'CACHED_STATEMENTS', 256)
+
+# Профиль для баз, в которые пишет сервер: WAL позволяет читать
+# во время записи, synchronous=NORMAL в режиме WAL не теряет
+# целостность при сбое процесса
+READ_WRITE_PRAGMAS = (
+    ('journal_mode', 'wal'),
+    ('synchronous', 'normal'),
+    ('cache_size', -CACHE_SIZE_KB),
+    ('mmap_size', MMAP_SIZE),
+    ('temp_store', 'memory'),
+)
+
+# Профиль для баз, которые сервер только читает
+READ_ONLY_PRAGMAS = (
+    ('query_only', 1),
+    ('cache_size', -CACHE_SIZE_KB),
+    ('mmap_size', MMAP_SIZE),
+    ('temp_store', 'memory'),
+)
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def _connect_params(file_path: str, read_only: bool):
+    """Имя базы и параметры подключения для режима работы"""
+
+    params = {
+        'timeout': BUSY_TIMEOUT,
+        'cached_statements': CACHED_STATEMENTS,
+    }
+
+    if read_only:
+        params['uri'] = True
+        params['pragmas'] = READ_ONLY_PRAGMAS
+        name = 'file:{}?mode=ro'.format(pathname2url(path.abspath(file_path)))
+    else:
+        params['pragmas'] = READ_WRITE_PRAGMAS
+        name = file_path
+
+    return name, params
+
+
+def sqlite_database(file_path: str, read_only: bool = False):
+    """
+    Общий для всего процесса объект базы данных для файла.
+    Каждый поток получает собственное подключение (так устроен
+    SqliteDatabase), поэтому потоки сервера не делят одно
+    подключение и не ждут друг друга на чтении. Режим работы
+    задается при первом обращении к файлу, сменить его можно
+    через reopen_database
+    """
+
+    key = path.abspath(file_path)
+
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            name, params = _connect_params(file_path, read_only)
+            database = SqliteDatabase(name, **params)
+            _databases[key] = database
+
+    return database
+
+
+def reopen_database(database: SqliteDatabase, file_path: str, read_only: bool):
+    """
+    Смена режима работы базы данных, например, открытие базы
+    знаний на запись при ее пересоздании. Подключение текущего
+    потока закрывается, новое будет открыто с новыми настройками
+    """
+
+    name, params = _connect_params(file_path, read_only)
+    database.init(name, **params)
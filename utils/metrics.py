@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Легковесные метрики для горячего пути: гистограммы времени исполнения,
+счетчики и их выдача в текстовом формате Prometheus
+"""
+
+from bisect import bisect_left
+import threading
+
+from config import SETTINGS
+
+
+# Настройки, которые можно переопределить в settings.json (раздел METRICS)
+METRICS_SETTINGS = getattr(SETTINGS, 'METRICS', None)
+ENABLED = getattr(METRICS_SETTINGS, 'ENABLED', True)
+
+# Границы корзин по умолчанию в секундах
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+class Histogram:
+    """
+    Гистограмма значений с фиксированными границами корзин.
+    Потокобезопасна, так как сервер работает в несколько потоков
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Добавление наблюдения"""
+
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """
+        Состояние гистограммы в виде словаря с кумулятивными
+        количествами по корзинам: {'buckets': {граница: кол-во}, 'sum', 'count'}
+        """
+
+        with self._lock:
+            counts = list(self._counts)
+            total_sum = self._sum
+            total_count = self._count
+
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            buckets[bound] = cumulative
+
+        return {'buckets': buckets, 'sum': total_sum, 'count': total_count}
+
+
+class Counter:
+    """Потокобезопасный счетчик"""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def increment(self, value=1):
+        """Увеличение счетчика"""
+
+        with self._lock:
+            self._value += value
+
+    @property
+    def value(self):
+        return self._value
+
+
+def _format_labels(labels: tuple, **extra):
+    """Метки в формате Prometheus: {name="value",...}"""
+
+    labels = labels + tuple(extra.items())
+    if not labels:
+        return ''
+
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    ))
+
+
+def _format_bound(bound: float):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик процесса. Гистограммы и счетчики различаются
+    по имени и набору меток и создаются при первом обращении.
+    Показатели, которые уже считаются в других местах (кеши, клиенты
+    серверов), подключаются функциями-сборщиками и опрашиваются только
+    при выдаче метрик. Если метрики выключены, observe и increment
+    сразу возвращаются. Синглтон! Singleton!
+    """
+
+    __instance = None
+
+    @staticmethod
+    def inst():
+        """Реализует Синглтон"""
+        if MetricsRegistry.__instance is None:
+            MetricsRegistry.__instance = MetricsRegistry()
+        return MetricsRegistry.__instance
+
+    def __init__(self, enabled=ENABLED):
+        self.enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _metric(self, metrics: dict, factory, name: str, labels: dict):
+        key = (name, tuple(sorted(labels.items())))
+        metric = metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = metrics.setdefault(key, factory())
+        return metric
+
+    def observe(self, name: str, value: float, **labels):
+        """Наблюдение в гистограмму name с метками labels"""
+
+        if not self.enabled:
+            return
+        self._metric(self._histograms, Histogram, name, labels).observe(value)
+
+    def increment(self, name: str, value=1, **labels):
+        """Увеличение счетчика name с метками labels"""
+
+        if not self.enabled:
+            return
+        self._metric(self._counters, Counter, name, labels).increment(value)
+
+    def register_collector(self, name: str, collect, kind='gauge', label='label'):
+        """
+        Подключение сборщика. Для kind='gauge' collect возвращает словарь
+        {показатель: число}, показатели выдаются с меткой stat.
+        Для kind='histogram' collect возвращает снимок Histogram
+        или словарь {значение метки label: снимок}
+        """
+
+        with self._lock:
+            self._collectors.append((name, collect, kind, label))
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+
+        lines = []
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            collectors = list(self._collectors)
+
+        typed = set()
+
+        def add_type(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        def add_histogram(name, labels, snapshot):
+            add_type(name, 'histogram')
+            for bound, count in sorted(snapshot['buckets'].items()):
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, le=_format_bound(bound)), count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), snapshot['sum']))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), snapshot['count']))
+
+        for (name, labels), histogram in histograms:
+            add_histogram(name, labels, histogram.snapshot())
+
+        for (name, labels), counter in counters:
+            add_type(name, 'counter')
+            lines.append('{}{} {}'.format(name, _format_labels(labels), counter.value))
+
+        for name, collect, kind, label_name in collectors:
+            collected = collect()
+            if kind == 'histogram':
+                if 'buckets' in collected:
+                    collected = {None: collected}
+                for label, snapshot in sorted(collected.items(), key=lambda item: str(item[0])):
+                    labels = () if label is None else ((label_name, label),)
+                    add_histogram(name, labels, snapshot)
+            else:
+                add_type(name, 'gauge')
+                for stat, value in sorted(collected.items()):
+                    if isinstance(value, (int, float)):
+                        lines.append('{}{} {}'.format(
+                            name, _format_labels((('stat', stat),)), value))
+
+        return '\n'.join(lines) + '\n'
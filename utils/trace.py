@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Трассировка обработки запроса: этапы складывают события
+в трассу запроса, которая пишется в лог одной JSON-строкой
+"""
+
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+from utils.metrics import MetricsRegistry
+
+
+class RequestTrace:
+    """
+    События обработки одного запроса. Событие - словарь с названием
+    этапа, временем от начала запроса, длительностью этапа (если
+    замерялась) и произвольными полями. Значения полей не форматируются
+    до записи трассы, а если уровень INFO выключен, то не форматируются
+    вовсе
+    """
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.start = time.monotonic()
+        self.events = []
+
+    def event(self, stage: str, duration: float = None, **fields):
+        """Добавление события этапа"""
+
+        fields['stage'] = stage
+        fields['at'] = time.monotonic() - self.start
+        if duration is not None:
+            fields['duration'] = duration
+            MetricsRegistry.inst().observe(
+                'datatron_stage_seconds', duration, stage=stage)
+        self.events.append(fields)
+
+    @contextmanager
+    def stage(self, stage: str, **fields):
+        """
+        Замер длительности этапа. Поля события можно дополнить
+        внутри блока через возвращаемый словарь
+        """
+
+        start = time.monotonic()
+        try:
+            yield fields
+        finally:
+            self.event(stage, time.monotonic() - start, **fields)
+
+    def to_dict(self):
+        """Трасса в виде словаря для JSON"""
+
+        return {
+            'request_id': self.request_id,
+            'duration': time.monotonic() - self.start,
+            'events': self.events,
+        }
+
+
+class _NoTrace(RequestTrace):
+    """Трасса для вызовов вне обработки запроса: события отбрасываются"""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def event(self, stage: str, duration: float = None, **fields):
+        pass
+
+
+_NO_TRACE = _NoTrace()
+
+_traces = {}
+_traces_lock = threading.Lock()
+
+
+def start_trace(request_id: str):
+    """Начало трассировки запроса"""
+
+    trace = RequestTrace(request_id)
+    with _traces_lock:
+        _traces[request_id] = trace
+    return trace
+
+
+def get_trace(request_id: str):
+    """
+    Трасса запроса. Этапы, исполняемые вне трассируемого запроса
+    (тесты, замеры), получают трассу, которая ничего не сохраняет
+    """
+
+    return _traces.get(request_id, _NO_TRACE)
+
+
+def trace_event(request_id: str, stage: str, duration: float = None, **fields):
+    """Добавление события в трассу запроса"""
+
+    get_trace(request_id).event(stage, duration, **fields)
+
+
+def finish_trace(request_id: str, **fields):
+    """
+    Завершение трассировки и запись трассы в лог одной строкой.
+    Строка начинается с Query_ID, как и остальные логи запроса
+    """
+
+    with _traces_lock:
+        trace = _traces.pop(request_id, None)
+
+    if trace is None:
+        return None
+
+    metrics = MetricsRegistry.inst()
+    metrics.observe('datatron_request_seconds', time.monotonic() - trace.start)
+    metrics.increment('datatron_requests_total')
+
+    if not logging.getLogger().isEnabledFor(logging.INFO):
+        return trace
+
+    trace_dict = trace.to_dict()
+    trace_dict.update(fields)
+
+    logging.info('Query_ID: {}\tTrace: {}'.format(
+        request_id,
+        json.dumps(trace_dict, ensure_ascii=False, default=str)
+    ))
+
+    return trace